@@ -0,0 +1,93 @@
+"""
+Throwaway PostgreSQL server for benchmarks
+
+Creates a fresh cluster with initdb in a temporary directory, starts it on a
+free localhost port with trust authentication and removes it on stop.
+"""
+
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import psycopg2
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def _pg_binary(name: str) -> str:
+    """Find a PostgreSQL server binary on PATH or in the usual Debian location"""
+    found = shutil.which(name)
+    if found:
+        return found
+    versions_dir = "/usr/lib/postgresql"
+    if os.path.isdir(versions_dir):
+        for version in sorted(os.listdir(versions_dir), reverse=True):
+            candidate = os.path.join(versions_dir, version, "bin", name)
+            if os.path.exists(candidate):
+                return candidate
+    raise RuntimeError(f"{name} not found; install PostgreSQL or pass --use-env-db to use an existing server")
+
+
+class LocalPostgres:
+    def __init__(self, dbname: str = "gym", user: str = "bench"):
+        self.dbname = dbname
+        self.user = user
+        self.port = _free_port()
+        self.data_dir = tempfile.mkdtemp(prefix="gymbook-bench-pg-")
+
+    def start(self):
+        subprocess.run(
+            [_pg_binary("initdb"), "-D", self.data_dir, "-U", self.user, "--auth=trust", "-E", "UTF8"],
+            check=True, capture_output=True,
+        )
+        options = f"-p {self.port} -k {self.data_dir} -c listen_addresses=localhost -c fsync=off"
+        subprocess.run(
+            [_pg_binary("pg_ctl"), "-D", self.data_dir, "-o", options,
+             "-l", os.path.join(self.data_dir, "server.log"), "-w", "start"],
+            check=True, capture_output=True,
+        )
+        conn = self._wait_for_server()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'CREATE DATABASE "{self.dbname}"')
+        conn.close()
+        return self
+
+    def _wait_for_server(self, timeout: float = 30.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return psycopg2.connect(dbname="postgres", user=self.user, host="localhost", port=self.port)
+            except psycopg2.OperationalError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+
+    def connect(self):
+        return psycopg2.connect(dbname=self.dbname, user=self.user, host="localhost", port=self.port)
+
+    def env(self) -> dict:
+        """DB_* variables read by config/database.py"""
+        return {
+            "DB_NAME": self.dbname,
+            "DB_USER": self.user,
+            "DB_PASSWORD": "",
+            "DB_HOST": "localhost",
+            "DB_PORT": str(self.port),
+        }
+
+    def stop(self):
+        try:
+            subprocess.run(
+                [_pg_binary("pg_ctl"), "-D", self.data_dir, "-m", "fast", "-w", "stop"],
+                capture_output=True,
+            )
+        finally:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
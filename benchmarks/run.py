@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Load test GymBook against a throwaway local PostgreSQL
+
+Provisions a fresh cluster (or uses the DB_* environment with --use-env-db),
+starts the real FastAPI app under uvicorn, seeds it and drives it with
+concurrent virtual users running a weighted mix of logins, client listings,
+payments, dashboard and report calls. Prints throughput and p50/p95/p99 per
+endpoint, writes the results as JSON and compares them with a baseline.
+
+    python -m benchmarks.run --tenants 5 --members 2000 --users 20 --duration 60
+    python -m benchmarks.run --save-baseline
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import date
+
+import requests
+
+from benchmarks.local_postgres import LocalPostgres, _free_port
+from database_utils import get_db_connection
+from generate_data import generate
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "benchmarks", "baseline.json")
+
+# name -> weight in the request mix
+MIX = {
+    "login": 1,
+    "list_clients": 4,
+    "list_payments": 2,
+    "create_payment": 2,
+    "dashboard_stats": 4,
+    "due_members": 2,
+    "report_revenue": 2,
+    "report_growth": 1,
+    "report_plan_distribution": 1,
+}
+
+
+def _login(session, base_url, tenant):
+    response = session.post(f"{base_url}/login/", json={"email": tenant["email"], "password": tenant["password"]})
+    response.raise_for_status()
+    session.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+    return response
+
+
+def _request(name, session, base_url, tenant):
+    if name == "login":
+        return session.post(f"{base_url}/login/", json={"email": tenant["email"], "password": tenant["password"]})
+    if name == "list_clients":
+        return session.get(f"{base_url}/clients/")
+    if name == "list_payments":
+        return session.get(f"{base_url}/payments/", params={"client_id": random.choice(tenant["client_ids"])})
+    if name == "create_payment":
+        return session.post(f"{base_url}/payments/", json={
+            "client_id": random.choice(tenant["client_ids"]),
+            "amount": 10.0,
+            "paid_at": str(date.today()),
+            "method": "cash",
+        })
+    if name == "dashboard_stats":
+        return session.get(f"{base_url}/dashboard/stats")
+    if name == "due_members":
+        return session.get(f"{base_url}/dashboard/due_members")
+    if name == "report_revenue":
+        return session.get(f"{base_url}/reports/revenue", params={"period": random.choice(["daily", "monthly", "yearly"])})
+    if name == "report_growth":
+        return session.get(f"{base_url}/reports/client-growth")
+    if name == "report_plan_distribution":
+        return session.get(f"{base_url}/reports/plan-distribution")
+    raise ValueError(f"Unknown request type: {name}")
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, base_url, tenant, deadline, results, lock):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.tenant = tenant
+        self.deadline = deadline
+        self.results = results
+        self.lock = lock
+        self.names = list(MIX)
+        self.weights = [MIX[name] for name in self.names]
+
+    def run(self):
+        session = requests.Session()
+        _login(session, self.base_url, self.tenant)
+        samples = []
+        while time.monotonic() < self.deadline:
+            name = random.choices(self.names, self.weights)[0]
+            started = time.perf_counter()
+            try:
+                ok = _request(name, session, self.base_url, self.tenant).status_code < 400
+            except requests.RequestException:
+                ok = False
+            samples.append((name, time.perf_counter() - started, ok))
+        with self.lock:
+            self.results.extend(samples)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, duration):
+    endpoints = {}
+    for name in sorted({sample[0] for sample in samples}):
+        latencies = sorted(seconds for sample_name, seconds, _ in samples if sample_name == name)
+        errors = sum(1 for sample_name, _, ok in samples if sample_name == name and not ok)
+        endpoints[name] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / duration, 2),
+            "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        }
+    return {
+        "total_requests": len(samples),
+        "total_errors": sum(1 for _, _, ok in samples if not ok),
+        "throughput_rps": round(len(samples) / duration, 2),
+        "endpoints": endpoints,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of endpoints whose p95 regressed by more than tolerance"""
+    regressions = []
+    for name, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if previous and previous["p95_ms"] > 0 and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+    return regressions
+
+
+def _start_app(env, port):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "index:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env={**os.environ, **env},
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            requests.get(f"{base_url}/", timeout=1)
+            return server, base_url
+        except requests.RequestException:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.terminate()
+                raise RuntimeError("GymBook server failed to start")
+            time.sleep(0.2)
+
+
+def print_results(results):
+    print(f"\n{'endpoint':<28}{'reqs':>8}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in results["endpoints"].items():
+        print(f"{name:<28}{row['requests']:>8}{row['errors']:>6}{row['throughput_rps']:>9}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+    print(f"\nTotal: {results['total_requests']} requests, {results['total_errors']} errors, "
+          f"{results['throughput_rps']} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GymBook load test")
+    parser.add_argument("--tenants", type=int, default=3)
+    parser.add_argument("--members", type=int, default=1000, help="members per tenant")
+    parser.add_argument("--payments", type=int, default=6, help="average payments per member")
+    parser.add_argument("--leads", type=int, default=200, help="leads per tenant")
+    parser.add_argument("--years", type=float, default=2, help="history covered by the seeded data")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the seeded data")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--use-env-db", action="store_true", help="use the DB_* environment instead of a throwaway server")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 regression, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    postgres = None if args.use_env_db else LocalPostgres().start()
+    server = None
+    try:
+        env = {} if postgres is None else postgres.env()
+        server, base_url = _start_app(env, _free_port())
+
+        print(f"Seeding {args.tenants} tenants x {args.members} members...")
+        conn = get_db_connection()[0] if postgres is None else postgres.connect()
+        if conn is None:
+            raise RuntimeError("Could not connect to the database")
+        try:
+            tenants = generate(conn, args.tenants, args.members, args.payments, args.leads,
+                               args.years, seed=args.seed, verbose=False)
+        finally:
+            conn.close()
+
+        print(f"Running {args.users} virtual users for {args.duration}s against {base_url}")
+        samples, lock = [], threading.Lock()
+        deadline = time.monotonic() + args.duration
+        users = [
+            VirtualUser(base_url, tenants[index % len(tenants)], deadline, samples, lock)
+            for index in range(args.users)
+        ]
+        started = time.monotonic()
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.monotonic() - started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if postgres is not None:
+            postgres.stop()
+
+    results = summarize(samples, elapsed)
+    results["config"] = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "save_baseline")}
+    print_results(results)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nPerformance regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo p95 regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Precompile the JSX frontend into a minified JavaScript bundle
+
+web/scripts/main.jsx is transpiled and minified with esbuild into
+web/build/main.<source hash>.js. The server serves that bundle instead of
+having Babel transpile the JSX in the browser, and builds it itself at
+startup when esbuild is on the PATH (or FRONTEND_ESBUILD points at it).
+Without esbuild, and without a bundle built for the current source, pages
+fall back to in-browser Babel.
+
+Run this as part of a deploy, where esbuild is available:
+    python build_frontend.py
+    python build_frontend.py --esbuild "npx --yes esbuild@0.20.2"
+"""
+
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+from typing import Optional
+
+SOURCE = os.path.join("web", "scripts", "main.jsx")
+BUILD_DIR = os.path.join("web", "build")
+TARGET = "es2018"
+
+logger = logging.getLogger("gymbook.frontend")
+
+_digest = {"mtime": None, "value": None}
+# Source digests whose build failed, not retried until the source changes
+_failed = set()
+
+
+def source_digest() -> str:
+    """Short sha256 of the JSX source, recomputed only when its mtime changes"""
+    mtime = os.path.getmtime(SOURCE)
+    if _digest["mtime"] != mtime:
+        with open(SOURCE, "rb") as f:
+            _digest["value"] = hashlib.sha256(f.read()).hexdigest()[:12]
+        _digest["mtime"] = mtime
+    return _digest["value"]
+
+
+def bundle_path(digest: str) -> str:
+    return os.path.join(BUILD_DIR, f"main.{digest}.js")
+
+
+def esbuild_command() -> Optional[list]:
+    configured = os.getenv('FRONTEND_ESBUILD')
+    if configured:
+        return shlex.split(configured)
+    found = shutil.which("esbuild")
+    return [found] if found else None
+
+
+def build(command: list) -> str:
+    """Transpile and minify the current source, returning the bundle path"""
+    digest = source_digest()
+    path = bundle_path(digest)
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    # Several workers may build at once; each writes its own file and renames it into place
+    partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        subprocess.run(
+            command + [SOURCE, "--loader:.jsx=jsx", "--minify", f"--target={TARGET}", f"--outfile={partial}"],
+            check=True,
+            capture_output=True,
+            timeout=120,
+        )
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    for stale in glob.glob(os.path.join(BUILD_DIR, "main.*.js")):
+        if stale != path:
+            os.remove(stale)
+    return path
+
+
+def bundle() -> Optional[str]:
+    """
+    Path of the bundle for the current source, building it if esbuild is
+    available, or None to fall back to in-browser Babel
+    """
+    digest = source_digest()
+    path = bundle_path(digest)
+    if os.path.exists(path):
+        return path
+    command = esbuild_command()
+    if command is None or digest in _failed:
+        return None
+    try:
+        return build(command)
+    except (OSError, subprocess.SubprocessError) as e:
+        _failed.add(digest)
+        stderr = getattr(e, "stderr", None)
+        logger.warning("Frontend build failed, using in-browser Babel: %s", stderr.decode(errors="replace") if stderr else e)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompile web/scripts/main.jsx with esbuild")
+    parser.add_argument("--esbuild", help='esbuild command, e.g. "npx --yes esbuild" (default: esbuild on the PATH)')
+    args = parser.parse_args()
+
+    command = shlex.split(args.esbuild) if args.esbuild else esbuild_command()
+    if command is None:
+        parser.error("esbuild not found; install it or pass --esbuild")
+    started = time.perf_counter()
+    path = build(command)
+    print(f"Built {path} ({os.path.getsize(path) / 1024:.0f} KiB) in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
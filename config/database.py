@@ -1,17 +1,218 @@
+import logging
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 import psycopg2.errors
+import psycopg2.pool
 
 
-# Database connection
-conn = psycopg2.connect(
-    dbname="gym",
-    user="skvar",
-    password="Root1234",
-    host="localhost",
-    port="5432"
+DB_SETTINGS = {
+    "dbname": os.getenv("DB_NAME", "gym"),
+    "user": os.getenv("DB_USER", "skvar"),
+    "password": os.getenv("DB_PASSWORD", "Root1234"),
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": os.getenv("DB_PORT", "5432"),
+}
+
+
+# Connections handed to authenticated requests, per worker
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Role that request connections switch to, so the row-level security policies
+# apply to them; background workers keep the owner role and see every gym
+TENANT_ROLE = "gymbook_tenant"
+# Set to 1 to start without row-level security when the role or policies
+# cannot be created; requests then rely on their gym_id predicates alone
+ALLOW_NO_RLS = os.getenv("DB_ALLOW_NO_RLS", "0") == "1"
+
+logger = logging.getLogger("gymbook.database")
+
+# Tables whose rows belong to one gym, isolated by the tenant_isolation policy
+TENANT_TABLES = (
+    "plans", "staffs", "leads", "clients", "payments", "client_balance",
+    "attendance", "attendance_hourly", "attendance_member_daily", "member_lists", "outbox",
+    "plan_repricings", "membership_periods", "membership_months", "membership_cohorts",
+    "membership_snapshots", "membership_churn",
 )
-cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+
+class GymbookConnection(psycopg2.extensions.connection):
+    """Connection that remembers the statements prepared on it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def connect():
+    """Open a dedicated connection, for work that must not share the request cursor"""
+    return psycopg2.connect(connection_factory=GymbookConnection, **DB_SETTINGS)
+
+
+# Callables invoked as listener(query, vars, seconds) after every statement
+# run through a TimedCursor, used by the metrics and slow query log
+query_listeners = []
+
+
+class TimedCursor(psycopg2.extras.DictCursor):
+    """DictCursor that reports the duration of each statement to query_listeners"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - started
+            for listener in query_listeners:
+                listener(query, vars, elapsed)
+
+
+class TenantPool:
+    """
+    Connections for requests, running as TENANT_ROLE. app.current_gym is set
+    once per checkout to the comma-separated gym ids of the verified token,
+    which is what the row-level security policies compare gym_id against.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.role = None
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.in_use = 0
+
+    def _open(self):
+        connection = connect()
+        if self.role:
+            with connection.cursor() as c:
+                c.execute(f"SET ROLE {self.role}")
+            connection.commit()
+        return connection
+
+    def checkout(self, gym_ids):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError(f"No database connection free after {self.timeout}s")
+        try:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._open()
+            if connection.closed:
+                connection = self._open()
+            set_gyms(connection, gym_ids)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+        return connection
+
+    def checkin(self, connection):
+        try:
+            if not connection.closed:
+                connection.rollback()
+                self._idle.put(connection)
+        except psycopg2.Error:
+            connection.close()
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def idle(self) -> int:
+        return self._idle.qsize()
+
+
+def set_gyms(connection, gym_ids):
+    """Scope a tenant connection to gym_ids; committed so a later rollback keeps it"""
+    with connection.cursor() as c:
+        c.execute("SELECT set_config('app.current_gym', %s, false)", (",".join(str(int(g)) for g in gym_ids),))
+    connection.commit()
+
+
+class _Lease:
+    """The pooled connection of one request, checked out on first use"""
+
+    def __init__(self, gym_ids):
+        self.gym_ids = list(gym_ids)
+        self.conn = None
+        self.cur = None
+
+    def acquire(self):
+        if self.conn is None:
+            self.conn = pool.checkout(self.gym_ids)
+            self.cur = self.conn.cursor(cursor_factory=TimedCursor)
+        return self.conn
+
+    def release(self):
+        if self.conn is not None:
+            self.cur.close()
+            pool.checkin(self.conn)
+            self.conn = self.cur = None
+
+
+_lease = ContextVar("gymbook_db_lease", default=None)
+
+
+def begin_request(gym_ids):
+    """Bind a lazily checked out tenant connection to the current request"""
+    lease = _Lease(gym_ids)
+    return _lease.set(lease), lease
+
+
+def end_request(token):
+    """Unbind the request's lease; the caller then returns it with lease.release()"""
+    _lease.reset(token)
+
+
+def scope_request(gym_ids):
+    """Widen or narrow the gyms the current request can see, e.g. to all of an owner's gyms"""
+    lease = _lease.get()
+    if lease is None:
+        return
+    lease.gym_ids = list(gym_ids)
+    if lease.conn is not None:
+        set_gyms(lease.conn, lease.gym_ids)
+
+
+class _RequestBound:
+    """
+    Stands in for the module's conn and cur: inside a request it resolves to
+    the request's pooled tenant connection, elsewhere (startup, scripts) to
+    the shared owner connection
+    """
+
+    def __init__(self, kind):
+        self._kind = kind
+
+    def _target(self):
+        lease = _lease.get()
+        if lease is None:
+            return _shared_conn if self._kind == "conn" else _shared_cur
+        lease.acquire()
+        return lease.conn if self._kind == "conn" else lease.cur
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __iter__(self):
+        return iter(self._target())
+
+
+# Database connection
+_shared_conn = connect()
+_shared_cur = _shared_conn.cursor(cursor_factory=TimedCursor)
+conn = _RequestBound("conn")
+cur = _RequestBound("cur")
+pool = TenantPool()
 
 # Ensure the tables exist in the correct order (referenced tables first)
 
@@ -94,17 +295,6 @@ CREATE TABLE IF NOT EXISTS payments (
 );
 """)
 
-# Create client_balance table (references clients table)
-cur.execute("""
--- Keeps running balance (optional but helpful for quick lookup)
-CREATE TABLE IF NOT EXISTS client_balance (
-    client_id INT PRIMARY KEY REFERENCES clients(id) ON DELETE CASCADE,
-    gym_id INT REFERENCES gyms(id) ON DELETE CASCADE,
-    total_paid NUMERIC(10,2) DEFAULT 0,
-    total_due NUMERIC(10,2) DEFAULT 0,
-    last_payment DATE
-);
-""")
 # Create gyms table
 cur.execute("""
     CREATE TABLE IF NOT EXISTS gyms (
@@ -132,6 +322,17 @@ cur.execute("""
     );
 """)
 
+# Create client_balance table (references clients table)
+cur.execute("""
+-- Keeps running balance (optional but helpful for quick lookup)
+CREATE TABLE IF NOT EXISTS client_balance (
+    client_id INT PRIMARY KEY REFERENCES clients(id) ON DELETE CASCADE,
+    gym_id INT REFERENCES gyms(id) ON DELETE CASCADE,
+    total_paid NUMERIC(10,2) DEFAULT 0,
+    total_due NUMERIC(10,2) DEFAULT 0,
+    last_payment DATE
+);
+""")
 # Add gym_id column to existing tables that need to be associated with a gym
 
 # Add gym_id to plans table
@@ -169,9 +370,389 @@ except psycopg2.errors.DuplicateColumn:
     conn.rollback()  # Rollback the failed ALTER TABLE command
     pass  # Column already exists, continue
 
+# Indexes backing the date range reports
+cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_gym_paid_at ON payments (gym_id, paid_at);")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_gym_created_at ON clients (gym_id, created_at);")
+
+# Append-only log of member check-ins, written in batches by services/attendance
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS attendance (
+        id BIGSERIAL PRIMARY KEY,
+        gym_id INT NOT NULL REFERENCES gyms(id) ON DELETE CASCADE,
+        client_id INT NOT NULL,
+        checked_in_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        allowed BOOLEAN NOT NULL,
+        reason VARCHAR(32),
+        device VARCHAR(64)
+    );
+""")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_attendance_gym_time ON attendance (gym_id, checked_in_at);")
+
+# Check-ins that could not be written even on their own (e.g. for a deleted
+# gym), set aside by services/attendance so they stop blocking newer scans.
+# No foreign keys or length limits, so any rejected row fits.
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS attendance_dead_letters (
+        id BIGSERIAL PRIMARY KEY,
+        gym_id INT,
+        client_id INT,
+        checked_in_at TIMESTAMP WITH TIME ZONE,
+        allowed BOOLEAN,
+        reason TEXT,
+        device TEXT,
+        error TEXT,
+        failed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+""")
+
+# Attendance rollups, upserted in the same transaction as each check-in batch.
+# hour is the gym's local wall-clock hour.
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS attendance_hourly (
+        gym_id INT NOT NULL REFERENCES gyms(id) ON DELETE CASCADE,
+        hour TIMESTAMP NOT NULL,
+        visits INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (gym_id, hour)
+    );
+""")
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS attendance_member_daily (
+        gym_id INT NOT NULL REFERENCES gyms(id) ON DELETE CASCADE,
+        client_id INT NOT NULL,
+        day DATE NOT NULL,
+        visits INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (gym_id, client_id, day)
+    );
+""")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_attendance_member_daily_day ON attendance_member_daily (gym_id, day);")
+
+# Persisted state of the background jobs in services/scheduler; gym_id 0 for
+# jobs that are not per gym
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS job_runs (
+        job VARCHAR(64) NOT NULL,
+        gym_id INT NOT NULL DEFAULT 0,
+        run_on DATE NOT NULL,
+        status VARCHAR(16) NOT NULL,
+        attempts INT NOT NULL DEFAULT 0,
+        started_at TIMESTAMP WITH TIME ZONE,
+        finished_at TIMESTAMP WITH TIME ZONE,
+        error TEXT,
+        PRIMARY KEY (job, gym_id, run_on)
+    );
+""")
+
+# Daily precomputed member lists (expiring, expired, birthday)
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS member_lists (
+        gym_id INT NOT NULL REFERENCES gyms(id) ON DELETE CASCADE,
+        list_date DATE NOT NULL,
+        kind VARCHAR(16) NOT NULL,
+        client_id INT NOT NULL,
+        PRIMARY KEY (gym_id, list_date, kind, client_id)
+    );
+""")
+
+# Outbound SMS/email, written in the same transaction as the change that
+# triggers it and delivered by services/notifications
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id BIGSERIAL PRIMARY KEY,
+        gym_id INT NOT NULL REFERENCES gyms(id) ON DELETE CASCADE,
+        client_id INT,
+        event VARCHAR(32) NOT NULL,
+        channel VARCHAR(8) NOT NULL,
+        recipient VARCHAR(100) NOT NULL,
+        subject TEXT,
+        body TEXT NOT NULL,
+        dedupe_key VARCHAR(100) UNIQUE,
+        status VARCHAR(16) NOT NULL DEFAULT 'pending',
+        attempts INT NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        last_error TEXT,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP WITH TIME ZONE
+    );
+""")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (next_attempt_at) WHERE status = 'pending';")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_outbox_gym ON outbox (gym_id, id);")
+
+# Lead pipeline: stage, and the client a converted lead became
+cur.execute("ALTER TABLE leads ADD COLUMN IF NOT EXISTS stage VARCHAR(16) NOT NULL DEFAULT 'new';")
+cur.execute("ALTER TABLE leads ADD COLUMN IF NOT EXISTS client_id INT REFERENCES clients(id) ON DELETE SET NULL;")
+cur.execute("ALTER TABLE leads ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;")
+# Newest first paging, overall and per stage
+cur.execute("CREATE INDEX IF NOT EXISTS idx_leads_gym_created ON leads (gym_id, created_at DESC, id DESC);")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_leads_gym_stage_created ON leads (gym_id, stage, created_at DESC, id DESC);")
+
+# Background repricing of a plan's members, run in chunks by services/repricing
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS plan_repricings (
+        id BIGSERIAL PRIMARY KEY,
+        gym_id INT NOT NULL REFERENCES gyms(id) ON DELETE CASCADE,
+        plan_id INT NOT NULL REFERENCES plans(id) ON DELETE CASCADE,
+        scope VARCHAR(8) NOT NULL,
+        status VARCHAR(16) NOT NULL DEFAULT 'pending',
+        total INT,
+        processed INT NOT NULL DEFAULT 0,
+        last_client_id INT NOT NULL DEFAULT 0,
+        attempts INT NOT NULL DEFAULT 0,
+        locked_until TIMESTAMP WITH TIME ZONE,
+        error TEXT,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP WITH TIME ZONE,
+        finished_at TIMESTAMP WITH TIME ZONE
+    );
+""")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_plan_repricings_open ON plan_repricings (id) WHERE status IN ('pending', 'running');")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_gym_plan ON clients (gym_id, plan_id, id);")
+# Members by end date, for the renewal schedule of the revenue forecast
+cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_gym_end_date ON clients (gym_id, end_date);")
+# Members owing money by due date, for the receivables aging report, and each
+# member's latest payment
+cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_gym_due ON clients (gym_id, start_date, id) WHERE balance_due > 0;")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_client_paid_at ON payments (client_id, paid_at);")
+
+# Append-only membership history: one row per period a member joined, renewed
+# or extended for, written in the same transaction as the change to clients.
+# No foreign key to clients, so the history of deleted members still counts.
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS membership_periods (
+        id BIGSERIAL PRIMARY KEY,
+        gym_id INT NOT NULL REFERENCES gyms(id) ON DELETE CASCADE,
+        client_id INT NOT NULL,
+        plan_id INT,
+        kind VARCHAR(16) NOT NULL,
+        start_date DATE NOT NULL,
+        end_date DATE NOT NULL,
+        amount NUMERIC(10,2) NOT NULL DEFAULT 0,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+""")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_membership_periods_client ON membership_periods (gym_id, client_id, start_date);")
+
+# Retention rollups, kept up to date by a statement trigger on membership_periods.
+# membership_months holds each month a member was active in, with the month of
+# their first period (their cohort); membership_cohorts counts those per
+# cohort and month, so cohort charts never read the raw history.
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS membership_months (
+        gym_id INT NOT NULL REFERENCES gyms(id) ON DELETE CASCADE,
+        client_id INT NOT NULL,
+        month DATE NOT NULL,
+        cohort_month DATE NOT NULL,
+        PRIMARY KEY (gym_id, client_id, month)
+    );
+""")
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS membership_cohorts (
+        gym_id INT NOT NULL REFERENCES gyms(id) ON DELETE CASCADE,
+        cohort_month DATE NOT NULL,
+        month DATE NOT NULL,
+        members INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (gym_id, cohort_month, month)
+    );
+""")
+cur.execute("""
+    CREATE OR REPLACE FUNCTION gymbook_membership_rollup() RETURNS trigger AS $$
+    BEGIN
+        WITH covered AS (
+            SELECT DISTINCT n.gym_id, n.client_id, m::date AS month
+            FROM new_periods n,
+                 generate_series(date_trunc('month', n.start_date), date_trunc('month', n.end_date), INTERVAL '1 month') m
+            WHERE n.end_date >= n.start_date
+        ),
+        cohorts AS (
+            SELECT gym_id, client_id,
+                   COALESCE(
+                       (SELECT mm.cohort_month FROM membership_months mm
+                        WHERE mm.gym_id = covered.gym_id AND mm.client_id = covered.client_id LIMIT 1),
+                       MIN(month)
+                   ) AS cohort_month
+            FROM covered
+            GROUP BY gym_id, client_id
+        ),
+        added AS (
+            INSERT INTO membership_months (gym_id, client_id, month, cohort_month)
+            SELECT c.gym_id, c.client_id, c.month, h.cohort_month
+            FROM covered c
+            JOIN cohorts h ON h.gym_id = c.gym_id AND h.client_id = c.client_id
+            WHERE c.month >= h.cohort_month
+            ON CONFLICT DO NOTHING
+            RETURNING gym_id, month, cohort_month
+        )
+        INSERT INTO membership_cohorts (gym_id, cohort_month, month, members)
+        SELECT gym_id, cohort_month, month, COUNT(*)
+        FROM added
+        GROUP BY gym_id, cohort_month, month
+        ON CONFLICT (gym_id, cohort_month, month)
+        DO UPDATE SET members = membership_cohorts.members + EXCLUDED.members;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+""")
+cur.execute("DROP TRIGGER IF EXISTS membership_periods_rollup ON membership_periods;")
+cur.execute("""
+    CREATE TRIGGER membership_periods_rollup
+    AFTER INSERT ON membership_periods
+    REFERENCING NEW TABLE AS new_periods
+    FOR EACH STATEMENT EXECUTE PROCEDURE gymbook_membership_rollup();
+""")
+# Nightly per-gym counts of active, joined, returning and lapsed members, built
+# from membership_periods by services/memberships, and their monthly totals
+cur.execute("CREATE INDEX IF NOT EXISTS idx_membership_periods_end ON membership_periods (gym_id, end_date);")
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS membership_snapshots (
+        gym_id INT NOT NULL REFERENCES gyms(id) ON DELETE CASCADE,
+        snapshot_date DATE NOT NULL,
+        active INT NOT NULL,
+        joined INT NOT NULL,
+        returned INT NOT NULL,
+        lapsed INT NOT NULL,
+        PRIMARY KEY (gym_id, snapshot_date)
+    );
+""")
+cur.execute("""
+    CREATE TABLE IF NOT EXISTS membership_churn (
+        gym_id INT NOT NULL REFERENCES gyms(id) ON DELETE CASCADE,
+        month DATE NOT NULL,
+        opening INT NOT NULL,
+        joined INT NOT NULL DEFAULT 0,
+        returned INT NOT NULL DEFAULT 0,
+        lapsed INT NOT NULL DEFAULT 0,
+        closing INT NOT NULL,
+        PRIMARY KEY (gym_id, month)
+    );
+""")
+
+# Members from before the history existed start with their current period
+cur.execute("""
+    INSERT INTO membership_periods (gym_id, client_id, plan_id, kind, start_date, end_date, amount, created_at)
+    SELECT c.gym_id, c.id, c.plan_id, 'join', c.start_date, c.end_date,
+           COALESCE(c.total_paid, 0) + COALESCE(c.balance_due, 0), c.created_at
+    FROM clients c
+    WHERE c.gym_id IS NOT NULL AND c.start_date IS NOT NULL AND c.end_date IS NOT NULL
+      AND NOT EXISTS (
+          SELECT 1 FROM membership_periods mp WHERE mp.gym_id = c.gym_id AND mp.client_id = c.id
+      );
+""")
+
+# Token buckets of the shared rate limiter backend in services/rate_limit.
+# Unlogged: losing them in a crash only refills every bucket.
+cur.execute("""
+    CREATE UNLOGGED TABLE IF NOT EXISTS rate_limits (
+        key VARCHAR(64) PRIMARY KEY,
+        tokens DOUBLE PRECISION NOT NULL,
+        updated_at TIMESTAMP WITH TIME ZONE NOT NULL
+    );
+""")
+
+# NOTIFY gymbook_changes with "table:gym_id" on every change to clients,
+# payments, leads, plans and membership_churn, for the live dashboard streams
+# and the report cache invalidation in services/live.
+# Postgres delivers on commit and folds duplicates within a transaction.
+cur.execute("""
+    CREATE OR REPLACE FUNCTION gymbook_notify_change() RETURNS trigger AS $$
+    DECLARE
+        changed_gym INT;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            changed_gym := OLD.gym_id;
+        ELSE
+            changed_gym := NEW.gym_id;
+        END IF;
+        IF changed_gym IS NOT NULL THEN
+            PERFORM pg_notify('gymbook_changes', TG_TABLE_NAME || ':' || changed_gym);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+""")
+for table in ("clients", "payments", "leads", "plans", "membership_churn"):
+    cur.execute(f"DROP TRIGGER IF EXISTS {table}_notify_change ON {table};")
+    cur.execute(f"""
+        CREATE TRIGGER {table}_notify_change
+        AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE PROCEDURE gymbook_notify_change();
+    """)
+
+conn.commit()
+
+# One lead per phone number and gym. Databases that already hold duplicates
+# skip the index until they are merged; creating leads still checks first.
+try:
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_leads_gym_phone ON leads (gym_id, phonenumber);")
+    conn.commit()
+except psycopg2.errors.UniqueViolation:
+    conn.rollback()
+    print("Duplicate lead phone numbers found, idx_leads_gym_phone not created")
+
+# Row-level security: request connections run as TENANT_ROLE and only see rows
+# of the gyms in app.current_gym. The owner role used by startup and the
+# background workers is not subject to the policies.
+try:
+    cur.execute(f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = '{TENANT_ROLE}') THEN
+                CREATE ROLE {TENANT_ROLE} NOLOGIN;
+            END IF;
+        END
+        $$;
+    """)
+    cur.execute("SELECT pg_has_role(CURRENT_USER, %s, 'MEMBER')", (TENANT_ROLE,))
+    if not cur.fetchone()[0]:
+        cur.execute(f"GRANT {TENANT_ROLE} TO CURRENT_USER;")
+    cur.execute(f"GRANT USAGE ON SCHEMA public TO {TENANT_ROLE};")
+    cur.execute(f"GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA public TO {TENANT_ROLE};")
+    cur.execute(f"GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA public TO {TENANT_ROLE};")
+    cur.execute("SELECT tablename FROM pg_policies WHERE policyname = 'tenant_isolation'")
+    with_policy = {row[0] for row in cur.fetchall()}
+    for table in TENANT_TABLES:
+        if table in with_policy:
+            continue
+        cur.execute(f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY;")
+        cur.execute(f"""
+            CREATE POLICY tenant_isolation ON {table} TO {TENANT_ROLE}
+            USING (gym_id = ANY (string_to_array(current_setting('app.current_gym', true), ',')::int[]))
+            WITH CHECK (gym_id = ANY (string_to_array(current_setting('app.current_gym', true), ',')::int[]));
+        """)
+    conn.commit()
+    pool.role = TENANT_ROLE
+except psycopg2.Error as e:
+    conn.rollback()
+    if not ALLOW_NO_RLS:
+        logger.critical(f"Row-level security could not be enabled: {e}. "
+                        "Grant CREATEROLE, or set DB_ALLOW_NO_RLS=1 to start without it.")
+        raise
+    # Opted out: requests keep the owner role and rely on their gym_id predicates
+    logger.warning(f"Row-level security not enabled (DB_ALLOW_NO_RLS=1): {e}")
+
 conn.commit()
 
 
+# name -> (sql, param types) of the statements run through execute_prepared,
+# so the slow query log can explain an EXECUTE on its own connection
+prepared_statements = {}
+
+
+def execute_prepared(name, sql, param_types, params):
+    """
+    Execute a query as a server-side prepared statement on the request cursor
+
+    The statement is prepared on first use of each connection and reused
+    afterwards, so Postgres plans it once per connection instead of on every
+    request. sql uses $1..$n placeholders matching param_types.
+    """
+    prepared_statements[name] = (sql, tuple(param_types))
+    prepared = conn.prepared
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} ({', '.join(param_types)}) AS {sql}")
+        prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders})", params)
+
+
 def initialize_multitenant_for_existing_users():
     """
     Initialize multitenant architecture for existing users by:
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+High-volume synthetic data generator for capacity planning
+
+Writes gyms, owner logins, plans, members, membership history, payments and
+leads straight into the schema with COPY, one gym at a time. Distributions are meant to look like
+a real gym: ages clustered around the early thirties, plan durations from a
+configurable mix, renewal chains ending around today (some lapsed, some with
+part of the current period unpaid) and weighted payment methods.
+
+Example (about 10M payments):
+    python generate_data.py --gyms 200 --members 5000 --payments 10 --years 5
+"""
+
+import argparse
+import hashlib
+import io
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from database_utils import get_db_connection, close_db_connection
+
+# plan type -> (days, amount)
+PLAN_TYPES = {
+    "monthly": (30, 50.0),
+    "quarterly": (90, 135.0),
+    "half-yearly": (180, 250.0),
+    "annual": (365, 480.0),
+}
+DEFAULT_PLAN_MIX = {"monthly": 50, "quarterly": 25, "half-yearly": 10, "annual": 15}
+
+METHODS = (("Cash", 40), ("Credit Card", 20), ("Debit Card", 25), ("Bank Transfer", 15))
+GENDERS = (("male", 55), ("female", 43), ("other", 2))
+BLOOD_GROUPS = (
+    ("O+", 37), ("A+", 28), ("B+", 20), ("AB+", 5),
+    ("O-", 5), ("A-", 3), ("B-", 1.5), ("AB-", 0.5),
+)
+FIRST_NAMES = (
+    "Aarav", "Vivaan", "Aditya", "Arjun", "Sai", "Rohan", "Ishaan", "Kabir", "Ananya", "Diya",
+    "Priya", "Sneha", "Kavya", "Meera", "Riya", "John", "Maria", "David", "Sarah", "Ahmed",
+)
+LAST_NAMES = (
+    "Sharma", "Verma", "Iyer", "Reddy", "Nair", "Patel", "Gupta", "Singh", "Khan", "Das",
+    "Rao", "Mehta", "Joshi", "Smith", "Garcia", "Fernandes", "Kapoor", "Menon", "Bose", "Pillai",
+)
+LEAD_NOTES = ("Walk-in enquiry", "Instagram campaign", "Referred by member", "Website form", None)
+
+OWNER_PASSWORD = "gymbook"
+
+
+class _Picker:
+    """Weighted random choice with precomputed cumulative weights"""
+
+    def __init__(self, rng, weighted):
+        self.rng = rng
+        self.values = [value for value, _ in weighted]
+        self.cum_weights = []
+        total = 0
+        for _, weight in weighted:
+            total += weight
+            self.cum_weights.append(total)
+
+    def __call__(self):
+        return self.rng.choices(self.values, cum_weights=self.cum_weights)[0]
+
+
+def _copy(cur, table, columns, buffer):
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer, size=1 << 20)
+
+
+def _text(value) -> str:
+    # Generated values never contain tabs, newlines or backslashes, so the
+    # COPY text format only needs NULL handling
+    return "\\N" if value is None else str(value)
+
+
+def _reserve_ids(cur, table, count) -> int:
+    """Advance a SERIAL sequence by count and return the first reserved id"""
+    cur.execute(f"SELECT nextval(pg_get_serial_sequence('{table}', 'id'))")
+    first_id = cur.fetchone()[0]
+    cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), %s)", (first_id + count - 1,))
+    return first_id
+
+
+def _create_gym(cur, plan_mix):
+    cur.execute("INSERT INTO gyms (name, description) VALUES ('Synthetic Gym', 'Generated data') RETURNING id")
+    gym_id = cur.fetchone()[0]
+    cur.execute("UPDATE gyms SET name = %s WHERE id = %s", (f"Synthetic Gym {gym_id}", gym_id))
+
+    email = f"owner{gym_id}@gymbook.test"
+    cur.execute("""
+        INSERT INTO loggingcredentials (username, email, password)
+        VALUES (%s, %s, %s)
+        RETURNING id
+    """, (f"owner{gym_id}", email, hashlib.sha256(OWNER_PASSWORD.encode()).hexdigest()))
+    user_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO user_gyms (user_id, gym_id, role, is_owner)
+        VALUES (%s, %s, 'admin', TRUE)
+    """, (user_id, gym_id))
+
+    plans = []
+    for plan_type, weight in plan_mix.items():
+        days, amount = PLAN_TYPES[plan_type]
+        cur.execute(
+            "INSERT INTO plans (planname, days, amount, gym_id) VALUES (%s, %s, %s, %s) RETURNING id",
+            (f"{plan_type.title()} #{gym_id}", days, amount, gym_id),
+        )
+        plans.append(((cur.fetchone()[0], days, amount), weight))
+    return gym_id, email, plans
+
+
+def _generate_gym(cur, rng, gym_id, plans, members, payments, leads, years, today):
+    pick_plan = _Picker(rng, plans)
+    pick_method = _Picker(rng, METHODS)
+    pick_gender = _Picker(rng, GENDERS)
+    pick_blood_group = _Picker(rng, BLOOD_GROUPS)
+    window_start = today - timedelta(days=int(365 * years))
+
+    first_id = _reserve_ids(cur, "clients", members)
+    clients = io.StringIO()
+    payment_rows = io.StringIO()
+    period_rows = io.StringIO()
+    payment_count = 0
+
+    for client_id in range(first_id, first_id + members):
+        plan_id, days, amount = pick_plan()
+
+        # Renewal chain ending somewhere between five months ago and two months ahead
+        periods = max(1, round(rng.gauss(payments, payments * 0.3)))
+        last_end = today + timedelta(days=rng.randint(-150, 60))
+        if (last_end - window_start).days < periods * days:
+            periods = max(1, (last_end - window_start).days // days)
+        first_start = last_end - timedelta(days=periods * days)
+        current_start = last_end - timedelta(days=days)
+
+        current_paid = 0.0
+        for period in range(periods):
+            period_start = first_start + timedelta(days=period * days)
+            kind = "join" if period == 0 else "renewal"
+            period_rows.write(f"{gym_id}\t{client_id}\t{plan_id}\t{kind}\t{period_start}\t{period_start + timedelta(days=days)}\t{amount}\n")
+            paid = amount
+            if period == periods - 1:
+                roll = rng.random()
+                if roll < 0.05:
+                    continue  # current period not paid at all
+                if roll < 0.20:
+                    paid = round(amount * rng.choice((0.25, 0.5, 0.75)), 2)
+                current_paid = paid
+            paid_at = datetime.combine(
+                period_start + timedelta(days=min(int(rng.expovariate(0.7)), days - 1)),
+                datetime.min.time(),
+            ) + timedelta(hours=rng.randint(6, 21), minutes=rng.randint(0, 59))
+            payment_rows.write(f"{client_id}\t{paid}\t{paid_at}\t\\N\t{pick_method()}\t{gym_id}\n")
+            payment_count += 1
+
+        age = min(75, max(15, rng.gauss(33, 11)))
+        date_of_birth = today - timedelta(days=int(age * 365.25) + rng.randint(0, 364))
+        gender = pick_gender()
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        height = round(rng.gauss(165 if gender == "female" else 175, 8), 1)
+        weight = round(rng.gauss(62 if gender == "female" else 76, 11), 1)
+        created_at = datetime.combine(first_start, datetime.min.time()) + timedelta(hours=rng.randint(6, 21))
+        clients.write("\t".join(_text(value) for value in (
+            client_id,
+            f"{first_name} {last_name} #{client_id}",
+            9000000000 + client_id,
+            date_of_birth,
+            gender,
+            pick_blood_group(),
+            f"{rng.randint(1, 300)} Generated Street",
+            None,
+            f"{first_name}.{last_name}.{client_id}@example.com".lower(),
+            height,
+            weight,
+            plan_id,
+            current_start,
+            last_end,
+            created_at,
+            current_paid,
+            round(amount - current_paid, 2),
+            gym_id,
+        )) + "\n")
+
+    _copy(cur, "clients", (
+        "id", "clientname", "phonenumber", "dateofbirth", "gender", "bloodgroup", "address",
+        "notes", "email", "height", "weight", "plan_id", "start_date", "end_date",
+        "created_at", "total_paid", "balance_due", "gym_id",
+    ), clients)
+    _copy(cur, "payments", ("client_id", "amount", "paid_at", "note", "method", "gym_id"), payment_rows)
+    # One statement, so the retention rollup trigger runs once for the gym
+    _copy(cur, "membership_periods", ("gym_id", "client_id", "plan_id", "kind", "start_date", "end_date", "amount"), period_rows)
+
+    lead_rows = io.StringIO()
+    for index in range(leads):
+        created_at = datetime.combine(
+            window_start + timedelta(days=rng.randint(0, (today - window_start).days)),
+            datetime.min.time(),
+        ) + timedelta(hours=rng.randint(6, 21))
+        lead_rows.write("\t".join(_text(value) for value in (
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            8000000000 + gym_id * 100000 + index,
+            rng.choice(LEAD_NOTES),
+            created_at,
+            gym_id,
+        )) + "\n")
+    _copy(cur, "leads", ("name", "phonenumber", "notes", "created_at", "gym_id"), lead_rows)
+
+    return list(range(first_id, first_id + members)), payment_count
+
+
+def generate(conn, gyms, members, payments, leads, years, plan_mix=None, seed=None, verbose=True):
+    """
+    Generate gyms of synthetic data and return one dict per gym with the
+    owner's login, the gym id and its member ids
+    """
+    rng = random.Random(seed)
+    plan_mix = plan_mix or DEFAULT_PLAN_MIX
+    today = date.today()
+    tenants = []
+    total_payments = 0
+    started = time.monotonic()
+
+    cur = conn.cursor()
+    for index in range(gyms):
+        gym_id, email, plans = _create_gym(cur, plan_mix)
+        client_ids, payment_count = _generate_gym(cur, rng, gym_id, plans, members, payments, leads, years, today)
+        conn.commit()
+        total_payments += payment_count
+        tenants.append({"email": email, "password": OWNER_PASSWORD, "gym_id": gym_id, "client_ids": client_ids})
+        if verbose:
+            elapsed = time.monotonic() - started
+            print(f"Gym {index + 1}/{gyms} (id {gym_id}): {members} members, "
+                  f"{payment_count} payments, {total_payments / max(elapsed, 1e-9):,.0f} payments/s")
+
+    cur.execute("ANALYZE clients")
+    cur.execute("ANALYZE payments")
+    cur.execute("ANALYZE leads")
+    cur.execute("ANALYZE membership_periods")
+    conn.commit()
+    cur.close()
+    return tenants
+
+
+def parse_plan_mix(value: str) -> dict:
+    """Parse 'monthly=50,annual=20' into {plan type: weight}"""
+    mix = {}
+    for part in value.split(","):
+        plan_type, _, weight = part.partition("=")
+        plan_type = plan_type.strip()
+        if plan_type not in PLAN_TYPES:
+            raise argparse.ArgumentTypeError(f"Unknown plan type '{plan_type}', expected one of {', '.join(PLAN_TYPES)}")
+        mix[plan_type] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic GymBook data with COPY")
+    parser.add_argument("--gyms", type=int, default=10)
+    parser.add_argument("--members", type=int, default=1000, help="members per gym")
+    parser.add_argument("--payments", type=int, default=8, help="average payments per member")
+    parser.add_argument("--leads", type=int, default=200, help="leads per gym")
+    parser.add_argument("--years", type=float, default=3, help="how far back the history reaches")
+    parser.add_argument("--plan-mix", type=parse_plan_mix, default=DEFAULT_PLAN_MIX,
+                        help="weights per plan type, e.g. monthly=50,quarterly=25,annual=25")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for reproducible data")
+    args = parser.parse_args()
+
+    conn, cur = get_db_connection()
+    if not conn:
+        return
+    try:
+        tenants = generate(conn, args.gyms, args.members, args.payments, args.leads, args.years,
+                           plan_mix=args.plan_mix, seed=args.seed)
+        print(f"\n✅ Generated {len(tenants)} gyms. Owner logins: owner<gym id>@gymbook.test / {OWNER_PASSWORD}")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Data generation failed: {e}")
+        raise
+    finally:
+        close_db_connection(conn, cur)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
 from config import database  # Import database connection
+from services.metrics import MetricsMiddleware
+from services.tenancy import TenantMiddleware
+from services.rate_limit import RateLimitMiddleware
+from services.compression import CompressionMiddleware
+from services import assets
 from datetime import datetime, timedelta
 from typing import Optional
 import hashlib
@@ -13,10 +18,18 @@ import jwt
 
 app = FastAPI()
 
+# JWT Configuration
+SECRET_KEY = "your-secret-key-here-change-in-production"
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
 # Serve static files
 app.mount("/styles", StaticFiles(directory="web/styles"), name="styles")
 app.mount("/scripts", StaticFiles(directory="web/scripts"), name="scripts")
 
+# Token buckets and concurrency caps per gym and user; 429 with Retry-After
+app.add_middleware(RateLimitMiddleware, secret_key=SECRET_KEY, algorithm=ALGORITHM)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -26,10 +39,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# JWT Configuration
-SECRET_KEY = "your-secret-key-here-change-in-production"
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# gzip/brotli for API responses of at least COMPRESS_MIN_BYTES
+app.add_middleware(CompressionMiddleware)
+
+# Request, error and database timings per route, scraped from /metrics
+app.add_middleware(MetricsMiddleware)
+
+# One pooled connection per request, scoped to the token's gym by row-level security
+app.add_middleware(TenantMiddleware, secret_key=SECRET_KEY, algorithm=ALGORITHM)
 
 # Security
 security = HTTPBearer()
@@ -256,7 +273,7 @@ def get_current_user_info(current_user: dict = Depends(get_current_user)):
 
 
 # Import routes after all functions are defined
-from routes import clients, plans, staffs, leads, dashboard, payments, reports, gym
+from routes import clients, plans, staffs, leads, dashboard, payments, reports, gym, exports, metrics, checkins, attendance_reports, notifications
 
 # Include routers
 app.include_router(clients.router)
@@ -267,8 +284,31 @@ app.include_router(dashboard.router)
 app.include_router(payments.router)
 app.include_router(reports.router)
 app.include_router(gym.router)
+app.include_router(exports.router)
+app.include_router(metrics.router)
+app.include_router(checkins.router)
+app.include_router(attendance_reports.router)
+app.include_router(notifications.router)
+
+@app.on_event("startup")
+def build_static_assets():
+    assets.store.refresh()
+
 
-# Serve the main index.html file
+# Serve the main index.html file, pointing at the hashed static assets
 @app.get("/")
-async def read_index():
-    return FileResponse('web/index.html')
\ No newline at end of file
+def read_index():
+    return HTMLResponse(assets.store.index_html(), headers={"Cache-Control": "no-cache"})
+
+
+# Content-hashed, precompressed styles and scripts
+@app.get("/static/{path:path}")
+def read_static(path: str, request: Request):
+    response = assets.store.response(
+        path,
+        request.headers.get("accept-encoding", ""),
+        request.headers.get("if-none-match"),
+    )
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return response
\ No newline at end of file
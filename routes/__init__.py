@@ -1,3 +1,3 @@
-from . import clients, plans, staffs, leads, dashboard, payments, reports
+from . import clients, plans, staffs, leads, dashboard, payments, reports, exports, metrics, checkins, attendance_reports, notifications
 
-__all__ = ["clients", "plans", "staffs", "leads", "dashboard", "payments", "reports"]
\ No newline at end of file
+__all__ = ["clients", "plans", "staffs", "leads", "dashboard", "payments", "reports", "exports", "metrics", "checkins", "attendance_reports", "notifications"]
\ No newline at end of file
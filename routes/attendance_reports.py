@@ -0,0 +1,193 @@
+from fastapi import APIRouter, Query
+from config import database
+from fastapi import Depends
+from index import get_current_gym_id
+from datetime import datetime, timedelta, timezone
+from services import attendance
+
+router = APIRouter()
+
+
+def _local_now() -> datetime:
+    return attendance.local_time(datetime.now(timezone.utc))
+
+
+@router.get("/reports/attendance/heatmap")
+def get_attendance_heatmap(
+    weeks: int = Query(12, ge=1, le=104),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    """Average visits per hour of the week (ISO weekday 1-7, hour 0-23) over the last weeks"""
+    since = (_local_now() - timedelta(weeks=weeks)).replace(minute=0, second=0, microsecond=0)
+    try:
+        database.cur.execute("""
+            SELECT EXTRACT(ISODOW FROM hour)::int AS weekday,
+                   EXTRACT(HOUR FROM hour)::int AS hour_of_day,
+                   SUM(visits) AS visits
+            FROM attendance_hourly
+            WHERE gym_id = %s AND hour >= %s
+            GROUP BY weekday, hour_of_day
+        """, (current_gym_id, since))
+        visits = {(row[0], row[1]): row[2] for row in database.cur.fetchall()}
+        heatmap = []
+        for weekday in range(1, 8):
+            for hour in range(24):
+                total = visits.get((weekday, hour), 0)
+                heatmap.append({
+                    "weekday": weekday,
+                    "hour": hour,
+                    "visits": total,
+                    "average": round(total / weeks, 2),
+                })
+        return {"weeks": weeks, "heatmap": heatmap}
+    except Exception as e:
+        print(f"Error in get_attendance_heatmap: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        database.conn.rollback()
+        return {"weeks": weeks, "heatmap": [], "error": str(e)}
+
+
+@router.get("/reports/attendance/occupancy")
+def get_live_occupancy(current_gym_id: int = Depends(get_current_gym_id)):
+    """Members currently in the gym, estimated as members with an accepted scan within the assumed visit length"""
+    now = _local_now()
+    try:
+        occupancy = attendance.occupancy.count(current_gym_id)
+        database.cur.execute("""
+            SELECT COALESCE(SUM(visits), 0)
+            FROM attendance_hourly
+            WHERE gym_id = %s AND hour >= %s
+        """, (current_gym_id, now.replace(hour=0, minute=0, second=0, microsecond=0)))
+        visits_today = database.cur.fetchone()[0]
+    except Exception as e:
+        print(f"Error in get_live_occupancy: {str(e)}")
+        database.conn.rollback()
+        occupancy = visits_today = None
+    return {
+        "occupancy": occupancy,
+        "visit_minutes": attendance.VISIT_MINUTES,
+        # Scans still waiting in the write buffer are not in the rollup yet
+        "visits_today": visits_today,
+        "as_of": now.isoformat(timespec="seconds"),
+    }
+
+
+@router.get("/reports/attendance/frequency")
+def get_visit_frequency(
+    days: int = Query(30, ge=1, le=365),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    """Visits per member over the last days, most frequent first, with the distribution of visits per week"""
+    since = _local_now().date() - timedelta(days=days - 1)
+    try:
+        database.cur.execute("""
+            SELECT c.id, c.clientname, SUM(d.visits) AS visits, COUNT(*) AS visit_days, MAX(d.day) AS last_visit
+            FROM attendance_member_daily d
+            JOIN clients c ON c.id = d.client_id AND c.gym_id = d.gym_id
+            WHERE d.gym_id = %s AND d.day >= %s
+            GROUP BY c.id, c.clientname
+            ORDER BY visits DESC, c.id
+            LIMIT %s OFFSET %s
+        """, (current_gym_id, since, limit, offset))
+        members = []
+        for row in database.cur.fetchall():
+            members.append({
+                "client_id": row[0],
+                "clientname": row[1],
+                "visits": row[2],
+                "visit_days": row[3],
+                "visits_per_week": round(row[2] * 7 / days, 2),
+                "last_visit": str(row[4]),
+            })
+
+        database.cur.execute("""
+            WITH per_member AS (
+                SELECT SUM(visits) AS visits
+                FROM attendance_member_daily
+                WHERE gym_id = %s AND day >= %s
+                GROUP BY client_id
+            )
+            SELECT LEAST(FLOOR(visits * 7.0 / %s), 7)::int AS per_week, COUNT(*)
+            FROM per_member
+            GROUP BY per_week
+            ORDER BY per_week
+        """, (current_gym_id, since, days))
+        distribution = [{"visits_per_week": row[0], "members": row[1]} for row in database.cur.fetchall()]
+        return {"days": days, "members": members, "distribution": distribution}
+    except Exception as e:
+        print(f"Error in get_visit_frequency: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        database.conn.rollback()
+        return {"days": days, "members": [], "distribution": [], "error": str(e)}
+
+
+@router.get("/reports/attendance/churn-risk")
+def get_churn_risk(
+    recent_weeks: int = Query(4, ge=1, le=26),
+    baseline_weeks: int = Query(8, ge=1, le=52),
+    drop: float = Query(0.5, gt=0, le=1),
+    min_weekly: float = Query(1.0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    """
+    Active members whose weekly visits over the last recent_weeks fell below
+    drop times their rate over the baseline_weeks before that
+    """
+    today = _local_now().date()
+    recent_from = today - timedelta(weeks=recent_weeks) + timedelta(days=1)
+    baseline_from = recent_from - timedelta(weeks=baseline_weeks)
+    try:
+        database.cur.execute("""
+            WITH rates AS (
+                SELECT client_id,
+                       COALESCE(SUM(visits) FILTER (WHERE day >= %(recent_from)s), 0)::float / %(recent_weeks)s AS recent_rate,
+                       COALESCE(SUM(visits) FILTER (WHERE day < %(recent_from)s), 0)::float / %(baseline_weeks)s AS baseline_rate,
+                       MAX(day) AS last_visit
+                FROM attendance_member_daily
+                WHERE gym_id = %(gym)s AND day >= %(baseline_from)s
+                GROUP BY client_id
+            )
+            SELECT c.id, c.clientname, c.phonenumber, c.end_date, r.recent_rate, r.baseline_rate, r.last_visit
+            FROM rates r
+            JOIN clients c ON c.id = r.client_id AND c.gym_id = %(gym)s
+            WHERE c.end_date >= CURRENT_DATE
+                AND r.baseline_rate >= %(min_weekly)s
+                AND r.recent_rate < r.baseline_rate * %(drop)s
+            ORDER BY r.recent_rate / r.baseline_rate, r.last_visit
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, {
+            "gym": current_gym_id,
+            "recent_from": recent_from,
+            "baseline_from": baseline_from,
+            "recent_weeks": recent_weeks,
+            "baseline_weeks": baseline_weeks,
+            "min_weekly": min_weekly,
+            "drop": drop,
+            "limit": limit,
+            "offset": offset,
+        })
+        members = []
+        for row in database.cur.fetchall():
+            members.append({
+                "client_id": row[0],
+                "clientname": row[1],
+                "phonenumber": row[2],
+                "end_date": str(row[3]) if row[3] else None,
+                "recent_visits_per_week": round(row[4], 2),
+                "baseline_visits_per_week": round(row[5], 2),
+                "last_visit": str(row[6]),
+                "days_since_last_visit": (today - row[6]).days,
+            })
+        return {"members": members}
+    except Exception as e:
+        print(f"Error in get_churn_risk: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        database.conn.rollback()
+        return {"members": [], "error": str(e)}
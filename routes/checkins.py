@@ -0,0 +1,75 @@
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import date, timedelta
+from config import database
+from fastapi import Depends
+from index import get_current_gym_id
+from services import attendance
+
+router = APIRouter()
+
+
+class CheckinModel(BaseModel):
+    client_id: int
+    # attendance.device is VARCHAR(64)
+    device: Optional[str] = Field(None, max_length=64)
+
+
+@router.on_event("startup")
+def start_checkin_flusher():
+    attendance.buffer.start()
+
+
+@router.on_event("shutdown")
+def stop_checkin_flusher():
+    attendance.buffer.stop()
+
+
+@router.post("/checkins/")
+def create_checkin(checkin: CheckinModel, current_gym_id: int = Depends(get_current_gym_id)):
+    """Allow or deny a door scan; the visit is written to attendance asynchronously"""
+    try:
+        return attendance.check_in(current_gym_id, checkin.client_id, checkin.device)
+    except Exception as e:
+        database.conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Check-in failed: {str(e)}")
+
+
+@router.get("/checkins/")
+def get_checkins(
+    day: Optional[date] = None,
+    client_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    """Recorded check-ins for a day (default today), newest first"""
+    day = day or date.today()
+    try:
+        database.cur.execute("""
+            SELECT id, client_id, checked_in_at, allowed, reason, device
+            FROM attendance
+            WHERE gym_id = %s AND checked_in_at >= %s AND checked_in_at < %s
+                AND (%s::int IS NULL OR client_id = %s)
+            ORDER BY checked_in_at DESC
+            LIMIT %s OFFSET %s
+        """, (current_gym_id, day, day + timedelta(days=1), client_id, client_id, limit, offset))
+        rows = database.cur.fetchall()
+        checkins = []
+        for row in rows:
+            checkins.append({
+                "id": row[0],
+                "client_id": row[1],
+                "checked_in_at": str(row[2]) if row[2] else None,
+                "allowed": row[3],
+                "reason": row[4],
+                "device": row[5],
+            })
+        return {"day": str(day), "checkins": checkins, "pending": attendance.buffer.pending()}
+    except Exception as e:
+        print(f"Error in get_checkins: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        database.conn.rollback()
+        return {"day": str(day), "checkins": [], "error": str(e)}
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, HTTPException, Query
-from typing import Optional
+from typing import List, Optional
 from datetime import date, timedelta
 from pydantic import BaseModel
 from config import database
+from services import attendance, memberships, notifications, projection, report_cache
 from fastapi import HTTPException, Depends
 from index import get_current_user, get_current_gym_id
 
@@ -42,33 +43,70 @@ class RenewalModel(BaseModel):
     start_date: date = date.today()
 
 
+class BulkRenewalModel(BaseModel):
+    # Members to renew: an id list and/or filters, combined with AND
+    client_ids: Optional[List[int]] = None
+    current_plan_id: Optional[int] = None
+    status: Optional[str] = None
+    expires_from: Optional[date] = None
+    expires_to: Optional[date] = None
+    # Renew onto plan_id (default: each member's current plan) from start_date
+    # (default: each member's end date, or today if already expired) ...
+    plan_id: Optional[int] = None
+    start_date: Optional[date] = None
+    # ... or only push end dates out by extend_days, leaving plan and balance alone
+    extend_days: Optional[int] = None
+    dry_run: bool = False
+
+
+# Member status filters shared by the filter endpoint and bulk renewals
+STATUS_CONDITIONS = {
+    "active": "c.end_date >= CURRENT_DATE",
+    "expiring": "c.end_date BETWEEN CURRENT_DATE AND CURRENT_DATE + INTERVAL '10 days'",
+    "expired": "c.end_date < CURRENT_DATE AND c.end_date >= CURRENT_DATE - INTERVAL '30 days'",
+}
+
+
+def insert_client(client: ClientModel, gym_id: int):
+    """
+    Insert a member on its plan, in the caller's transaction
+
+    Returns (client id, end date). Raises HTTPException for an unknown plan.
+    """
+    database.cur.execute("SELECT days, amount FROM plans WHERE id = %s AND gym_id = %s", (client.plan_id, gym_id))
+    plan = database.cur.fetchone()
+    if not plan:
+        raise HTTPException(status_code=400, detail="Invalid plan ID")
+
+    duration = plan[0]
+    plan_amount = float(plan[1]) if plan[1] else 0.0
+    end_date = client.start_date + timedelta(days=duration)
+
+    database.cur.execute("""
+        INSERT INTO clients
+            (clientname, phonenumber, dateofbirth, gender, bloodgroup,
+             address, notes, email, height, weight,
+             plan_id, start_date, end_date, balance_due, gym_id)
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        RETURNING id
+    """, (
+        client.clientname, client.phonenumber, client.dateofbirth,
+        client.gender, client.bloodgroup, client.address, client.notes,
+        client.email, client.height, client.weight,
+        client.plan_id, client.start_date, end_date, plan_amount, gym_id
+    ))
+    client_id = database.cur.fetchone()[0]
+    memberships.record(database.cur, gym_id, client_id, client.plan_id, client.start_date, end_date, plan_amount, memberships.JOIN)
+    return client_id, end_date
+
+
 @router.post("/clients/")
 def create_client(client: ClientModel, current_gym_id: int = Depends(get_current_gym_id)):
     try:
-        database.cur.execute("SELECT days, amount FROM plans WHERE id = %s AND gym_id = %s", (client.plan_id, current_gym_id))
-        plan = database.cur.fetchone()
-        if not plan:
-            raise HTTPException(status_code=400, detail="Invalid plan ID")
-
-        duration = plan[0]
-        plan_amount = float(plan[1]) if plan[1] else 0.0
-        end_date = client.start_date + timedelta(days=duration)
-
-        database.cur.execute("""
-            INSERT INTO clients
-                (clientname, phonenumber, dateofbirth, gender, bloodgroup,
-                 address, notes, email, height, weight,
-                 plan_id, start_date, end_date, balance_due, gym_id)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-            RETURNING id
-        """, (
-            client.clientname, client.phonenumber, client.dateofbirth,
-            client.gender, client.bloodgroup, client.address, client.notes,
-            client.email, client.height, client.weight,
-            client.plan_id, client.start_date, end_date, plan_amount, current_gym_id
-        ))
+        client_id, end_date = insert_client(client, current_gym_id)
         database.conn.commit()
-        client_id = database.cur.fetchone()[0]
+        report_cache.invalidate(current_gym_id)
+        attendance.membership_index.update(current_gym_id, client_id, client.start_date, end_date)
         return {"id": client_id, "end_date": str(end_date), "message": "Client created successfully"}
 
     except Exception as e:
@@ -76,66 +114,52 @@ def create_client(client: ClientModel, current_gym_id: int = Depends(get_current
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def _number(value):
+    return float(value) if value is not None and str(value).replace('.', '').replace('-', '').isdigit() else 0.0
+
+
+# Columns of the client lists, selectable with ?fields=
+CLIENT_COLUMNS = {
+    "id": ("c.id", lambda value: value if value is not None else 0),
+    "clientname": ("c.clientname", lambda value: value if value else ""),
+    "phonenumber": ("c.phonenumber", lambda value: str(value) if value else ""),
+    "dateofbirth": ("c.dateofbirth", lambda value: str(value) if value else None),
+    "gender": ("c.gender", lambda value: value if value else ""),
+    "bloodgroup": ("c.bloodgroup", lambda value: value if value else ""),
+    "address": ("c.address", lambda value: value if value else ""),
+    "notes": ("c.notes", lambda value: value if value else ""),
+    "email": ("c.email", lambda value: value if value else ""),
+    "height": ("c.height", _number),
+    "weight": ("c.weight", _number),
+    "start_date": ("c.start_date", lambda value: str(value) if value else None),
+    "end_date": ("c.end_date", lambda value: str(value) if value else None),
+    "total_paid": ("c.total_paid", _number),
+    "balance_due": ("c.balance_due", _number),
+    "planname": ("p.planname", lambda value: value if value else ""),
+    "days": ("p.days", lambda value: value if value is not None else 0),
+    "amount": ("p.amount", _number),
+}
+
+FIELDS_QUERY = Query(None, description="Comma separated columns to return, e.g. clientname,phonenumber,end_date")
+
+
+def _plan_join(names) -> str:
+    """The plans join, left out when no plan column was asked for"""
+    return "LEFT JOIN plans p ON c.plan_id = p.id" if projection.uses(CLIENT_COLUMNS, names, "p") else ""
+
+
 @router.get("/clients/")
-def get_clients(current_gym_id: int = Depends(get_current_gym_id)):
+def get_clients(fields: Optional[str] = FIELDS_QUERY, current_gym_id: int = Depends(get_current_gym_id)):
+    names = projection.choose(CLIENT_COLUMNS, fields)
     try:
-        database.cur.execute("""
-            SELECT c.id, c.clientname, c.phonenumber, c.dateofbirth, c.gender, c.bloodgroup,
-                   c.address, c.notes, c.email, c.height, c.weight,
-                   c.start_date, c.end_date, c.total_paid, c.balance_due,
-                   p.planname, p.days, p.amount
+        database.cur.execute(f"""
+            SELECT {projection.select_list(CLIENT_COLUMNS, names)}
             FROM clients c
-            LEFT JOIN plans p ON c.plan_id = p.id
+            {_plan_join(names)}
             WHERE c.gym_id = %s
         """, (current_gym_id,))
         rows = database.cur.fetchall() if database.cur.rowcount != -1 else []
-        clients = []
-        for row in rows:
-            # Ensure we have enough elements in the row
-            if len(row) >= 18:
-                clients.append({
-                    "id": row[0] if row[0] is not None else 0,
-                    "clientname": row[1] if row[1] else "",
-                    "phonenumber": str(row[2]) if row[2] else "",
-                    "dateofbirth": str(row[3]) if row[3] else None,
-                    "gender": row[4] if row[4] else "",
-                    "bloodgroup": row[5] if row[5] else "",
-                    "address": row[6] if row[6] else "",
-                    "notes": row[7] if row[7] else "",
-                    "email": row[8] if row[8] else "",
-                    "height": float(row[9]) if row[9] is not None and str(row[9]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "weight": float(row[10]) if row[10] is not None and str(row[10]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "start_date": str(row[11]) if row[11] else None,
-                    "end_date": str(row[12]) if row[12] else None,
-                    "total_paid": float(row[13]) if row[13] is not None and str(row[13]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "balance_due": float(row[14]) if row[14] is not None and str(row[14]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "planname": row[15] if row[15] else "",
-                    "days": row[16] if row[16] is not None else 0,
-                    "amount": float(row[17]) if row[17] is not None and str(row[17]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                })
-            else:
-                # Handle case where row doesn't have enough elements
-                clients.append({
-                    "id": row[0] if len(row) > 0 and row[0] is not None else 0,
-                    "clientname": row[1] if len(row) > 1 and row[1] else "",
-                    "phonenumber": str(row[2]) if len(row) > 2 and row[2] else "",
-                    "dateofbirth": str(row[3]) if len(row) > 3 and row[3] else None,
-                    "gender": row[4] if len(row) > 4 and row[4] else "",
-                    "bloodgroup": row[5] if len(row) > 5 and row[5] else "",
-                    "address": row[6] if len(row) > 6 and row[6] else "",
-                    "notes": row[7] if len(row) > 7 and row[7] else "",
-                    "email": row[8] if len(row) > 8 and row[8] else "",
-                    "height": float(row[9]) if len(row) > 9 and row[9] is not None and str(row[9]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "weight": float(row[10]) if len(row) > 10 and row[10] is not None and str(row[10]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "start_date": str(row[11]) if len(row) > 11 and row[11] else None,
-                    "end_date": str(row[12]) if len(row) > 12 and row[12] else None,
-                    "total_paid": float(row[13]) if len(row) > 13 and row[13] is not None and str(row[13]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "balance_due": float(row[14]) if len(row) > 14 and row[14] is not None and str(row[14]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "planname": row[15] if len(row) > 15 and row[15] else "",
-                    "days": row[16] if len(row) > 16 and row[16] is not None else 0,
-                    "amount": float(row[17]) if len(row) > 17 and row[17] is not None and str(row[17]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                })
-        return {"clients": clients}
+        return {"clients": [projection.serialize(CLIENT_COLUMNS, names, row) for row in rows]}
     except Exception as e:
         print(f"Error in get_clients: {str(e)}")
         import traceback
@@ -144,67 +168,19 @@ def get_clients(current_gym_id: int = Depends(get_current_gym_id)):
 
 
 @router.get("/clients/birthdays/today")
-def get_birthday_clients(current_gym_id: int = Depends(get_current_gym_id)):
+def get_birthday_clients(fields: Optional[str] = FIELDS_QUERY, current_gym_id: int = Depends(get_current_gym_id)):
+    names = projection.choose(CLIENT_COLUMNS, fields)
     try:
-        database.cur.execute("""
-            SELECT c.id, c.clientname, c.phonenumber, c.dateofbirth, c.gender, c.bloodgroup,
-                   c.address, c.notes, c.email, c.height, c.weight,
-                   c.start_date, c.end_date, c.total_paid, c.balance_due,
-                   p.planname, p.days, p.amount
+        database.cur.execute(f"""
+            SELECT {projection.select_list(CLIENT_COLUMNS, names)}
             FROM clients c
-            LEFT JOIN plans p ON c.plan_id = p.id
+            {_plan_join(names)}
             WHERE EXTRACT(MONTH FROM c.dateofbirth::date) = EXTRACT(MONTH FROM CURRENT_DATE)
               AND EXTRACT(DAY FROM c.dateofbirth::date) = EXTRACT(DAY FROM CURRENT_DATE)
               AND c.gym_id = %s
         """, (current_gym_id,))
         rows = database.cur.fetchall() if database.cur.rowcount != -1 else []
-        clients = []
-        for row in rows:
-            # Ensure we have enough elements in the row
-            if len(row) >= 18:
-                clients.append({
-                    "id": row[0] if row[0] is not None else 0,
-                    "clientname": row[1] if row[1] else "",
-                    "phonenumber": str(row[2]) if row[2] else "",
-                    "dateofbirth": str(row[3]) if row[3] else None,
-                    "gender": row[4] if row[4] else "",
-                    "bloodgroup": row[5] if row[5] else "",
-                    "address": row[6] if row[6] else "",
-                    "notes": row[7] if row[7] else "",
-                    "email": row[8] if row[8] else "",
-                    "height": float(row[9]) if row[9] is not None and str(row[9]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "weight": float(row[10]) if row[10] is not None and str(row[10]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "start_date": str(row[11]) if row[11] else None,
-                    "end_date": str(row[12]) if row[12] else None,
-                    "total_paid": float(row[13]) if row[13] is not None and str(row[13]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "balance_due": float(row[14]) if row[14] is not None and str(row[14]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "planname": row[15] if row[15] else "",
-                    "days": row[16] if row[16] is not None else 0,
-                    "amount": float(row[17]) if row[17] is not None and str(row[17]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                })
-            else:
-                # Handle case where row doesn't have enough elements
-                clients.append({
-                    "id": row[0] if len(row) > 0 and row[0] is not None else 0,
-                    "clientname": row[1] if len(row) > 1 and row[1] else "",
-                    "phonenumber": str(row[2]) if len(row) > 2 and row[2] else "",
-                    "dateofbirth": str(row[3]) if len(row) > 3 and row[3] else None,
-                    "gender": row[4] if len(row) > 4 and row[4] else "",
-                    "bloodgroup": row[5] if len(row) > 5 and row[5] else "",
-                    "address": row[6] if len(row) > 6 and row[6] else "",
-                    "notes": row[7] if len(row) > 7 and row[7] else "",
-                    "email": row[8] if len(row) > 8 and row[8] else "",
-                    "height": float(row[9]) if len(row) > 9 and row[9] is not None and str(row[9]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "weight": float(row[10]) if len(row) > 10 and row[10] is not None and str(row[10]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "start_date": str(row[11]) if len(row) > 11 and row[11] else None,
-                    "end_date": str(row[12]) if len(row) > 12 and row[12] else None,
-                    "total_paid": float(row[13]) if len(row) > 13 and row[13] is not None and str(row[13]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "balance_due": float(row[14]) if len(row) > 14 and row[14] is not None and str(row[14]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                    "planname": row[15] if len(row) > 15 and row[15] else "",
-                    "days": row[16] if len(row) > 16 and row[16] is not None else 0,
-                    "amount": float(row[17]) if len(row) > 17 and row[17] is not None and str(row[17]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                })
-        return {"clients": clients}
+        return {"clients": [projection.serialize(CLIENT_COLUMNS, names, row) for row in rows]}
     except Exception as e:
         print(f"Error in get_birthday_clients: {str(e)}")
         import traceback
@@ -297,8 +273,10 @@ def update_client(client_id: int, client: ClientUpdateModel, current_gym_id: int
     ))
     
     database.conn.commit()
+    report_cache.invalidate(current_gym_id)
     if database.cur.rowcount == 0:
         raise HTTPException(status_code=404, detail="Client not found")
+    attendance.membership_index.update(current_gym_id, client_id, current_start_date, end_date)
     return {"message": "Client updated successfully", "end_date": str(end_date)}
 
 
@@ -333,8 +311,23 @@ def renew_subscription(client_id: int, renewal: RenewalModel, current_gym_id: in
                 total_paid = 0, balance_due = %s
             WHERE id = %s AND gym_id = %s
         """, (renewal.plan_id, renewal.start_date, end_date, plan_amount, client_id, current_gym_id))
+        memberships.record(
+            database.cur, current_gym_id, client_id, renewal.plan_id,
+            renewal.start_date, end_date, plan_amount, memberships.RENEWAL,
+        )
+
+        notifications.enqueue(
+            database.cur, current_gym_id, client_id, "membership_renewed",
+            "Membership renewed",
+            f"Hi {client_data[0]}, your membership is renewed from {renewal.start_date} to {end_date}. "
+            f"Amount due: {plan_amount:.2f}.",
+            dedupe_key=f"renewal:{client_id}:{renewal.start_date}:{renewal.plan_id}",
+        )
         
         database.conn.commit()
+        report_cache.invalidate(current_gym_id)
+        notifications.dispatcher.wake()
+        attendance.membership_index.update(current_gym_id, client_id, renewal.start_date, end_date)
         return {
             "message": "Subscription renewed successfully", 
             "client_id": client_id,
@@ -348,81 +341,157 @@ def renew_subscription(client_id: int, renewal: RenewalModel, current_gym_id: in
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def _bulk_conditions(renewal: BulkRenewalModel):
+    """WHERE conditions on clients c selecting the members of a bulk renewal"""
+    conditions = ["c.gym_id = %(gym)s"]
+    if renewal.client_ids is not None:
+        conditions.append("c.id = ANY(%(client_ids)s)")
+    if renewal.current_plan_id is not None:
+        conditions.append("c.plan_id = %(current_plan_id)s")
+    if renewal.status is not None:
+        if renewal.status not in STATUS_CONDITIONS:
+            raise HTTPException(status_code=400, detail=f"Status must be one of {', '.join(STATUS_CONDITIONS)}")
+        conditions.append(STATUS_CONDITIONS[renewal.status])
+    if renewal.expires_from is not None:
+        conditions.append("c.end_date >= %(expires_from)s")
+    if renewal.expires_to is not None:
+        conditions.append("c.end_date <= %(expires_to)s")
+    if len(conditions) == 1:
+        raise HTTPException(status_code=400, detail="Give client_ids or at least one filter")
+    return " AND ".join(conditions)
+
+
+@router.post("/clients/renew/bulk")
+def bulk_renew(renewal: BulkRenewalModel, current_gym_id: int = Depends(get_current_gym_id)):
+    """
+    Renew or extend a set of members with one UPDATE, queueing their
+    confirmation messages in the same statement
+    """
+    if renewal.extend_days is not None and (renewal.plan_id is not None or renewal.start_date is not None):
+        raise HTTPException(status_code=400, detail="extend_days cannot be combined with plan_id or start_date")
+    where = _bulk_conditions(renewal)
+    params = {**renewal.dict(), "gym": current_gym_id, "channel": notifications.CHANNEL}
+
+    if renewal.extend_days is not None:
+        update = f"""
+            UPDATE clients c
+            SET end_date = c.end_date + %(extend_days)s
+            WHERE {where} AND c.end_date IS NOT NULL
+            RETURNING c.id, c.gym_id, c.clientname, {notifications.recipient_column()} AS recipient,
+                      c.plan_id, c.start_date, c.end_date, c.balance_due
+        """
+        # The added days, from the old end date
+        period = "u.end_date - %(extend_days)s, u.end_date, 0"
+        kind = memberships.EXTENSION
+        event, subject = "membership_extended", "Membership extended"
+        body = "'Hi ' || u.clientname || ', your membership now runs until ' || TO_CHAR(u.end_date, 'DD Mon YYYY') || '.'"
+        dedupe = "'extension:' || u.id || ':' || u.end_date"
+    else:
+        # Members without a valid plan to renew onto drop out at the join
+        update = f"""
+            UPDATE clients c
+            SET plan_id = t.plan_id, start_date = t.start_date, end_date = t.start_date + p.days,
+                total_paid = 0, balance_due = COALESCE(p.amount, 0)
+            FROM (
+                SELECT c.id,
+                       COALESCE(%(plan_id)s, c.plan_id) AS plan_id,
+                       COALESCE(%(start_date)s::date, GREATEST(c.end_date, CURRENT_DATE)) AS start_date
+                FROM clients c
+                WHERE {where}
+            ) t
+            JOIN plans p ON p.id = t.plan_id AND p.gym_id = %(gym)s
+            WHERE c.id = t.id
+            RETURNING c.id, c.gym_id, c.clientname, {notifications.recipient_column()} AS recipient,
+                      c.plan_id, c.start_date, c.end_date, c.balance_due
+        """
+        period = "u.start_date, u.end_date, u.balance_due"
+        kind = memberships.RENEWAL
+        event, subject = "membership_renewed", "Membership renewed"
+        body = ("'Hi ' || u.clientname || ', your membership is renewed from ' || u.start_date || ' to ' || u.end_date"
+                " || '. Amount due: ' || TO_CHAR(u.balance_due, 'FM999999990.00') || '.'")
+        dedupe = "'renewal:' || u.id || ':' || u.start_date || ':' || u.plan_id"
+
+    try:
+        database.cur.execute(f"SELECT COUNT(*) FROM clients c WHERE {where}", params)
+        matched = database.cur.fetchone()[0]
+        database.cur.execute(f"""
+            WITH u AS ({update}),
+            queued AS (
+                INSERT INTO outbox (gym_id, client_id, event, channel, recipient, subject, body, dedupe_key)
+                SELECT u.gym_id, u.id, %(event)s, %(channel)s, u.recipient, %(subject)s, {body}, {dedupe}
+                FROM u
+                WHERE NOT %(dry_run)s
+                ON CONFLICT (dedupe_key) DO NOTHING
+            ),
+            history AS (
+                INSERT INTO membership_periods (gym_id, client_id, plan_id, kind, start_date, end_date, amount)
+                SELECT u.gym_id, u.id, u.plan_id, %(kind)s, {period}
+                FROM u
+                WHERE NOT %(dry_run)s
+            )
+            SELECT u.id, u.start_date, u.end_date, u.balance_due FROM u ORDER BY u.id
+        """, {**params, "event": event, "subject": subject, "kind": kind})
+        rows = database.cur.fetchall()
+        if renewal.dry_run:
+            database.conn.rollback()
+        else:
+            database.conn.commit()
+    except Exception as e:
+        database.conn.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not renewal.dry_run and rows:
+        report_cache.invalidate(current_gym_id)
+        notifications.dispatcher.wake()
+        for client_id, start_date, end_date, _ in rows:
+            attendance.membership_index.update(current_gym_id, client_id, start_date, end_date)
+    return {
+        "dry_run": renewal.dry_run,
+        "matched": matched,
+        "updated": len(rows),
+        "skipped": matched - len(rows),
+        "total_balance_due": float(sum(row[3] or 0 for row in rows)),
+        "clients": [
+            {"id": row[0], "start_date": str(row[1]), "end_date": str(row[2]), "balance_due": float(row[3] or 0)}
+            for row in rows
+        ],
+    }
+
+
 @router.delete("/clients/{client_id}")
 def delete_client(client_id: int, current_gym_id: int = Depends(get_current_gym_id)):
     database.cur.execute("DELETE FROM clients WHERE id = %s AND gym_id = %s RETURNING id", (client_id, current_gym_id))
     database.conn.commit()
+    report_cache.invalidate(current_gym_id)
+    attendance.membership_index.remove(current_gym_id, client_id)
     if database.cur.rowcount == 0:
         raise HTTPException(status_code=404, detail="client not found")
     return {"message": "client deleted successfully"}
 
 
 @router.get("/clients/filter/")
-def filter_clients(status: str = Query(..., regex="^(active|expiring|expired)$"), current_gym_id: int = Depends(get_current_gym_id)):
+def filter_clients(
+    status: str = Query(..., regex="^(active|expiring|expired)$"),
+    fields: Optional[str] = FIELDS_QUERY,
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    names = projection.choose(CLIENT_COLUMNS, fields)
     try:
-        if status == "active":
-            query = '''
-                SELECT c.id, c.clientname, c.phonenumber, c.dateofbirth, c.gender, c.bloodgroup,
-                       c.address, c.notes, c.email, c.height, c.weight,
-                       c.start_date, c.end_date, c.total_paid, c.balance_due,
-                       p.planname, p.days, p.amount
-                FROM clients c
-                JOIN plans p ON c.plan_id = p.id
-                WHERE c.end_date >= CURRENT_DATE AND c.gym_id = %s
-                ORDER BY c.end_date
-            '''
-        elif status == "expiring":
-            query = '''
-                SELECT c.id, c.clientname, c.phonenumber, c.dateofbirth, c.gender, c.bloodgroup,
-                       c.address, c.notes, c.email, c.height, c.weight,
-                       c.start_date, c.end_date, c.total_paid, c.balance_due,
-                       p.planname, p.days, p.amount
-                FROM clients c
-                JOIN plans p ON c.plan_id = p.id
-                WHERE c.end_date BETWEEN CURRENT_DATE AND CURRENT_DATE + INTERVAL '10 days'
-                    AND c.gym_id = %s
-                ORDER BY c.end_date
-            '''
-        elif status == "expired":
-            query = '''
-                    SELECT c.id, c.clientname, c.phonenumber, c.dateofbirth, c.gender, c.bloodgroup,
-                                 c.address, c.notes, c.email, c.height, c.weight,
-                                 c.start_date, c.end_date, c.total_paid, c.balance_due,
-                                 p.planname, p.days, p.amount
-                    FROM clients c
-                    JOIN plans p ON c.plan_id = p.id
-                    WHERE c.end_date < CURRENT_DATE
-                        AND c.end_date >= CURRENT_DATE - INTERVAL '30 days'
-                        AND c.gym_id = %s
-                    ORDER BY c.end_date
-            '''
-        else:
+        condition = STATUS_CONDITIONS.get(status)
+        if condition is None:
             raise HTTPException(status_code=400, detail="Invalid status")
 
-        database.cur.execute(query, (current_gym_id,))
+        # Inner join even when no plan column is selected: members without a plan are not listed
+        database.cur.execute(f"""
+            SELECT {projection.select_list(CLIENT_COLUMNS, names)}
+            FROM clients c
+            JOIN plans p ON c.plan_id = p.id
+            WHERE {condition}
+                AND c.gym_id = %s
+            ORDER BY c.end_date
+        """, (current_gym_id,))
         rows = database.cur.fetchall() if database.cur.rowcount != -1 else []
-        clients = []
-        for row in rows:
-            clients.append({
-                "id": row[0] if row[0] is not None else 0,
-                "clientname": row[1] if row[1] else "",
-                "phonenumber": str(row[2]) if row[2] else "",
-                "dateofbirth": str(row[3]) if row[3] else None,
-                "gender": row[4] if row[4] else "",
-                "bloodgroup": row[5] if row[5] else "",
-                "address": row[6] if row[6] else "",
-                "notes": row[7] if row[7] else "",
-                "email": row[8] if row[8] else "",
-                "height": float(row[9]) if row[9] is not None and str(row[9]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                "weight": float(row[10]) if row[10] is not None and str(row[10]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                "start_date": str(row[11]) if row[11] else None,
-                "end_date": str(row[12]) if row[12] else None,
-                "total_paid": float(row[13]) if row[13] is not None and str(row[13]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                "balance_due": float(row[14]) if row[14] is not None and str(row[14]).replace('.', '').replace('-', '').isdigit() else 0.0,
-                "planname": row[15] if row[15] else "",
-                "days": row[16] if row[16] is not None else 0,
-                "amount": float(row[17]) if row[17] is not None and str(row[17]).replace('.', '').replace('-', '').isdigit() else 0.0,
-            })
+        clients = [projection.serialize(CLIENT_COLUMNS, names, row) for row in rows]
         return {"status": status, "clients": clients}
     except Exception as e:
         print(f"Error in filter_clients: {str(e)}")
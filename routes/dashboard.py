@@ -1,53 +1,48 @@
-from fastapi import APIRouter
+import asyncio
+import json
+import jwt
+from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
 from config import database
 from fastapi import Depends
-from index import get_current_user, get_current_gym_id
+from index import get_current_user, get_current_gym_id, SECRET_KEY, ALGORITHM
+from services import live
+from services.scheduler import scheduler
 
 router = APIRouter()
 
+KEEPALIVE_SECONDS = 15
+# EventSource cannot send headers, so browsers open the stream with a ticket in
+# the URL: a JWT only for the stream (its audience keeps it from being accepted
+# as an API token, and API tokens from being accepted as tickets), valid just
+# long enough to connect, so access logs never hold a usable API token
+STREAM_AUDIENCE = "dashboard-stream"
+STREAM_TICKET_SECONDS = 60
 
-@router.get("/dashboard/stats")
-def dashboard_stats(current_gym_id: int = Depends(get_current_gym_id)):
-    try:
-        database.cur.execute("SELECT COUNT(*) FROM clients WHERE gym_id = %s", (current_gym_id,))
-        total_row = database.cur.fetchone()
-        total = total_row[0] if total_row else 0
+stream_security = HTTPBearer(auto_error=False)
 
-        database.cur.execute("SELECT COUNT(*) FROM clients WHERE end_date >= CURRENT_DATE AND gym_id = %s", (current_gym_id,))
-        active_row = database.cur.fetchone()
-        active = active_row[0] if active_row else 0
 
-        database.cur.execute("SELECT COUNT(*) FROM clients WHERE end_date BETWEEN CURRENT_DATE AND CURRENT_DATE + INTERVAL '10 days' AND gym_id = %s", (current_gym_id,))
-        expiring_10_row = database.cur.fetchone()
-        expiring_10 = expiring_10_row[0] if expiring_10_row else 0
+@router.on_event("startup")
+def start_scheduler():
+    scheduler.start()
+    # Always listening, as it also invalidates the report cache
+    live.hub.start()
 
-        database.cur.execute("SELECT COUNT(*) FROM clients WHERE end_date < CURRENT_DATE AND end_date >= CURRENT_DATE - INTERVAL '30 days' AND gym_id = %s", (current_gym_id,))
-        expired_30_row = database.cur.fetchone()
-        expired_30 = expired_30_row[0] if expired_30_row else 0
 
-        database.cur.execute("""
-            SELECT COUNT(*) 
-            FROM clients 
-            WHERE EXTRACT(MONTH FROM dateofbirth::date) = EXTRACT(MONTH FROM CURRENT_DATE)
-              AND EXTRACT(DAY FROM dateofbirth::date) = EXTRACT(DAY FROM CURRENT_DATE)
-              AND gym_id = %s
-        """, (current_gym_id,))
-        birthdays_row = database.cur.fetchone()
-        birthdays_today = birthdays_row[0] if birthdays_row else 0
+@router.on_event("shutdown")
+def stop_scheduler():
+    scheduler.stop()
+    live.hub.stop()
 
-        # Get lead count
-        database.cur.execute("SELECT COUNT(*) FROM leads WHERE gym_id = %s", (current_gym_id,))
-        leads_row = database.cur.fetchone()
-        total_leads = leads_row[0] if leads_row else 0
 
-        return {
-            "total_members": total,
-            "active_members": active,
-            "expiring_in_10_days": expiring_10,
-            "expired_in_last_30_days": expired_30,
-            "birthdays_today": birthdays_today,
-            "total_leads": total_leads
-        }
+@router.get("/dashboard/stats")
+def dashboard_stats(current_gym_id: int = Depends(get_current_gym_id)):
+    try:
+        return live.dashboard_stats(database.cur, current_gym_id)
     except Exception as e:
         print(f"Error in dashboard_stats: {str(e)}")
         import traceback
@@ -58,10 +53,78 @@ def dashboard_stats(current_gym_id: int = Depends(get_current_gym_id)):
             "expiring_in_10_days": 0,
             "expired_in_last_30_days": 0,
             "birthdays_today": 0,
-            "total_leads": 0
+            "total_leads": 0,
+            "due_members": 0,
+            "total_balance_due": 0.0
         }
 
 
+@router.post("/dashboard/stream/ticket")
+def create_stream_ticket(current_user: dict = Depends(get_current_user)):
+    """Short-lived ticket for opening /dashboard/stream as ?ticket="""
+    if current_user["current_gym_id"] is None:
+        raise HTTPException(status_code=400, detail="No gym selected. Please select a gym first.")
+    ticket = jwt.encode({
+        "sub": current_user["user_id"],
+        "gym": current_user["current_gym_id"],
+        "aud": STREAM_AUDIENCE,
+        "exp": datetime.utcnow() + timedelta(seconds=STREAM_TICKET_SECONDS),
+    }, SECRET_KEY, algorithm=ALGORITHM)
+    return {"ticket": ticket, "expires_in": STREAM_TICKET_SECONDS}
+
+
+def get_stream_gym_id(ticket: Optional[str] = None,
+                      credentials: Optional[HTTPAuthorizationCredentials] = Depends(stream_security)):
+    """Gym of the stream, from the Authorization header or a ticket from /dashboard/stream/ticket"""
+    if credentials is not None:
+        return get_current_gym_id(credentials)
+    if not ticket:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        return jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM], audience=STREAM_AUDIENCE)["gym"]
+    except (jwt.InvalidTokenError, KeyError):
+        raise HTTPException(status_code=401, detail="Invalid or expired stream ticket")
+
+
+def _event(name: str, data: dict) -> str:
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get("/dashboard/stream")
+async def stream_dashboard(request: Request, current_gym_id: int = Depends(get_stream_gym_id)):
+    """
+    Server-Sent Events: a "snapshot" of /dashboard/stats, then a "delta" with
+    the changed fields whenever clients, payments or leads of the gym change
+    """
+    async def events():
+        subscriber = live.hub.subscribe(current_gym_id, asyncio.get_running_loop())
+        try:
+            yield _event("snapshot", await run_in_threadpool(live.hub.snapshot, current_gym_id))
+            while True:
+                try:
+                    delta = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if subscriber.stale:
+                    # Deltas were dropped while this client was slow; resend everything
+                    while not subscriber.queue.empty():
+                        subscriber.queue.get_nowait()
+                    subscriber.stale = False
+                    yield _event("snapshot", await run_in_threadpool(live.hub.snapshot, current_gym_id))
+                else:
+                    yield _event("delta", delta)
+        finally:
+            live.hub.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
 @router.get("/dashboard/due_members")
 def get_due_members(current_gym_id: int = Depends(get_current_gym_id)):
     """Get clients with pending payments (positive balance_due)"""
@@ -86,4 +149,5 @@ def get_due_members(current_gym_id: int = Depends(get_current_gym_id)):
         print(f"Error in get_due_members: {str(e)}")
         import traceback
         traceback.print_exc()
-        return {"due_members": []}
\ No newline at end of file
+        return {"due_members": []}
+
@@ -0,0 +1,188 @@
+import io
+import os
+import tempfile
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from config import database
+from index import get_current_gym_id
+from services import report_cache
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # exports are optional, the rest of the API works without pyarrow
+    pa = None
+    pq = None
+
+router = APIRouter()
+
+# Rows fetched from the server-side cursor per Arrow record batch
+BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', '50000'))
+
+# dataset -> (query, column names, arrow type names). Queries take
+# (gym_id, from, to) and must return columns in the listed order.
+EXPORTS = {
+    "payments": (
+        """
+        SELECT id, client_id, amount, paid_at, note, method, created_at
+        FROM payments
+        WHERE gym_id = %s AND paid_at >= %s AND paid_at < %s
+        ORDER BY paid_at, id
+        """,
+        [
+            ("id", "int32"), ("client_id", "int32"), ("amount", "decimal"),
+            ("paid_at", "timestamp"), ("note", "string"), ("method", "string"),
+            ("created_at", "timestamp"),
+        ],
+    ),
+    "clients": (
+        """
+        SELECT id, clientname, phonenumber, dateofbirth, gender, bloodgroup,
+               address, notes, email, height, weight, plan_id,
+               start_date, end_date, created_at, total_paid, balance_due
+        FROM clients
+        WHERE gym_id = %s AND created_at >= %s AND created_at < %s
+        ORDER BY id
+        """,
+        [
+            ("id", "int32"), ("clientname", "string"), ("phonenumber", "int64"),
+            ("dateofbirth", "date"), ("gender", "string"), ("bloodgroup", "string"),
+            ("address", "string"), ("notes", "string"), ("email", "string"),
+            ("height", "float64"), ("weight", "float64"), ("plan_id", "int32"),
+            ("start_date", "date"), ("end_date", "date"), ("created_at", "timestamptz"),
+            ("total_paid", "decimal"), ("balance_due", "decimal"),
+        ],
+    ),
+    "daily-revenue": (
+        """
+        SELECT paid_at::date AS day, method, COUNT(*) AS payments, SUM(amount) AS total_revenue
+        FROM payments
+        WHERE gym_id = %s AND paid_at >= %s AND paid_at < %s
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        """,
+        [
+            ("day", "date"), ("method", "string"),
+            ("payments", "int64"), ("total_revenue", "decimal"),
+        ],
+    ),
+}
+
+MEDIA_TYPES = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def _arrow_type(name: str):
+    if name == "decimal":
+        return pa.decimal128(14, 2)
+    if name == "date":
+        return pa.date32()
+    if name == "timestamp":
+        return pa.timestamp("us")
+    if name == "timestamptz":
+        return pa.timestamp("us", tz="UTC")
+    return getattr(pa, name)()
+
+
+def _open_cursor(dataset: str, current_gym_id: int, start: date, end: date):
+    """Run the export query on its own connection behind a server-side cursor"""
+    query, columns = EXPORTS[dataset]
+    conn = database.connect()
+    conn.set_session(readonly=True)
+    cur = conn.cursor(name=f"export_{dataset.replace('-', '_')}")
+    cur.itersize = BATCH_ROWS
+    try:
+        cur.execute(query, (current_gym_id, start, end))
+    except Exception:
+        conn.close()
+        raise
+    schema = pa.schema([(name, _arrow_type(type_name)) for name, type_name in columns])
+    return conn, cur, schema
+
+
+def _batches(cur, schema):
+    """Yield record batches built column-wise from each cursor fetch"""
+    while True:
+        rows = cur.fetchmany(BATCH_ROWS)
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+
+def _arrow_stream(conn, cur, schema):
+    try:
+        sink = io.BytesIO()
+        writer = pa.ipc.new_stream(sink, schema)
+        for batch in _batches(cur, schema):
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate(0)
+        writer.close()
+        yield sink.getvalue()
+    finally:
+        conn.close()
+
+
+def _parquet_file(conn, cur, schema) -> str:
+    handle, path = tempfile.mkstemp(suffix=".parquet")
+    os.close(handle)
+    try:
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            for batch in _batches(cur, schema):
+                writer.write_batch(batch)
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        conn.close()
+    return path
+
+
+@router.get("/exports/{dataset}")
+def export_dataset(
+    dataset: str,
+    format: str = Query("arrow", regex="^(arrow|parquet)$"),
+    start: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    """Export payments, clients or daily revenue as an Arrow IPC stream or a Parquet file"""
+    if pa is None:
+        raise HTTPException(status_code=501, detail="Exports require the pyarrow package")
+    if dataset not in EXPORTS:
+        raise HTTPException(status_code=404, detail=f"Unknown export: {dataset}")
+
+    start = start or date.min
+    try:
+        end = report_cache.day_after(to) if to else date.max
+    except OverflowError:
+        raise HTTPException(status_code=400, detail="'from' and 'to' are out of the supported date range")
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+
+    try:
+        conn, cur, schema = _open_cursor(dataset, current_gym_id, start, end)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+
+    media_type, extension = MEDIA_TYPES[format]
+    headers = {"Content-Disposition": f'attachment; filename="{dataset}.{extension}"'}
+    if format == "arrow":
+        return StreamingResponse(_arrow_stream(conn, cur, schema), media_type=media_type, headers=headers)
+
+    try:
+        path = _parquet_file(conn, cur, schema)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+    return FileResponse(path, media_type=media_type, headers=headers, background=BackgroundTask(os.remove, path))
@@ -1,12 +1,13 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel
 from config import database
-from typing import List
+from typing import List, Optional
 import jwt
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime
 from index import get_current_user, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token
-from datetime import timedelta
+from datetime import date, timedelta, timezone
+from services import attendance
 
 router = APIRouter()
 
@@ -172,4 +173,108 @@ def get_current_gym(current_user: dict = Depends(get_current_user)):
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get current gym: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to get current gym: {str(e)}")
+
+
+OVERVIEW_SQL = """
+    WITH my_gyms AS (
+        SELECT g.id, g.name, ug.role, ug.is_owner
+        FROM user_gyms ug
+        JOIN gyms g ON g.id = ug.gym_id
+        WHERE ug.user_id = %(user)s
+    ),
+    members AS (
+        SELECT c.gym_id,
+               COUNT(*) AS total_members,
+               COUNT(*) FILTER (WHERE c.end_date >= %(today)s) AS active_members,
+               COUNT(*) FILTER (WHERE c.end_date BETWEEN %(today)s AND %(today)s + 10) AS expiring_members,
+               COUNT(*) FILTER (WHERE c.balance_due > 0) AS due_members,
+               COALESCE(SUM(c.balance_due) FILTER (WHERE c.balance_due > 0), 0) AS total_balance_due
+        FROM clients c
+        WHERE c.gym_id IN (SELECT id FROM my_gyms)
+        GROUP BY c.gym_id
+    ),
+    revenue AS (
+        SELECT p.gym_id, SUM(p.amount) AS revenue, COUNT(*) AS payments
+        FROM payments p
+        WHERE p.gym_id IN (SELECT id FROM my_gyms)
+            AND p.paid_at >= %(start)s AND p.paid_at < %(end)s
+        GROUP BY p.gym_id
+    ),
+    visits AS (
+        SELECT h.gym_id, SUM(h.visits) AS visits_today
+        FROM attendance_hourly h
+        WHERE h.gym_id IN (SELECT id FROM my_gyms) AND h.hour >= %(local_today)s
+        GROUP BY h.gym_id
+    )
+    SELECT g.id, g.name, g.role, g.is_owner,
+           COALESCE(m.total_members, 0), COALESCE(m.active_members, 0), COALESCE(m.expiring_members, 0),
+           COALESCE(m.due_members, 0), COALESCE(m.total_balance_due, 0),
+           COALESCE(r.revenue, 0), COALESCE(r.payments, 0), COALESCE(v.visits_today, 0)
+    FROM my_gyms g
+    LEFT JOIN members m ON m.gym_id = g.id
+    LEFT JOIN revenue r ON r.gym_id = g.id
+    LEFT JOIN visits v ON v.gym_id = g.id
+    ORDER BY g.is_owner DESC, g.name
+"""
+
+OVERVIEW_TOTALS = (
+    "total_members", "active_members", "expiring_members", "due_members",
+    "total_balance_due", "revenue", "payments", "visits_today",
+)
+
+
+@router.get("/owner/overview")
+def get_owner_overview(
+    start: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Members, expiring members, dues, revenue between from and to (default:
+    this month) and today's visits for every gym of the user, in one query
+    """
+    today = date.today()
+    start = start or today.replace(day=1)
+    to = to or today
+    if start > to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    local_today = attendance.local_time(datetime.now(timezone.utc)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    try:
+        # The request connection only sees the current gym; widen it to all of the user's gyms
+        database.cur.execute("SELECT gym_id FROM user_gyms WHERE user_id = %s", (current_user["user_id"],))
+        database.scope_request([row[0] for row in database.cur.fetchall()])
+        database.cur.execute(OVERVIEW_SQL, {
+            "user": current_user["user_id"],
+            "today": today,
+            "start": start,
+            "end": to + timedelta(days=1),
+            "local_today": local_today,
+        })
+        gyms = []
+        for row in database.cur.fetchall():
+            gyms.append({
+                "gym_id": row[0],
+                "name": row[1],
+                "role": row[2],
+                "is_owner": row[3],
+                "total_members": row[4],
+                "active_members": row[5],
+                "expiring_members": row[6],
+                "due_members": row[7],
+                "total_balance_due": float(row[8]),
+                "revenue": float(row[9]),
+                "payments": row[10],
+                "visits_today": row[11],
+            })
+        totals = {key: sum(gym[key] for gym in gyms) for key in OVERVIEW_TOTALS}
+        totals["total_balance_due"] = round(totals["total_balance_due"], 2)
+        totals["revenue"] = round(totals["revenue"], 2)
+        return {"from": str(start), "to": str(to), "gyms": gyms, "totals": totals}
+    except Exception as e:
+        print(f"Error in get_owner_overview: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        database.conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to get owner overview: {str(e)}")
@@ -1,12 +1,21 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from typing import Optional
+from datetime import date, datetime
 from pydantic import BaseModel
+import base64
+import psycopg2.errors
 from config import database
+from services import attendance, projection, report_cache
 from fastapi import Depends
 from index import get_current_user, get_current_gym_id
+from routes.clients import ClientModel, insert_client
 
 router = APIRouter()
 
+# Pipeline stages; "converted" is only reached through POST /leads/{id}/convert
+LEAD_STAGES = ("new", "contacted", "trial", "converted", "lost")
+OPEN_STAGES = ("new", "contacted", "trial", "lost")
+
 
 class LeadModel(BaseModel):
     name: str
@@ -14,40 +23,188 @@ class LeadModel(BaseModel):
     notes: Optional[str] = None
 
 
+class LeadStageModel(BaseModel):
+    stage: str
+
+
+class LeadConversionModel(BaseModel):
+    """Member details a lead does not have; name and phone number come from the lead"""
+    dateofbirth: str
+    gender: str
+    bloodgroup: str
+    address: str
+    notes: Optional[str] = None
+    email: str
+    height: float
+    weight: float
+    plan_id: int
+    # Defaults to the day of the conversion, filled in by the handler
+    start_date: Optional[date] = None
+
+
 @router.post("/leads/")
 def create_lead(lead: LeadModel, current_gym_id: int = Depends(get_current_gym_id)):
     try:
+        # Served by idx_leads_gym_phone; the index also rejects a concurrent duplicate
+        database.cur.execute(
+            "SELECT id FROM leads WHERE gym_id = %s AND phonenumber = %s",
+            (current_gym_id, lead.phonenumber)
+        )
+        existing = database.cur.fetchone()
+        if existing:
+            raise HTTPException(status_code=409, detail={"message": "A lead with this phone number exists", "id": existing[0]})
         database.cur.execute(
             "INSERT INTO leads (name, phonenumber, notes, gym_id) VALUES (%s, %s, %s, %s) RETURNING id",
             (lead.name, lead.phonenumber, lead.notes, current_gym_id)
         )
-        database.conn.commit()
         lead_id = database.cur.fetchone()[0]
+        database.conn.commit()
         return {"id": lead_id, "message": "Lead added successfully"}
+    except HTTPException:
+        database.conn.rollback()
+        raise
+    except psycopg2.errors.UniqueViolation:
+        database.conn.rollback()
+        raise HTTPException(status_code=409, detail="A lead with this phone number exists")
     except Exception as e:
         database.conn.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# Columns of the lead list, selectable with ?fields=
+LEAD_COLUMNS = {
+    "id": ("id", lambda value: value),
+    "name": ("name", lambda value: value),
+    "phonenumber": ("phonenumber", lambda value: str(value)),
+    "notes": ("notes", lambda value: value),
+    "stage": ("stage", lambda value: value),
+    "client_id": ("client_id", lambda value: value),
+    "created_at": ("created_at", lambda value: str(value) if value else None),
+    "updated_at": ("updated_at", lambda value: str(value) if value else None),
+}
+
+
+def _cursor(created_at, lead_id) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{lead_id}".encode()).decode()
+
+
+def _parse_cursor(cursor: str):
+    try:
+        created_at, _, lead_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition("|")
+        return datetime.fromisoformat(created_at), int(lead_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("/leads/")
-def get_leads(current_gym_id: int = Depends(get_current_gym_id)):
+def get_leads(
+    stage: Optional[str] = Query(None, regex="^(new|contacted|trial|converted|lost)$"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma separated columns to return, e.g. name,phonenumber"),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    """
+    Leads newest first, optionally of one stage. With limit, pages are read
+    by keyset from the (gym, stage, created_at, id) indexes, so deep pages
+    cost the same as the first; pass next_cursor back as cursor.
+    """
+    names = projection.choose(LEAD_COLUMNS, fields)
+    conditions = ["gym_id = %s"]
+    params = [current_gym_id]
+    if stage is not None:
+        conditions.append("stage = %s")
+        params.append(stage)
+    if cursor is not None:
+        conditions.append("(created_at, id) < (%s, %s)")
+        params.extend(_parse_cursor(cursor))
+    page = f"LIMIT {limit + 1}" if limit is not None else ""
     try:
-        database.cur.execute("SELECT id, name, phonenumber, notes, created_at FROM leads WHERE gym_id = %s ORDER BY created_at DESC", (current_gym_id,))
+        database.cur.execute(f"""
+            SELECT {projection.select_list(LEAD_COLUMNS, names)}, created_at, id
+            FROM leads
+            WHERE {" AND ".join(conditions)}
+            ORDER BY created_at DESC, id DESC
+            {page}
+        """, params)
         rows = database.cur.fetchall()
-        leads = []
-        for row in rows:
-            leads.append({
-                "id": row[0],
-                "name": row[1],
-                "phonenumber": str(row[2]),
-                "notes": row[3],
-                "created_at": str(row[4]) if row[4] else None,
-            })
-        return {"leads": leads}
     except Exception as e:
         # Handle case where there are no results to fetch
         return {"leads": []}
 
+    result = {}
+    if limit is not None:
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        last = rows[-1] if rows else None
+        result["next_cursor"] = _cursor(last[-2], last[-1]) if has_more else None
+    result["leads"] = [projection.serialize(LEAD_COLUMNS, names, row[:len(names)]) for row in rows]
+    return result
+
+
+@router.get("/leads/stages")
+def get_lead_stage_counts(current_gym_id: int = Depends(get_current_gym_id)):
+    """Number of leads in each stage"""
+    database.cur.execute(
+        "SELECT stage, COUNT(*) FROM leads WHERE gym_id = %s GROUP BY stage",
+        (current_gym_id,)
+    )
+    counts = dict.fromkeys(LEAD_STAGES, 0)
+    counts.update({row[0]: row[1] for row in database.cur.fetchall()})
+    return {"stages": counts}
+
+
+@router.put("/leads/{lead_id}/stage")
+def update_lead_stage(lead_id: int, update: LeadStageModel, current_gym_id: int = Depends(get_current_gym_id)):
+    if update.stage not in OPEN_STAGES:
+        raise HTTPException(status_code=400, detail=f"Stage must be one of {', '.join(OPEN_STAGES)}")
+    database.cur.execute("""
+        UPDATE leads SET stage = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND gym_id = %s AND stage <> 'converted'
+        RETURNING id
+    """, (update.stage, lead_id, current_gym_id))
+    updated = database.cur.rowcount
+    database.conn.commit()
+    if updated == 0:
+        raise HTTPException(status_code=404, detail="Open lead not found")
+    return {"message": "Lead stage updated successfully"}
+
+
+@router.post("/leads/{lead_id}/convert")
+def convert_lead(lead_id: int, conversion: LeadConversionModel, current_gym_id: int = Depends(get_current_gym_id)):
+    """Create the member from the lead and close the lead, in one transaction"""
+    try:
+        # Locks the lead, so two conversions of it cannot both create a member
+        database.cur.execute(
+            "SELECT name, phonenumber, stage FROM leads WHERE id = %s AND gym_id = %s FOR UPDATE",
+            (lead_id, current_gym_id)
+        )
+        lead = database.cur.fetchone()
+        if not lead:
+            raise HTTPException(status_code=404, detail="Lead not found")
+        if lead[2] == "converted":
+            raise HTTPException(status_code=409, detail="Lead already converted")
+
+        details = conversion.dict()
+        details["start_date"] = conversion.start_date or date.today()
+        client = ClientModel(clientname=lead[0], phonenumber=lead[1], **details)
+        client_id, end_date = insert_client(client, current_gym_id)
+        database.cur.execute("""
+            UPDATE leads SET stage = 'converted', client_id = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND gym_id = %s
+        """, (client_id, lead_id, current_gym_id))
+        database.conn.commit()
+    except HTTPException:
+        database.conn.rollback()
+        raise
+    except Exception as e:
+        database.conn.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    report_cache.invalidate(current_gym_id)
+    attendance.membership_index.update(current_gym_id, client_id, client.start_date, end_date)
+    return {"client_id": client_id, "end_date": str(end_date), "message": "Lead converted successfully"}
+
 
 @router.delete("/leads/{lead_id}")
 def delete_lead(lead_id: int, current_gym_id: int = Depends(get_current_gym_id)):
@@ -0,0 +1,75 @@
+from fastapi import APIRouter, HTTPException, Query
+from config import database
+from fastapi import Depends
+from index import get_current_gym_id
+from services import notifications
+
+router = APIRouter()
+
+
+@router.on_event("startup")
+def start_outbox_dispatcher():
+    notifications.dispatcher.start()
+
+
+@router.on_event("shutdown")
+def stop_outbox_dispatcher():
+    notifications.dispatcher.stop()
+
+
+@router.get("/notifications/")
+def get_notifications(
+    status: str = Query("pending", regex="^(pending|sent|failed)$"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    """Outbound messages of the gym by delivery status, newest first"""
+    try:
+        database.cur.execute("""
+            SELECT id, client_id, event, channel, recipient, subject, body,
+                   attempts, last_error, created_at, sent_at, next_attempt_at
+            FROM outbox
+            WHERE gym_id = %s AND status = %s
+            ORDER BY id DESC
+            LIMIT %s OFFSET %s
+        """, (current_gym_id, status, limit, offset))
+        messages = []
+        for row in database.cur.fetchall():
+            messages.append({
+                "id": row[0],
+                "client_id": row[1],
+                "event": row[2],
+                "channel": row[3],
+                "recipient": row[4],
+                "subject": row[5],
+                "body": row[6],
+                "attempts": row[7],
+                "last_error": row[8],
+                "created_at": str(row[9]) if row[9] else None,
+                "sent_at": str(row[10]) if row[10] else None,
+                "next_attempt_at": str(row[11]) if row[11] else None,
+            })
+        return {"status": status, "notifications": messages}
+    except Exception as e:
+        print(f"Error in get_notifications: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        database.conn.rollback()
+        return {"status": status, "notifications": [], "error": str(e)}
+
+
+@router.post("/notifications/{notification_id}/retry")
+def retry_notification(notification_id: int, current_gym_id: int = Depends(get_current_gym_id)):
+    """Queue a failed message for delivery again"""
+    database.cur.execute("""
+        UPDATE outbox
+        SET status = 'pending', attempts = 0, next_attempt_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND gym_id = %s AND status = 'failed'
+    """, (notification_id, current_gym_id))
+    updated = database.cur.rowcount
+    database.conn.commit()
+    if updated == 0:
+        raise HTTPException(status_code=404, detail="Failed notification not found")
+    notifications.dispatcher.wake()
+    return {"message": "Notification queued for retry"}
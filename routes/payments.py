@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 from typing import Optional
 from config import database
+from services import notifications, projection, report_cache
 from fastapi import Depends
 from index import get_current_user, get_current_gym_id
 
@@ -16,46 +17,37 @@ class PaymentModel(BaseModel):
     method: Optional[str] = None
 
 
-@router.get("/payments/")
-def get_payments(client_id: Optional[int] = None, current_gym_id: int = Depends(get_current_gym_id)):
-    if client_id is not None:
-        database.cur.execute(
-            """
-            SELECT p.id, p.client_id, p.amount, p.paid_at, p.note, p.method, p.created_at
-            FROM payments p
-            JOIN clients c ON p.client_id = c.id
-            WHERE p.client_id = %s AND c.gym_id = %s
-            ORDER BY p.paid_at DESC, p.id DESC
-            """,
-            (client_id, current_gym_id)
-        )
-    else:
-        database.cur.execute(
-            """
-            SELECT p.id, p.client_id, p.amount, p.paid_at, p.note, p.method, p.created_at
-            FROM payments p
-            JOIN clients c ON p.client_id = c.id
-            WHERE c.gym_id = %s
-            ORDER BY p.paid_at DESC, p.id DESC
-            """,
-            (current_gym_id,)
-        )
+# Columns of the payment list, selectable with ?fields=
+PAYMENT_COLUMNS = {
+    "id": ("p.id", lambda value: value),
+    "client_id": ("p.client_id", lambda value: value),
+    "amount": ("p.amount", lambda value: float(value) if value is not None else 0.0),
+    "paid_at": ("p.paid_at", lambda value: str(value) if value else None),
+    "note": ("p.note", lambda value: value),
+    "method": ("p.method", lambda value: value),
+    "created_at": ("p.created_at", lambda value: str(value) if value else None),
+}
+
 
+@router.get("/payments/")
+def get_payments(
+    client_id: Optional[int] = None,
+    fields: Optional[str] = Query(None, description="Comma separated columns to return, e.g. amount,paid_at"),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    names = projection.choose(PAYMENT_COLUMNS, fields)
+    client_filter = "AND p.client_id = %s" if client_id is not None else ""
+    database.cur.execute(
+        f"""
+        SELECT {projection.select_list(PAYMENT_COLUMNS, names)}
+        FROM payments p
+        WHERE p.gym_id = %s {client_filter}
+        ORDER BY p.paid_at DESC, p.id DESC
+        """,
+        (current_gym_id, client_id) if client_id is not None else (current_gym_id,)
+    )
     rows = database.cur.fetchall()
-    payments = []
-    for row in rows:
-        payments.append(
-            {
-                "id": row[0],
-                "client_id": row[1],
-                "amount": float(row[2]) if row[2] is not None else 0.0,
-                "paid_at": str(row[3]) if row[3] else None,
-                "note": row[4],
-                "method": row[5],
-                "created_at": str(row[6]) if row[6] else None,
-            }
-        )
-    return {"payments": payments}
+    return {"payments": [projection.serialize(PAYMENT_COLUMNS, names, row) for row in rows]}
 
 
 @router.post("/payments/")
@@ -63,7 +55,7 @@ def create_payment(payment: PaymentModel, current_gym_id: int = Depends(get_curr
     try:
         # First, get the client's plan amount
         database.cur.execute("""
-            SELECT p.amount, c.total_paid, c.balance_due
+            SELECT p.amount, c.total_paid, c.balance_due, c.clientname
             FROM clients c
             JOIN plans p ON c.plan_id = p.id
             WHERE c.id = %s AND c.gym_id = %s
@@ -114,8 +106,19 @@ def create_payment(payment: PaymentModel, current_gym_id: int = Depends(get_curr
             """,
             (new_paid, new_balance, payment.client_id, current_gym_id)
         )
+
+        # Receipt goes out through the outbox, committed together with the payment
+        notifications.enqueue(
+            database.cur, current_gym_id, payment.client_id, "payment_received",
+            "Payment received",
+            f"Hi {client_data[3]}, we received your payment of {payment.amount:.2f} on {payment.paid_at}. "
+            f"Balance due: {max(new_balance, 0):.2f}.",
+            dedupe_key=f"payment:{payment_id}",
+        )
         
         database.conn.commit()
+        report_cache.invalidate(current_gym_id)
+        notifications.dispatcher.wake()
         return {
             "id": payment_id, 
             "message": "Payment created successfully",
@@ -198,6 +201,7 @@ def update_payment(payment_id: int, payment: PaymentModel, current_gym_id: int =
         )
         
         database.conn.commit()
+        report_cache.invalidate(current_gym_id)
         return {
             "message": "Payment updated successfully",
             "balance_due": new_balance,
@@ -261,6 +265,7 @@ def delete_payment(payment_id: int, current_gym_id: int = Depends(get_current_gy
         )
         
         database.conn.commit()
+        report_cache.invalidate(current_gym_id)
         return {
             "message": "Payment deleted successfully",
             "balance_due": new_balance,
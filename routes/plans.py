@@ -1,12 +1,24 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
 from pydantic import BaseModel
 from config import database
+from services import repricing, report_cache
 from fastapi import Depends
 from index import get_current_user, get_current_gym_id
 
 router = APIRouter()
 
 
+@router.on_event("startup")
+def start_repricer():
+    repricing.repricer.start()
+
+
+@router.on_event("shutdown")
+def stop_repricer():
+    repricing.repricer.stop()
+
+
 class PlanModel(BaseModel):
     planname: str
     days: int
@@ -44,21 +56,61 @@ def get_plans(current_gym_id: int = Depends(get_current_gym_id)):
 
 
 @router.put("/plans/{plan_id}")
-def update_plan(plan_id: int, plan: PlanModel, current_gym_id: int = Depends(get_current_gym_id)):
+def update_plan(
+    plan_id: int,
+    plan: PlanModel,
+    reprice: Optional[str] = Query(None, regex="^(active|all)$", description="Recompute balance_due of the plan's active or all members"),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
     database.cur.execute(
         "UPDATE plans SET planname = %s, days = %s, amount = %s WHERE id = %s AND gym_id = %s RETURNING id",
         (plan.planname, plan.days, plan.amount, plan_id, current_gym_id),
     )
-    database.conn.commit()
     if database.cur.rowcount == 0:
+        database.conn.rollback()
         raise HTTPException(status_code=404, detail="plan not found")
-    return {"message": "plan updated successfully"}
+    # Queued with the new amount, so the members are repriced if and only if it commits
+    repricing_id = repricing.enqueue(database.cur, current_gym_id, plan_id, reprice) if reprice else None
+    database.conn.commit()
+    report_cache.invalidate(current_gym_id)
+    if repricing_id is None:
+        return {"message": "plan updated successfully"}
+    repricing.repricer.wake()
+    return {"message": "plan updated successfully, members are being repriced", "repricing_id": repricing_id}
+
+
+@router.get("/plans/repricings/{repricing_id}")
+def get_repricing(repricing_id: int, current_gym_id: int = Depends(get_current_gym_id)):
+    """Progress of a background repricing"""
+    database.cur.execute("""
+        SELECT id, plan_id, scope, status, total, processed, error, created_at, started_at, finished_at
+        FROM plan_repricings
+        WHERE id = %s AND gym_id = %s
+    """, (repricing_id, current_gym_id))
+    row = database.cur.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="repricing not found")
+    total, processed = row[4], row[5]
+    return {
+        "id": row[0],
+        "plan_id": row[1],
+        "scope": row[2],
+        "status": row[3],
+        "total": total,
+        "processed": processed,
+        "percent": 100.0 if row[3] == "done" else (round(100.0 * processed / total, 1) if total else 0.0),
+        "error": row[6],
+        "created_at": str(row[7]) if row[7] else None,
+        "started_at": str(row[8]) if row[8] else None,
+        "finished_at": str(row[9]) if row[9] else None,
+    }
 
 
 @router.delete("/plans/{plan_id}")
 def delete_plan(plan_id: int, current_gym_id: int = Depends(get_current_gym_id)):
     database.cur.execute("DELETE FROM plans WHERE id = %s AND gym_id = %s RETURNING id", (plan_id, current_gym_id))
     database.conn.commit()
+    report_cache.invalidate(current_gym_id)
     if database.cur.rowcount == 0:
         raise HTTPException(status_code=404, detail="plan not found")
     return {"message": "plan deleted successfully"}
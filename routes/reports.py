@@ -1,52 +1,144 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query
+import base64
+import os
 from config import database
 from fastapi import Depends
 from index import get_current_user, get_current_gym_id
 from typing import Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from services import forecast, report_cache
 
 router = APIRouter()
 
+# Default granularity and look-back window of the legacy period presets
+REVENUE_PERIODS = {
+    "daily": ("day", 7, "days"),
+    "weekly": ("week", 8, "weeks"),
+    "monthly": ("month", 12, "months"),
+    "yearly": ("year", 5, "years"),
+}
+
+GROWTH_PERIODS = {
+    "daily": ("day", 30, "days"),
+    "weekly": ("week", 12, "weeks"),
+    "monthly": ("month", 24, "months"),
+    "yearly": ("year", 5, "years"),
+}
+
+GRANULARITY_PATTERN = "^(day|week|month|year)$"
+
+# Most buckets one series may have: about 3 years of days, 10 of weeks, 50 of months
+MAX_BUCKETS = {"day": 1100, "week": 530, "month": 600, "year": 100}
+
+REVENUE_SERIES_SQL = """
+    WITH totals AS (
+        SELECT DATE_TRUNC($1, paid_at) AS period, SUM(amount) AS total_revenue
+        FROM payments
+        WHERE gym_id = $2 AND paid_at >= $3 AND paid_at < $4
+        GROUP BY 1
+    )
+    SELECT s.period::date, COALESCE(t.total_revenue, 0)
+    FROM generate_series(
+        DATE_TRUNC($1, $3::timestamp),
+        DATE_TRUNC($1, $4::timestamp - INTERVAL '1 day'),
+        ('1 ' || $1)::interval
+    ) AS s(period)
+    LEFT JOIN totals t ON t.period = s.period
+    ORDER BY s.period
+"""
+
+GROWTH_SERIES_SQL = """
+    WITH totals AS (
+        SELECT DATE_TRUNC($1, created_at::date::timestamp) AS period, COUNT(*) AS new_clients
+        FROM clients
+        WHERE gym_id = $2 AND created_at >= $3 AND created_at < $4
+        GROUP BY 1
+    )
+    SELECT s.period::date, COALESCE(t.new_clients, 0)
+    FROM generate_series(
+        DATE_TRUNC($1, $3::timestamp),
+        DATE_TRUNC($1, $4::timestamp - INTERVAL '1 day'),
+        ('1 ' || $1)::interval
+    ) AS s(period)
+    LEFT JOIN totals t ON t.period = s.period
+    ORDER BY s.period
+"""
+
+SERIES_PARAM_TYPES = ("text", "int", "date", "date")
+
+
+def _window_start(end, amount: int, unit: str):
+    """Python equivalent of <end> - INTERVAL '<amount> <unit>'"""
+    if unit == "days":
+        return end - timedelta(days=amount)
+    if unit == "weeks":
+        return end - timedelta(weeks=amount)
+    if unit == "months":
+        return report_cache.shift_months(end, -amount)
+    return report_cache.shift_months(end, -12 * amount)
+
+
+def _resolve_range(presets, period, start, end, granularity):
+    """
+    Turn the legacy period preset and the optional from/to/granularity
+    parameters into (cache key, granularity, start, exclusive end)
+    """
+    if period not in presets:
+        period = "monthly"
+    default_granularity, amount, unit = presets[period]
+    granularity = granularity or default_granularity
+    if start is None and end is None:
+        key = f"{period}:{granularity}"
+    else:
+        key = f"{start}:{end}:{granularity}"
+    end = end or date.today()
+    try:
+        start = start or _window_start(end, amount, unit)
+        if start > end:
+            raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+        end = report_cache.day_after(end)
+        # The series code also needs the start of the bucket after the last one
+        report_cache.next_bucket(granularity, report_cache.bucket_start(granularity, end - timedelta(days=1)))
+    except (OverflowError, ValueError):
+        raise HTTPException(status_code=400, detail="'from' and 'to' are out of the supported date range")
+    buckets = report_cache.bucket_count(granularity, start, end)
+    if buckets > MAX_BUCKETS[granularity]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The range spans {buckets} {granularity} buckets, at most {MAX_BUCKETS[granularity]} are allowed",
+        )
+    return key, granularity, start, end
+
+
+def _series(statement: str, sql: str, current_gym_id: int, granularity: str):
+    def compute(start, end):
+        database.execute_prepared(statement, sql, SERIES_PARAM_TYPES, (granularity, current_gym_id, start, end))
+        return {row[0]: row[1] for row in database.cur.fetchall()}
+    return compute
+
+
 @router.get("/reports/revenue")
-def get_revenue_report(period: str = "monthly", current_gym_id: int = Depends(get_current_gym_id)):
-    """Get revenue data for charts"""
-    if period == "daily":
-        date_trunc = "DAY"
-        interval = "7 days"
-    elif period == "weekly":
-        date_trunc = "WEEK"
-        interval = "8 weeks"
-    elif period == "yearly":
-        date_trunc = "YEAR"
-        interval = "5 years"
-    else:  # monthly
-        date_trunc = "MONTH"
-        interval = "12 months"
+def get_revenue_report(
+    period: str = "monthly",
+    start: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    granularity: Optional[str] = Query(None, regex=GRANULARITY_PATTERN),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    """Get revenue data for charts, one entry per bucket between from and to"""
+    key, granularity, start, end = _resolve_range(REVENUE_PERIODS, period, start, to, granularity)
     
     try:
-        database.cur.execute(f"""
-            SELECT 
-                DATE_TRUNC('{date_trunc}', paid_at::date) as period,
-                SUM(amount) as total_revenue
-            FROM payments p
-            JOIN clients c ON p.client_id = c.id
-            WHERE paid_at >= CURRENT_DATE - INTERVAL '{interval}'
-                AND c.gym_id = %s
-            GROUP BY period
-            ORDER BY period
-        """, (current_gym_id,))
-        
-        rows = database.cur.fetchall()
+        buckets = report_cache.cached_series(
+            current_gym_id, "revenue", key, granularity, start, end,
+            _series("revenue_series", REVENUE_SERIES_SQL, current_gym_id, granularity),
+        )
         revenue_data = []
-        for row in rows:
-            try:
-                period_str = row[0].strftime('%Y-%m-%d') if row[0] is not None else None
-            except:
-                period_str = str(row[0]) if row[0] is not None else None
-            
+        for bucket in sorted(buckets):
+            total = buckets[bucket]
             revenue_data.append({
-                "period": period_str,
-                "total_revenue": float(row[1]) if row[1] is not None and str(row[1]).replace('.', '').replace('-', '').isdigit() else 0.0
+                "period": bucket.strftime('%Y-%m-%d'),
+                "total_revenue": float(total) if total is not None else 0.0
             })
         
         return {"revenue_data": revenue_data}
@@ -61,6 +153,10 @@ def get_revenue_report(period: str = "monthly", current_gym_id: int = Depends(ge
 @router.get("/reports/revenue-by-plan")
 def get_revenue_by_plan(current_gym_id: int = Depends(get_current_gym_id)):
     """Get revenue broken down by membership plan"""
+    cached = report_cache.lookup(current_gym_id, "revenue-by-plan")
+    if cached is not None:
+        return cached
+
     try:
         database.cur.execute("""
             SELECT 
@@ -69,10 +165,12 @@ def get_revenue_by_plan(current_gym_id: int = Depends(get_current_gym_id)):
             FROM plans p
             LEFT JOIN clients c ON p.id = c.plan_id
             LEFT JOIN payments pay ON c.id = pay.client_id
-            WHERE p.gym_id = %s AND c.gym_id = %s
+            WHERE p.gym_id = %s
             GROUP BY p.id, p.planname
+            -- Plans without members are left out, as when c.gym_id was filtered here
+            HAVING COUNT(c.id) > 0
             ORDER BY total_revenue DESC
-        """, (current_gym_id, current_gym_id))
+        """, (current_gym_id,))
         
         try:
             rows = database.cur.fetchall()
@@ -85,7 +183,9 @@ def get_revenue_by_plan(current_gym_id: int = Depends(get_current_gym_id)):
                 "total_revenue": float(row[1]) if row[1] is not None and str(row[1]).replace('.', '').replace('-', '').isdigit() else 0.0
             })
         
-        return {"plan_revenue": plan_revenue}
+        result = {"plan_revenue": plan_revenue}
+        report_cache.store(current_gym_id, "revenue-by-plan", result)
+        return result
     except Exception as e:
         print(f"Error in get_revenue_by_plan: {str(e)}")
         import traceback
@@ -95,47 +195,26 @@ def get_revenue_by_plan(current_gym_id: int = Depends(get_current_gym_id)):
         return {"plan_revenue": [], "error": str(e)}
 
 @router.get("/reports/client-growth")
-def get_client_growth(period: str = "monthly", current_gym_id: int = Depends(get_current_gym_id)):
-    """Get client growth data"""
-    if period == "daily":
-        date_trunc = "DAY"
-        interval = "30 days"
-    elif period == "weekly":
-        date_trunc = "WEEK"
-        interval = "12 weeks"
-    elif period == "yearly":
-        date_trunc = "YEAR"
-        interval = "5 years"
-    else:  # monthly
-        date_trunc = "MONTH"
-        interval = "24 months"
+def get_client_growth(
+    period: str = "monthly",
+    start: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    granularity: Optional[str] = Query(None, regex=GRANULARITY_PATTERN),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    """Get client growth data, one entry per bucket between from and to"""
+    key, granularity, start, end = _resolve_range(GROWTH_PERIODS, period, start, to, granularity)
     
     try:
-        database.cur.execute(f"""
-            SELECT 
-                DATE_TRUNC('{date_trunc}', created_at::date) as period,
-                COUNT(*) as new_clients
-            FROM clients 
-            WHERE created_at >= CURRENT_DATE - INTERVAL '{interval}'
-                AND gym_id = %s
-            GROUP BY period
-            ORDER BY period
-        """, (current_gym_id,))
-        
-        try:
-            rows = database.cur.fetchall()
-        except:
-            rows = []
+        buckets = report_cache.cached_series(
+            current_gym_id, "client-growth", key, granularity, start, end,
+            _series("client_growth_series", GROWTH_SERIES_SQL, current_gym_id, granularity),
+        )
         growth_data = []
-        for row in rows:
-            try:
-                period_str = row[0].strftime('%Y-%m-%d') if row[0] is not None else None
-            except:
-                period_str = str(row[0]) if row[0] is not None else None
-            
+        for bucket in sorted(buckets):
             growth_data.append({
-                "period": period_str,
-                "new_clients": row[1] if row[1] is not None else 0
+                "period": bucket.strftime('%Y-%m-%d'),
+                "new_clients": buckets[bucket] if buckets[bucket] is not None else 0
             })
         
         return {"growth_data": growth_data}
@@ -150,6 +229,10 @@ def get_client_growth(period: str = "monthly", current_gym_id: int = Depends(get
 @router.get("/reports/plan-distribution")
 def get_plan_distribution(current_gym_id: int = Depends(get_current_gym_id)):
     """Get distribution of clients by plan"""
+    cached = report_cache.lookup(current_gym_id, "plan-distribution")
+    if cached is not None:
+        return cached
+
     try:
         database.cur.execute("""
             SELECT 
@@ -157,10 +240,12 @@ def get_plan_distribution(current_gym_id: int = Depends(get_current_gym_id)):
                 COUNT(c.id) as client_count
             FROM plans p
             LEFT JOIN clients c ON p.id = c.plan_id
-            WHERE p.gym_id = %s AND c.gym_id = %s
+            WHERE p.gym_id = %s
             GROUP BY p.id, p.planname
+            -- Plans without members are left out, as when c.gym_id was filtered here
+            HAVING COUNT(c.id) > 0
             ORDER BY client_count DESC
-        """, (current_gym_id, current_gym_id))
+        """, (current_gym_id,))
         
         try:
             rows = database.cur.fetchall()
@@ -173,7 +258,9 @@ def get_plan_distribution(current_gym_id: int = Depends(get_current_gym_id)):
                 "client_count": row[1] if row[1] is not None else 0
             })
         
-        return {"plan_distribution": plan_distribution}
+        result = {"plan_distribution": plan_distribution}
+        report_cache.store(current_gym_id, "plan-distribution", result)
+        return result
     except Exception as e:
         print(f"Error in get_plan_distribution: {str(e)}")
         import traceback
@@ -185,6 +272,10 @@ def get_plan_distribution(current_gym_id: int = Depends(get_current_gym_id)):
 @router.get("/reports/payment-methods")
 def get_payment_methods(current_gym_id: int = Depends(get_current_gym_id)):
     """Get payment method distribution"""
+    cached = report_cache.lookup(current_gym_id, "payment-methods")
+    if cached is not None:
+        return cached
+
     try:
         database.cur.execute("""
             SELECT 
@@ -192,9 +283,8 @@ def get_payment_methods(current_gym_id: int = Depends(get_current_gym_id)):
                 COUNT(*) as count,
                 SUM(amount) as total_amount
             FROM payments p
-            JOIN clients c ON p.client_id = c.id
             WHERE method IS NOT NULL
-                AND c.gym_id = %s
+                AND p.gym_id = %s
             GROUP BY method
             ORDER BY total_amount DESC
         """, (current_gym_id,))
@@ -211,7 +301,9 @@ def get_payment_methods(current_gym_id: int = Depends(get_current_gym_id)):
                 "total_amount": float(row[2]) if row[2] is not None and str(row[2]).replace('.', '').replace('-', '').isdigit() else 0.0
             })
         
-        return {"payment_methods": payment_methods}
+        result = {"payment_methods": payment_methods}
+        report_cache.store(current_gym_id, "payment-methods", result)
+        return result
     except Exception as e:
         print(f"Error in get_payment_methods: {str(e)}")
         import traceback
@@ -223,6 +315,10 @@ def get_payment_methods(current_gym_id: int = Depends(get_current_gym_id)):
 @router.get("/reports/membership-status")
 def get_membership_status(current_gym_id: int = Depends(get_current_gym_id)):
     """Get membership status distribution"""
+    cached = report_cache.lookup(current_gym_id, "membership-status")
+    if cached is not None:
+        return cached
+
     try:
         database.cur.execute("""
             SELECT 
@@ -249,7 +345,9 @@ def get_membership_status(current_gym_id: int = Depends(get_current_gym_id)):
                 "count": row[1] if row[1] is not None else 0
             })
         
-        return {"membership_status": membership_status}
+        result = {"membership_status": membership_status}
+        report_cache.store(current_gym_id, "membership-status", result)
+        return result
     except Exception as e:
         print(f"Error in get_membership_status: {str(e)}")
         import traceback
@@ -261,6 +359,10 @@ def get_membership_status(current_gym_id: int = Depends(get_current_gym_id)):
 @router.get("/reports/age-distribution")
 def get_age_distribution(current_gym_id: int = Depends(get_current_gym_id)):
     """Get client age distribution"""
+    cached = report_cache.lookup(current_gym_id, "age-distribution")
+    if cached is not None:
+        return cached
+
     try:
         database.cur.execute("""
             SELECT 
@@ -314,7 +416,9 @@ def get_age_distribution(current_gym_id: int = Depends(get_current_gym_id)):
                 "count": row[1] if row[1] is not None else 0
             })
         
-        return {"age_distribution": age_distribution}
+        result = {"age_distribution": age_distribution}
+        report_cache.store(current_gym_id, "age-distribution", result)
+        return result
     except Exception as e:
         print(f"Error in get_age_distribution: {str(e)}")
         import traceback
@@ -326,6 +430,10 @@ def get_age_distribution(current_gym_id: int = Depends(get_current_gym_id)):
 @router.get("/reports/gender-distribution")
 def get_gender_distribution(current_gym_id: int = Depends(get_current_gym_id)):
     """Get client gender distribution"""
+    cached = report_cache.lookup(current_gym_id, "gender-distribution")
+    if cached is not None:
+        return cached
+
     try:
         database.cur.execute("""
             SELECT 
@@ -348,11 +456,351 @@ def get_gender_distribution(current_gym_id: int = Depends(get_current_gym_id)):
                 "count": row[1] if row[1] is not None else 0
             })
         
-        return {"gender_distribution": gender_distribution}
+        result = {"gender_distribution": gender_distribution}
+        report_cache.store(current_gym_id, "gender-distribution", result)
+        return result
     except Exception as e:
         print(f"Error in get_gender_distribution: {str(e)}")
         import traceback
         traceback.print_exc()
         # Rollback transaction in case of error
         database.conn.rollback()
-        return {"gender_distribution": [], "error": str(e)}
\ No newline at end of file
+        return {"gender_distribution": [], "error": str(e)}
+
+def _month_offset(cohort_month: date, month: date) -> int:
+    return (month.year - cohort_month.year) * 12 + month.month - cohort_month.month
+
+
+def _cohort_rows(current_gym_id: int, first_month: date, last_month: date):
+    """(cohort month, month, members) of the cohorts from first_month, read from the rollup"""
+    database.cur.execute("""
+        SELECT cohort_month, month, members
+        FROM membership_cohorts
+        WHERE gym_id = %s AND cohort_month >= %s AND month <= %s
+        ORDER BY cohort_month, month
+    """, (current_gym_id, first_month, last_month))
+    return database.cur.fetchall()
+
+
+def _cohorts(rows, last_month: date):
+    """Cohort sizes and members still active n months later, by cohort month"""
+    cohorts = {}
+    for cohort_month, month, members in rows:
+        cohort = cohorts.setdefault(cohort_month, [0] * (_month_offset(cohort_month, last_month) + 1))
+        cohort[_month_offset(cohort_month, month)] = members
+    return cohorts
+
+
+@router.get("/reports/cohorts")
+def get_cohorts(months: int = Query(12, ge=1, le=60), current_gym_id: int = Depends(get_current_gym_id)):
+    """Monthly join cohorts of the last months and the share of each still active in the months after"""
+    cache_key = f"cohorts:{months}"
+    cached = report_cache.lookup(current_gym_id, cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        last_month = report_cache.bucket_start("month", date.today())
+        first_month = report_cache.shift_months(last_month, -(months - 1))
+        cohorts = _cohorts(_cohort_rows(current_gym_id, first_month, last_month), last_month)
+        result = {"cohorts": [
+            {
+                "cohort": cohort_month.strftime('%Y-%m'),
+                "members": counts[0],
+                "retention": [
+                    {
+                        "month_offset": offset,
+                        "members": members,
+                        "rate": round(100.0 * members / counts[0], 1) if counts[0] else 0.0,
+                    }
+                    for offset, members in enumerate(counts)
+                ],
+            }
+            for cohort_month, counts in sorted(cohorts.items())
+        ]}
+        report_cache.store(current_gym_id, cache_key, result)
+        return result
+    except Exception as e:
+        print(f"Error in get_cohorts: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        # Rollback transaction in case of error
+        database.conn.rollback()
+        return {"cohorts": [], "error": str(e)}
+
+
+@router.get("/reports/retention")
+def get_retention(months: int = Query(12, ge=1, le=60), current_gym_id: int = Depends(get_current_gym_id)):
+    """
+    Active, new and continuing members per month, and the retention curve:
+    the share of members still active n months after joining, over all
+    cohorts of the last months that are at least n months old
+    """
+    cache_key = f"retention:{months}"
+    cached = report_cache.lookup(current_gym_id, cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        last_month = report_cache.bucket_start("month", date.today())
+        first_month = report_cache.shift_months(last_month, -(months - 1))
+        database.cur.execute("""
+            SELECT s.month::date,
+                   COALESCE(SUM(mc.members), 0),
+                   COALESCE(SUM(mc.members) FILTER (WHERE mc.cohort_month = s.month), 0)
+            FROM generate_series(%s::date, %s::date, INTERVAL '1 month') AS s(month)
+            LEFT JOIN membership_cohorts mc ON mc.gym_id = %s AND mc.month = s.month
+            GROUP BY s.month
+            ORDER BY s.month
+        """, (first_month, last_month, current_gym_id))
+        monthly = [
+            {"month": month.strftime('%Y-%m'), "active": active, "new": new, "continuing": active - new}
+            for month, active, new in database.cur.fetchall()
+        ]
+
+        cohorts = _cohorts(_cohort_rows(current_gym_id, first_month, last_month), last_month)
+        curve = []
+        for offset in range(months):
+            # Cohorts old enough to have reached this offset
+            reached = [counts for counts in cohorts.values() if len(counts) > offset]
+            joined = sum(counts[0] for counts in reached)
+            if not joined:
+                break
+            active = sum(counts[offset] for counts in reached)
+            curve.append({
+                "month_offset": offset,
+                "cohorts": len(reached),
+                "members": joined,
+                "rate": round(100.0 * active / joined, 1),
+            })
+
+        result = {"monthly": monthly, "curve": curve}
+        report_cache.store(current_gym_id, cache_key, result)
+        return result
+    except Exception as e:
+        print(f"Error in get_retention: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        # Rollback transaction in case of error
+        database.conn.rollback()
+        return {"monthly": [], "curve": [], "error": str(e)}
+
+
+@router.get("/reports/churn")
+def get_churn(months: int = Query(12, ge=1, le=60), current_gym_id: int = Depends(get_current_gym_id)):
+    """
+    Monthly churn from the nightly membership snapshots: members active at
+    the start of each month, joined, returned and lapsed during it, and at
+    its end. Reads one rollup row per month, however long the history.
+    """
+    cache_key = f"churn:{months}"
+    cached = report_cache.lookup(current_gym_id, cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        first_month = report_cache.shift_months(report_cache.bucket_start("month", date.today()), -(months - 1))
+        database.cur.execute("""
+            SELECT month, opening, joined, returned, lapsed, closing
+            FROM membership_churn
+            WHERE gym_id = %s AND month >= %s
+            ORDER BY month
+        """, (current_gym_id, first_month))
+        churn = []
+        for month, opening, joined, returned, lapsed, closing in database.cur.fetchall():
+            churn_rate = round(100.0 * lapsed / opening, 1) if opening else None
+            churn.append({
+                "month": month.strftime('%Y-%m'),
+                "opening": opening,
+                "joined": joined,
+                "returned": returned,
+                "lapsed": lapsed,
+                "closing": closing,
+                "churn_rate": churn_rate,
+                "retention_rate": round(100.0 - churn_rate, 1) if churn_rate is not None else None,
+            })
+
+        result = {"churn": churn}
+        report_cache.store(current_gym_id, cache_key, result)
+        return result
+    except Exception as e:
+        print(f"Error in get_churn: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        # Rollback transaction in case of error
+        database.conn.rollback()
+        return {"churn": [], "error": str(e)}
+
+
+@router.get("/reports/forecast")
+def get_revenue_forecast(
+    days: int = Query(forecast.HORIZON_DAYS, ge=1, le=forecast.HORIZON_DAYS),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    """
+    Projected renewal revenue per day for the next days, with an 80% band,
+    and totals for 30, 60 and 90 days. Cached until the next payment or
+    renewal of the gym.
+    """
+    if not forecast.available():
+        raise HTTPException(status_code=501, detail="Forecasts require the numpy package")
+    result = report_cache.lookup(current_gym_id, "forecast")
+    if result is None:
+        try:
+            result = forecast.forecast(database.cur, current_gym_id)
+        except Exception as e:
+            print(f"Error in get_revenue_forecast: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            # Rollback transaction in case of error
+            database.conn.rollback()
+            return {"days": [], "totals": {}, "error": str(e)}
+        report_cache.store(current_gym_id, "forecast", result)
+    return {**result, "days": result["days"][:days]}
+
+
+# Receivables aging: a balance is due AR_TERMS_DAYS after its period started.
+# bucket -> (min, max) days overdue, inclusive, None for open-ended
+AR_TERMS_DAYS = int(os.getenv('AR_TERMS_DAYS', '0'))
+AGING_BUCKETS = {
+    "current": (None, 0),
+    "1-30": (1, 30),
+    "31-60": (31, 60),
+    "61-90": (61, 90),
+    "90+": (91, None),
+}
+
+
+def _aging_range(bucket: str, today: date):
+    """SQL condition and parameters on clients c for a bucket, as a start_date range for idx_clients_gym_due"""
+    low, high = AGING_BUCKETS[bucket]
+    due_today = today - timedelta(days=AR_TERMS_DAYS)
+    conditions, params = [], []
+    if high is not None:
+        conditions.append("c.start_date >= %s")
+        params.append(due_today - timedelta(days=high))
+    if low is not None:
+        conditions.append("c.start_date <= %s")
+        params.append(due_today - timedelta(days=low))
+    return " AND ".join(conditions), params
+
+
+def _aging_cursor(start_date, client_id) -> str:
+    return base64.urlsafe_b64encode(f"{start_date.isoformat()}|{client_id}".encode()).decode()
+
+
+def _parse_aging_cursor(cursor: str):
+    try:
+        start_date, _, client_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition("|")
+        return date.fromisoformat(start_date), int(client_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/reports/ar-aging")
+def get_ar_aging(current_gym_id: int = Depends(get_current_gym_id)):
+    """Members owing money and their balances by days overdue, from one grouped query"""
+    cached = report_cache.lookup(current_gym_id, "ar-aging")
+    if cached is not None:
+        return cached
+
+    try:
+        today = date.today()
+        cases, params = [], []
+        for bucket in AGING_BUCKETS:
+            condition, bounds = _aging_range(bucket, today)
+            cases.append(f"WHEN {condition} THEN %s")
+            params.extend(bounds + [bucket])
+        database.cur.execute(f"""
+            SELECT CASE {" ".join(cases)} END AS bucket, COUNT(*), SUM(c.balance_due), MIN(c.start_date)
+            FROM clients c
+            WHERE c.gym_id = %s AND c.balance_due > 0 AND c.start_date IS NOT NULL
+            GROUP BY 1
+        """, params + [current_gym_id])
+        totals = {row[0]: row[1:] for row in database.cur.fetchall()}
+
+        buckets = []
+        for bucket in AGING_BUCKETS:
+            members, amount, oldest = totals.get(bucket, (0, 0, None))
+            buckets.append({
+                "bucket": bucket,
+                "members": members,
+                "balance_due": float(amount or 0),
+                "oldest_start_date": str(oldest) if oldest else None,
+            })
+        result = {
+            "terms_days": AR_TERMS_DAYS,
+            "buckets": buckets,
+            "total_members": sum(bucket["members"] for bucket in buckets),
+            "total_balance_due": round(sum(bucket["balance_due"] for bucket in buckets), 2),
+        }
+        report_cache.store(current_gym_id, "ar-aging", result)
+        return result
+    except Exception as e:
+        print(f"Error in get_ar_aging: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        # Rollback transaction in case of error
+        database.conn.rollback()
+        return {"buckets": [], "error": str(e)}
+
+
+@router.get("/reports/ar-aging/{bucket}")
+def get_ar_aging_members(
+    bucket: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    """
+    Members in one aging bucket, longest overdue first, with their latest
+    payment. Pages are read by keyset from idx_clients_gym_due; pass
+    next_cursor back as cursor.
+    """
+    if bucket not in AGING_BUCKETS:
+        raise HTTPException(status_code=404, detail=f"Unknown bucket, use one of {', '.join(AGING_BUCKETS)}")
+    today = date.today()
+    condition, params = _aging_range(bucket, today)
+    conditions = ["c.gym_id = %s", "c.balance_due > 0", condition]
+    params = [current_gym_id] + params
+    if cursor is not None:
+        conditions.append("(c.start_date, c.id) > (%s, %s)")
+        params.extend(_parse_aging_cursor(cursor))
+
+    database.cur.execute(f"""
+        SELECT c.id, c.clientname, c.phonenumber, c.plan_id, c.start_date, c.end_date,
+               c.total_paid, c.balance_due, lp.paid_at
+        FROM clients c
+        LEFT JOIN LATERAL (
+            SELECT p.paid_at FROM payments p
+            WHERE p.client_id = c.id
+            ORDER BY p.paid_at DESC
+            LIMIT 1
+        ) lp ON TRUE
+        WHERE {" AND ".join(conditions)}
+        ORDER BY c.start_date, c.id
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = database.cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "bucket": bucket,
+        "members": [
+            {
+                "id": row[0],
+                "clientname": row[1],
+                "phonenumber": str(row[2]) if row[2] else "",
+                "plan_id": row[3],
+                "start_date": str(row[4]),
+                "end_date": str(row[5]) if row[5] else None,
+                "total_paid": float(row[6] or 0),
+                "balance_due": float(row[7] or 0),
+                "days_overdue": max((today - row[4]).days - AR_TERMS_DAYS, 0),
+                "last_payment": str(row[8]) if row[8] else None,
+            }
+            for row in rows
+        ],
+        "next_cursor": _aging_cursor(rows[-1][4], rows[-1][0]) if has_more else None,
+    }
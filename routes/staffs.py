@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 from typing import Optional
 from config import database
+from services import projection
 from fastapi import Depends
 from index import get_current_user, get_current_gym_id
 
@@ -30,20 +31,25 @@ def create_staffs(staffs: StaffModel, current_gym_id: int = Depends(get_current_
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# Columns of the staff list, selectable with ?fields=
+STAFF_COLUMNS = {
+    "id": ("id", lambda value: value),
+    "staffname": ("staffname", lambda value: value),
+    "email": ("email", lambda value: value),
+    "phonenumber": ("phonenumber", lambda value: int(value)),
+    "role": ("role", lambda value: value),
+}
+
+
 @router.get("/staffs/")
-def get_staffs(current_gym_id: int = Depends(get_current_gym_id)):
-    database.cur.execute("SELECT id,staffname,email,phonenumber,role FROM staffs WHERE gym_id = %s", (current_gym_id,))
+def get_staffs(
+    fields: Optional[str] = Query(None, description="Comma separated columns to return, e.g. staffname,role"),
+    current_gym_id: int = Depends(get_current_gym_id),
+):
+    names = projection.choose(STAFF_COLUMNS, fields)
+    database.cur.execute(f"SELECT {projection.select_list(STAFF_COLUMNS, names)} FROM staffs WHERE gym_id = %s", (current_gym_id,))
     rows = database.cur.fetchall()
-    staffs = []
-    for row in rows:
-        staffs.append({
-            "id": row[0],
-            "staffname": row[1],
-            "email": row[2],
-            "phonenumber": int(row[3]),
-            "role": row[4],
-        })
-    return {"staffs": staffs}
+    return {"staffs": [projection.serialize(STAFF_COLUMNS, names, row) for row in rows]}
 
 
 @router.put("/staffs/{staffs_id}")
@@ -0,0 +1,3 @@
+from . import report_cache, metrics, slow_queries, attendance, scheduler, notifications, member_lists, live, tenancy, rate_limit, compression, assets, projection, repricing, memberships, forecast
+
+__all__ = ["report_cache", "metrics", "slow_queries", "attendance", "scheduler", "notifications", "member_lists", "live", "tenancy", "rate_limit", "compression", "assets", "projection", "repricing", "memberships", "forecast"]
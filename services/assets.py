@@ -0,0 +1,185 @@
+"""
+Precompressed, content-hashed static assets
+
+The files under web/styles and web/scripts are read once, hashed and
+compressed at the highest gzip and brotli levels up front, and served from
+/static under names that carry their hash (styles/main.3f9a61c2d0b4.css).
+A changed file gets a new URL, so responses can be cached by browsers for a
+year without revalidation. index.html is rewritten to reference the hashed
+URLs and is itself never cached. Everything is built at startup; after that,
+serving index.html starts a rescan in a background thread at most every
+ASSET_REFRESH_INTERVAL seconds (0 turns rescans off), and files whose
+modification time changed are rebuilt, so edits show up on a later reload
+without a request ever waiting on a scan or a bundle build.
+
+When build_frontend has a minified bundle for the current main.jsx, the
+page loads that instead of main.jsx, without Babel and with the production
+builds of React.
+"""
+
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+from fastapi import Response
+
+import build_frontend
+from services import compression
+
+WEB_DIR = "web"
+ASSET_DIRS = ("styles", "scripts")
+URL_PREFIX = "/static/"
+IMMUTABLE = "public, max-age=31536000, immutable"
+REFRESH_INTERVAL = float(os.getenv('ASSET_REFRESH_INTERVAL', '10'))
+
+logger = logging.getLogger("gymbook.assets")
+
+mimetypes.add_type("text/jsx", ".jsx")
+
+# src="scripts/main.jsx", href="/styles/main.css"
+_REFERENCE = re.compile(r'(src|href)="/?((?:%s)/[^"]+)"' % "|".join(ASSET_DIRS))
+_JSX_SCRIPT = re.compile(r'<script type="text/babel" src="/?scripts/main\.jsx"></script>')
+_BABEL_SCRIPT = re.compile(r'[ \t]*<!-- Babel for JSX processing -->\s*<script src="[^"]*@babel/standalone[^"]*"></script>\n?')
+
+
+def _use_bundle(html: str, url: str) -> str:
+    """Point index.html at the precompiled bundle and drop in-browser Babel"""
+    html = _JSX_SCRIPT.sub(f'<script src="{url}"></script>', html)
+    html = _BABEL_SCRIPT.sub("", html)
+    return html.replace("react.development.js", "react.production.min.js").replace(
+        "react-dom.development.js", "react-dom.production.min.js")
+
+
+class Asset:
+    def __init__(self, path: str, content: bytes, mtime: float):
+        self.path = path
+        self.mtime = mtime
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        stem, ext = os.path.splitext(path)
+        self.hashed_path = f"{stem}.{digest}{ext}"
+        self.url = URL_PREFIX + self.hashed_path
+        self.etag = f'"{digest}"'
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.bodies = {None: content}
+        if compression.compressible(self.media_type):
+            for encoding in compression.available_encodings():
+                compressed = compression.compress(content, encoding, level=11 if encoding == "br" else 9)
+                if len(compressed) < len(content):
+                    self.bodies[encoding] = compressed
+
+
+class AssetStore:
+    def __init__(self, web_dir: str = WEB_DIR, refresh_interval: float = REFRESH_INTERVAL):
+        self.web_dir = web_dir
+        self.refresh_interval = refresh_interval
+        self._by_path = {}
+        self._by_hashed_path = {}
+        self._index = None
+        self._index_mtime = None
+        self._bundle = None
+        self._bundle_file = None
+        self._lock = threading.Lock()
+        self._next_refresh = 0.0
+        self._refreshing = False
+        self._schedule_lock = threading.Lock()
+
+    def _scan(self) -> dict:
+        """path relative to web_dir -> modification time"""
+        found = {}
+        for folder in ASSET_DIRS:
+            for root, _, files in os.walk(os.path.join(self.web_dir, folder)):
+                for name in files:
+                    full = os.path.join(root, name)
+                    found[os.path.relpath(full, self.web_dir).replace(os.sep, "/")] = os.path.getmtime(full)
+        return found
+
+    def refresh(self):
+        """(Re)build the assets whose files changed since the last build"""
+        found = self._scan()
+        index_mtime = os.path.getmtime(os.path.join(self.web_dir, "index.html"))
+        with self._lock:
+            bundle_file = build_frontend.bundle()
+            current = {path: asset.mtime for path, asset in self._by_path.items()}
+            if found == current and index_mtime == self._index_mtime and bundle_file == self._bundle_file:
+                return
+            by_path = {}
+            for path, mtime in found.items():
+                asset = self._by_path.get(path)
+                if asset is None or asset.mtime != mtime:
+                    with open(os.path.join(self.web_dir, path), "rb") as f:
+                        asset = Asset(path, f.read(), mtime)
+                by_path[path] = asset
+            bundle = self._bundle if bundle_file == self._bundle_file else None
+            if bundle is None and bundle_file is not None:
+                with open(bundle_file, "rb") as f:
+                    bundle = Asset("build/main.js", f.read(), os.path.getmtime(bundle_file))
+            self._by_path = by_path
+            self._bundle = bundle
+            self._bundle_file = bundle_file
+            self._by_hashed_path = {asset.hashed_path: asset for asset in by_path.values()}
+            with open(os.path.join(self.web_dir, "index.html"), encoding="utf-8") as f:
+                html = f.read()
+            if bundle is not None:
+                self._by_hashed_path[bundle.hashed_path] = bundle
+                html = _use_bundle(html, bundle.url)
+            self._index = _REFERENCE.sub(self._rewrite, html)
+            self._index_mtime = index_mtime
+
+    def _rewrite(self, match) -> str:
+        asset = self._by_path.get(match.group(2))
+        return f'{match.group(1)}="{asset.url if asset else "/" + match.group(2)}"'
+
+    def url(self, path: str) -> Optional[str]:
+        asset = self._by_path.get(path)
+        return asset.url if asset else None
+
+    def index_html(self) -> str:
+        if self._index is None:
+            self.refresh()
+        else:
+            self._refresh_in_background()
+        return self._index
+
+    def _refresh_in_background(self):
+        """Start a refresh off the request, at most every refresh_interval seconds"""
+        if self.refresh_interval <= 0:
+            return
+        now = time.monotonic()
+        with self._schedule_lock:
+            if self._refreshing or now < self._next_refresh:
+                return
+            self._refreshing = True
+            self._next_refresh = now + self.refresh_interval
+        threading.Thread(target=self._background_refresh, name="asset-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Refreshing the static assets failed")
+        finally:
+            with self._schedule_lock:
+                self._refreshing = False
+
+    def response(self, hashed_path: str, accept_encoding: str, if_none_match: Optional[str]) -> Optional[Response]:
+        """The asset's response for the client, or None if no current asset has that name"""
+        asset = self._by_hashed_path.get(hashed_path)
+        if asset is None:
+            return None
+        headers = {"Cache-Control": IMMUTABLE, "ETag": asset.etag, "Vary": "Accept-Encoding"}
+        if if_none_match == asset.etag:
+            return Response(status_code=304, headers=headers)
+        encoding = compression.negotiate(accept_encoding)
+        if encoding in asset.bodies:
+            headers["Content-Encoding"] = encoding
+        else:
+            encoding = None
+        return Response(asset.bodies[encoding], media_type=asset.media_type, headers=headers)
+
+
+store = AssetStore()
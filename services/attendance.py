@@ -0,0 +1,320 @@
+"""
+Member check-in ingestion
+
+Door scans are validated against an in-memory index of each gym's members
+(start and end dates), so an accepted scan never waits on the database; a
+scan the index would refuse is rechecked against the member's row first, in
+case another worker created or renewed the member. Accepted and denied
+scans are buffered and written to the append-only attendance table in
+batches by a background thread using its own connection. The same
+transaction folds the accepted scans into the attendance_hourly and
+attendance_member_daily rollups that the attendance reports read.
+
+A batch that fails is retried up to FLUSH_ATTEMPTS times, then written row
+by row; rows the database rejects on their own go to attendance_dead_letters
+so they cannot block newer scans. At most CHECKIN_MAX_PENDING rows are kept
+while the database is unreachable, dropping the oldest.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from config import database
+
+FLUSH_INTERVAL = float(os.getenv('CHECKIN_FLUSH_INTERVAL', '1.0'))
+FLUSH_BATCH = int(os.getenv('CHECKIN_FLUSH_BATCH', '500'))
+FLUSH_ATTEMPTS = int(os.getenv('CHECKIN_FLUSH_ATTEMPTS', '3'))
+MAX_PENDING = int(os.getenv('CHECKIN_MAX_PENDING', '50000'))
+INDEX_TTL = float(os.getenv('CHECKIN_INDEX_TTL', '300'))
+# Assumed length of a visit, for live occupancy
+VISIT_MINUTES = int(os.getenv('VISIT_MINUTES', '90'))
+# Timezone of the rollup hours and days; the server's local zone by default
+TIMEZONE = ZoneInfo(os.environ['ATTENDANCE_TIMEZONE']) if os.getenv('ATTENDANCE_TIMEZONE') else None
+
+logger = logging.getLogger("gymbook.attendance")
+
+
+def local_time(moment: datetime) -> datetime:
+    """Naive local wall-clock time of an aware timestamp"""
+    return moment.astimezone(TIMEZONE).replace(tzinfo=None)
+
+
+def _rollups(rows):
+    """Aggregate accepted scans into hourly and member-daily visit counts"""
+    hourly = Counter()
+    member_daily = Counter()
+    for gym_id, client_id, checked_in_at, allowed, _, _ in rows:
+        if not allowed:
+            continue
+        local = local_time(checked_in_at)
+        hourly[(gym_id, local.replace(minute=0, second=0, microsecond=0))] += 1
+        member_daily[(gym_id, client_id, local.date())] += 1
+    return (
+        [(gym_id, hour, visits) for (gym_id, hour), visits in hourly.items()],
+        [(gym_id, client_id, day, visits) for (gym_id, client_id, day), visits in member_daily.items()],
+    )
+
+
+class MembershipIndex:
+    """Per-gym map of client_id -> (start_date, end_date), loaded on first use"""
+
+    def __init__(self, ttl: float = INDEX_TTL):
+        self.ttl = ttl
+        self._gyms = {}
+        self._loaded_at = {}
+        self._lock = threading.Lock()
+
+    def _load(self, gym_id: int) -> dict:
+        database.cur.execute("SELECT id, start_date, end_date FROM clients WHERE gym_id = %s", (gym_id,))
+        members = {row[0]: (row[1], row[2]) for row in database.cur.fetchall()}
+        with self._lock:
+            self._gyms[gym_id] = members
+            self._loaded_at[gym_id] = time.monotonic()
+        return members
+
+    def members(self, gym_id: int) -> dict:
+        """Members of a gym, reloaded after ttl seconds to pick up other workers' writes"""
+        with self._lock:
+            members = self._gyms.get(gym_id)
+            fresh = members is not None and time.monotonic() - self._loaded_at[gym_id] < self.ttl
+        return members if fresh else self._load(gym_id)
+
+    def refresh(self, gym_id: int, client_id: int):
+        """Reread one member from the database, e.g. before refusing a scan; returns its dates or None"""
+        database.cur.execute("SELECT start_date, end_date FROM clients WHERE id = %s AND gym_id = %s", (client_id, gym_id))
+        row = database.cur.fetchone()
+        if row is None:
+            self.remove(gym_id, client_id)
+            return None
+        self.update(gym_id, client_id, row[0], row[1])
+        return row[0], row[1]
+
+    def update(self, gym_id: int, client_id: int, start_date, end_date):
+        """Called after a committed client write so scans see it immediately"""
+        with self._lock:
+            if gym_id in self._gyms:
+                self._gyms[gym_id][client_id] = (start_date, end_date)
+
+    def remove(self, gym_id: int, client_id: int):
+        with self._lock:
+            if gym_id in self._gyms:
+                self._gyms[gym_id].pop(client_id, None)
+
+
+class CheckinBuffer:
+    """Collects check-in rows and flushes them to attendance in batches"""
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, flush_batch: int = FLUSH_BATCH,
+                 max_pending: int = MAX_PENDING, max_attempts: int = FLUSH_ATTEMPTS):
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_attempts = max_attempts
+        self.dropped = 0
+        self._rows = deque(maxlen=max_pending)
+        # Batch whose write failed and how often, retried before newer rows
+        self._failed = []
+        self._attempts = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+
+    def add(self, row: tuple):
+        with self._lock:
+            if len(self._rows) == self._rows.maxlen:
+                # The deque drops the oldest row on append
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    logger.warning(f"Check-in buffer full, {self.dropped} check-ins dropped")
+            self._rows.append(row)
+            full = len(self._rows) >= self.flush_batch
+        if full:
+            self._wake.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows) + len(self._failed)
+
+    def pending_rows(self) -> list:
+        """Rows not written yet, oldest first"""
+        with self._lock:
+            return self._failed + list(self._rows)
+
+    def _write(self, rows):
+        if self._conn is None or self._conn.closed:
+            self._conn = database.connect()
+        with self._conn.cursor() as cur:
+            execute_values(cur, """
+                INSERT INTO attendance (gym_id, client_id, checked_in_at, allowed, reason, device)
+                VALUES %s
+            """, rows, page_size=self.flush_batch)
+            hourly, member_daily = _rollups(rows)
+            if hourly:
+                execute_values(cur, """
+                    INSERT INTO attendance_hourly (gym_id, hour, visits)
+                    VALUES %s
+                    ON CONFLICT (gym_id, hour)
+                    DO UPDATE SET visits = attendance_hourly.visits + EXCLUDED.visits
+                """, hourly, page_size=self.flush_batch)
+                execute_values(cur, """
+                    INSERT INTO attendance_member_daily (gym_id, client_id, day, visits)
+                    VALUES %s
+                    ON CONFLICT (gym_id, client_id, day)
+                    DO UPDATE SET visits = attendance_member_daily.visits + EXCLUDED.visits
+                """, member_daily, page_size=self.flush_batch)
+        self._conn.commit()
+
+    def _rollback(self):
+        if self._conn is not None and not self._conn.closed:
+            self._conn.rollback()
+
+    def _dead_letter(self, row: tuple, error: Exception):
+        try:
+            with self._conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO attendance_dead_letters (gym_id, client_id, checked_in_at, allowed, reason, device, error)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, row + (str(error),))
+            self._conn.commit()
+        except psycopg2.Error as e:
+            self._rollback()
+            logger.error(f"Dropped check-in {row}: {error} (dead letter not stored: {e})")
+
+    def _write_rows(self, rows) -> list:
+        """
+        Write rows one at a time, setting aside those the database rejects;
+        returns the rows left when the database itself fails
+        """
+        for index, row in enumerate(rows):
+            try:
+                self._write([row])
+            except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                self._rollback()
+                self._dead_letter(row, e)
+            except Exception as e:
+                self._rollback()
+                logger.error(f"Failed to write check-ins one by one: {e}")
+                return rows[index:]
+        return []
+
+    def flush(self):
+        """Write the failed batch, if any, then the buffered rows"""
+        while True:
+            with self._lock:
+                if self._failed:
+                    rows, attempts = self._failed, self._attempts
+                    self._failed = []
+                else:
+                    rows, attempts = list(self._rows), 0
+                    self._rows.clear()
+            if not rows:
+                return
+            if attempts >= self.max_attempts:
+                rows = self._write_rows(rows)
+            else:
+                try:
+                    self._write(rows)
+                    rows = []
+                except Exception as e:
+                    logger.error(f"Failed to flush {len(rows)} check-ins (attempt {attempts + 1}): {e}")
+                    self._rollback()
+                    attempts += 1
+            if rows:
+                with self._lock:
+                    self._failed, self._attempts = rows, attempts
+                return
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="checkin-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+
+
+class Occupancy:
+    """
+    Distinct members with an accepted scan in the last VISIT_MINUTES: the
+    written scans from attendance, read through idx_attendance_gym_time, plus
+    this worker's unflushed ones. Other workers' unflushed scans are at most
+    FLUSH_INTERVAL old.
+    """
+
+    def __init__(self, buffer: CheckinBuffer, visit_minutes: int = VISIT_MINUTES):
+        self.buffer = buffer
+        self.window = timedelta(minutes=visit_minutes)
+
+    def count(self, gym_id: int, cur=None) -> int:
+        cur = cur or database.cur
+        cutoff = datetime.now(timezone.utc) - self.window
+        cur.execute("""
+            SELECT DISTINCT client_id FROM attendance
+            WHERE gym_id = %s AND checked_in_at >= %s AND allowed
+        """, (gym_id, cutoff))
+        members = {row[0] for row in cur.fetchall()}
+        members.update(
+            client_id
+            for row_gym, client_id, checked_in_at, allowed, _, _ in self.buffer.pending_rows()
+            if row_gym == gym_id and allowed and checked_in_at >= cutoff
+        )
+        return len(members)
+
+
+membership_index = MembershipIndex()
+buffer = CheckinBuffer()
+occupancy = Occupancy(buffer)
+
+
+def _decide(membership, today: date):
+    """(allowed, reason) for a member's (start_date, end_date), or for None when the member is unknown"""
+    if membership is None:
+        return False, "unknown_member"
+    if membership[1] is None or membership[1] < today:
+        return False, "expired"
+    if membership[0] is not None and membership[0] > today:
+        return False, "not_started"
+    return True, None
+
+
+def check_in(gym_id: int, client_id: int, device=None) -> dict:
+    """Validate a scan against the membership index and queue it for writing"""
+    today = date.today()
+    membership = membership_index.members(gym_id).get(client_id)
+    allowed, reason = _decide(membership, today)
+    if not allowed:
+        # The index may predate a join or renewal handled by another worker
+        membership = membership_index.refresh(gym_id, client_id)
+        allowed, reason = _decide(membership, today)
+
+    checked_in_at = datetime.now(timezone.utc)
+    buffer.add((gym_id, client_id, checked_in_at, allowed, reason, device))
+    return {
+        "client_id": client_id,
+        "allowed": allowed,
+        "reason": reason,
+        "end_date": str(membership[1]) if membership and membership[1] else None,
+        "checked_in_at": checked_in_at.isoformat(),
+    }
@@ -0,0 +1,176 @@
+"""
+Response compression
+
+CompressionMiddleware compresses text and JSON responses with brotli or gzip,
+whichever the client prefers in Accept-Encoding (brotli only when the
+optional brotli package is installed). Responses sent in one piece are
+compressed whole if they are at least COMPRESS_MIN_BYTES long; streamed
+responses are compressed chunk by chunk, each chunk flushed so the client
+is never kept waiting. Event streams and responses that already carry a
+Content-Encoding, such as the precompressed static assets, pass through.
+"""
+
+import os
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # gzip only without the brotli package
+    brotli = None
+
+MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def available_encodings() -> tuple:
+    """Supported encodings, preferred first"""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """The encoding to use for an Accept-Encoding header, or None for identity"""
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        if coding:
+            weights[coding] = weight
+    best, best_weight = None, 0.0
+    for coding in available_encodings():
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """Compress a whole body; level defaults to the on-the-fly setting"""
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY if level is None else level)
+    return zlib.compress(data, GZIP_LEVEL if level is None else level, wbits=31)
+
+
+def compressible(content_type: str) -> bool:
+    content_type = content_type.split(";")[0].strip().lower()
+    return content_type != "text/event-stream" and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class _StreamEncoder:
+    """Incremental compressor that flushes after each chunk"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes, last: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._compressor.process(data)
+            return out + (self._compressor.finish() if last else self._compressor.flush())
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _header(headers, name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _without(headers, *names: bytes) -> list:
+    return [(key, value) for key, value in headers if key.lower() not in names]
+
+
+def _vary(headers) -> list:
+    vary = _header(headers, b"vary")
+    if vary is None:
+        return headers + [(b"vary", b"Accept-Encoding")]
+    if b"accept-encoding" in vary.lower():
+        return headers
+    return _without(headers, b"vary") + [(b"vary", vary + b", Accept-Encoding")]
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware, so streamed responses stay streamed"""
+
+    def __init__(self, app, minimum_size: int = MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate((_header(scope["headers"], b"accept-encoding") or b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        encoder = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            if passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is not None:
+                await send({"type": "http.response.body", "body": encoder.chunk(body, not more_body), "more_body": more_body})
+                return
+
+            # First body message: decide from the headers and the first chunk
+            headers = list(start.get("headers", []))
+            eligible = (
+                start["status"] not in (204, 304)
+                and _header(headers, b"content-encoding") is None
+                and compressible((_header(headers, b"content-type") or b"").decode("latin-1"))
+            )
+            if eligible:
+                headers = _vary(headers)
+            if not eligible or (not more_body and len(body) < self.minimum_size):
+                passthrough = True
+                await send({**start, "headers": headers})
+                await send(message)
+                return
+
+            headers = _without(headers, b"content-length") + [(b"content-encoding", encoding.encode())]
+            if not more_body:
+                body = compress(body, encoding)
+                headers.append((b"content-length", str(len(body)).encode()))
+                await send({**start, "headers": headers})
+                await send({"type": "http.response.body", "body": body})
+                return
+            encoder = _StreamEncoder(encoding)
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": encoder.chunk(body, False), "more_body": True})
+
+        await self.app(scope, receive, send_wrapper)
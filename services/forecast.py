@@ -0,0 +1,183 @@
+"""
+Revenue forecast from scheduled renewals
+
+For every member whose period ends within the horizon (or ended up to
+GRACE_DAYS ago and may still renew) the expected renewal revenue is the
+plan amount times the plan's historical renewal rate, spread over the days
+after the end date by the gym's historical renewal lag. Members on plans
+shorter than the horizon renew again, with the rate compounded. The result
+is scaled by the share of billed periods that was actually paid over the
+last year.
+
+The schedule and the history are loaded with three grouped queries into
+numpy column arrays, and the per-day projection is computed with bincount
+and convolve over whole arrays rather than per member. Each member's
+renewal is a Bernoulli trial, so the per-day variance is known and gives
+the confidence band.
+"""
+
+import os
+from datetime import date, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # forecasts are optional, the rest of the API works without numpy
+    np = None
+
+HORIZON_DAYS = 90
+# Days after the end date in which a renewal still counts as one
+GRACE_DAYS = int(os.getenv('FORECAST_GRACE_DAYS', '30'))
+HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', '365'))
+# Weight, in periods, of the gym-wide rate in a plan's renewal rate
+PRIOR_PERIODS = 10
+# Two-sided 80% band of the normal approximation
+BAND_Z = 1.2816
+
+SCHEDULE_SQL = """
+    SELECT c.end_date - %(today)s, COALESCE(p.amount, 0), COALESCE(p.days, 0), COALESCE(c.plan_id, 0)
+    FROM clients c
+    LEFT JOIN plans p ON p.id = c.plan_id AND p.gym_id = c.gym_id
+    WHERE c.gym_id = %(gym)s AND c.end_date BETWEEN %(today)s::date - %(grace)s AND %(today)s::date + %(horizon)s
+"""
+
+# Periods that ended during the history window, by plan and days until the
+# member's next period started (NULL if not renewed within the grace days)
+RENEWAL_HISTORY_SQL = """
+    SELECT COALESCE(e.plan_id, 0),
+           CASE WHEN e.next_start <= e.end_date + %(grace)s THEN GREATEST(e.next_start - e.end_date, 0) END,
+           COUNT(*)
+    FROM (
+        SELECT mp.plan_id, mp.end_date,
+               (SELECT MIN(n.start_date) FROM membership_periods n
+                WHERE n.gym_id = mp.gym_id AND n.client_id = mp.client_id
+                  AND n.start_date > mp.start_date AND n.kind <> 'extension') AS next_start
+        FROM membership_periods mp
+        WHERE mp.gym_id = %(gym)s AND mp.kind <> 'extension'
+          AND mp.end_date BETWEEN %(today)s::date - %(history)s - %(grace)s AND %(today)s::date - %(grace)s
+    ) e
+    GROUP BY 1, 2
+"""
+
+COLLECTION_SQL = """
+    SELECT
+        (SELECT COALESCE(SUM(amount), 0) FROM payments
+         WHERE gym_id = %(gym)s AND paid_at >= %(today)s::date - %(history)s),
+        (SELECT COALESCE(SUM(amount), 0) FROM membership_periods
+         WHERE gym_id = %(gym)s AND kind <> 'extension' AND start_date >= %(today)s::date - %(history)s)
+"""
+
+
+def available() -> bool:
+    return np is not None
+
+
+def load(cur, gym_id: int, today: date):
+    """Renewal schedule, renewal history and collection ratio of a gym as column arrays"""
+    params = {"gym": gym_id, "today": today, "grace": GRACE_DAYS, "horizon": HORIZON_DAYS, "history": HISTORY_DAYS}
+    cur.execute(SCHEDULE_SQL, params)
+    schedule = np.array(cur.fetchall(), dtype=float).reshape(-1, 4)
+    cur.execute(RENEWAL_HISTORY_SQL, params)
+    history = np.array(
+        [(plan_id, -1 if lag is None else lag, count) for plan_id, lag, count in cur.fetchall()],
+        dtype=float,
+    ).reshape(-1, 3)
+    cur.execute(COLLECTION_SQL, params)
+    paid, billed = cur.fetchone()
+    collection = min(1.0, float(paid) / float(billed)) if billed else 1.0
+    return schedule, history, collection
+
+
+def renewal_model(history):
+    """
+    (plan ids, their renewal rates, gym-wide rate, lag distribution over
+    0..GRACE_DAYS days) from the history arrays
+    """
+    plans, lags, counts = history[:, 0], history[:, 1], history[:, 2]
+    renewed = lags >= 0
+    # Laplace smoothed gym-wide rate, which plans with little history lean towards
+    gym_rate = (counts[renewed].sum() + 1) / (counts.sum() + 2)
+    plan_ids, index = np.unique(plans, return_inverse=True)
+    ended = np.bincount(index, weights=counts, minlength=len(plan_ids))
+    renewals = np.bincount(index, weights=counts * renewed, minlength=len(plan_ids))
+    rates = (renewals + PRIOR_PERIODS * gym_rate) / (ended + PRIOR_PERIODS)
+
+    lag = np.bincount(lags[renewed].astype(int), weights=counts[renewed], minlength=GRACE_DAYS + 1)[:GRACE_DAYS + 1]
+    lag = lag / lag.sum() if lag.sum() else np.eye(1, GRACE_DAYS + 1).ravel()
+    return plan_ids, rates, float(gym_rate), lag
+
+
+def member_rates(plan_ids, plan_rates, gym_rate: float, members):
+    """Renewal rate of each member's plan, the gym-wide rate for plans without history"""
+    if not len(plan_ids):
+        return np.full(len(members), gym_rate)
+    index = np.minimum(np.searchsorted(plan_ids, members), len(plan_ids) - 1)
+    return np.where(plan_ids[index] == members, plan_rates[index], gym_rate)
+
+
+def project(offsets, amounts, days, rates, lag, horizon: int = HORIZON_DAYS):
+    """
+    Expected revenue and its variance for each of the next horizon days
+
+    offsets are the members' end dates in days from today, amounts and days
+    their plans', rates their renewal probabilities and lag the distribution
+    of days from an end date to the renewal.
+    """
+    expected = np.zeros(horizon)
+    variance = np.zeros(horizon)
+    probability = rates.copy()
+    ends = offsets.copy()
+    # k-th renewal within the horizon, for members on plans shorter than it
+    while True:
+        live = (ends < horizon) & (probability > 0)
+        if not live.any():
+            break
+        # Shifted so members that ended up to GRACE_DAYS ago land at index >= 0
+        at = (ends[live] + GRACE_DAYS).astype(int)
+        size = horizon + GRACE_DAYS
+        mean = np.bincount(at, weights=amounts[live] * probability[live], minlength=size)
+        second = np.bincount(at, weights=amounts[live] ** 2 * probability[live], minlength=size)
+        squared = np.bincount(at, weights=(amounts[live] * probability[live]) ** 2, minlength=size)
+        # Spread over the lag; a renewal on day d has probability p * lag[d - end]
+        window = slice(GRACE_DAYS, GRACE_DAYS + horizon)
+        expected += np.convolve(mean, lag)[window]
+        variance += (np.convolve(second, lag) - np.convolve(squared, lag ** 2))[window]
+        repeats = live & (days > 0)
+        ends = np.where(repeats, ends + days, horizon)
+        probability = np.where(repeats, probability * rates, 0)
+    return expected, np.maximum(variance, 0)
+
+
+def forecast(cur, gym_id: int, today: date = None) -> dict:
+    """Per-day projected revenue with an 80% band, and totals for 30, 60 and 90 days"""
+    today = today or date.today()
+    schedule, history, collection = load(cur, gym_id, today)
+    plan_ids, plan_rates, gym_rate, lag = renewal_model(history)
+    offsets, amounts, days, members = schedule.T
+    rates = member_rates(plan_ids, plan_rates, gym_rate, members)
+
+    expected, variance = project(offsets, amounts * collection, days, rates, lag)
+    spread = BAND_Z * np.sqrt(variance)
+    cumulative = np.cumsum(expected)
+    cumulative_spread = BAND_Z * np.sqrt(np.cumsum(variance))
+
+    return {
+        "days": [
+            {
+                "date": str(today + timedelta(days=offset)),
+                "expected": round(float(expected[offset]), 2),
+                "low": round(float(max(expected[offset] - spread[offset], 0)), 2),
+                "high": round(float(expected[offset] + spread[offset]), 2),
+            }
+            for offset in range(HORIZON_DAYS)
+        ],
+        "totals": {
+            str(horizon): {
+                "expected": round(float(cumulative[horizon - 1]), 2),
+                "low": round(float(max(cumulative[horizon - 1] - cumulative_spread[horizon - 1], 0)), 2),
+                "high": round(float(cumulative[horizon - 1] + cumulative_spread[horizon - 1]), 2),
+            }
+            for horizon in (30, 60, 90)
+        },
+        "renewal_rates": {str(int(plan_id)): round(float(rate), 3) for plan_id, rate in zip(plan_ids, plan_rates)},
+        "collection_rate": round(collection, 3),
+    }
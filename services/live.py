@@ -0,0 +1,232 @@
+"""
+Live dashboard stats over Server-Sent Events
+
+Triggers on clients, payments, leads, plans and membership_churn NOTIFY the
+gymbook_changes channel with "table:gym_id" when a transaction commits. Each
+worker runs one hub thread, from startup, that LISTENs on its own connection.
+Every notification drops the gym's cached reports in services/report_cache,
+so writes made through any worker reach every worker's cache; the whole cache
+is dropped when the hub (re)connects, as notifications sent while it was not
+listening are lost. Only for gyms that have open streams does it recompute the dashboard stats, once per burst of changes
+(STATS_DEBOUNCE) and once a minute for date-driven changes such as expiries.
+Only the fields that changed are pushed to the subscribers. Subscribers are
+asyncio queues on the event loop, so an idle stream costs a queue and a
+parked coroutine, not a thread or a poll.
+"""
+
+import asyncio
+import logging
+import os
+import select
+import threading
+import time
+
+from config import database
+from services import member_lists, report_cache
+
+CHANNEL = "gymbook_changes"
+STATS_DEBOUNCE = float(os.getenv('STATS_DEBOUNCE', '0.5'))
+STATS_REFRESH = float(os.getenv('STATS_REFRESH', '60'))
+SUBSCRIBER_QUEUE = 32
+
+logger = logging.getLogger("gymbook.live")
+
+
+def _count(cur, sql, params) -> int:
+    cur.execute(sql, params)
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def dashboard_stats(cur, gym_id: int) -> dict:
+    """Dashboard counters of a gym, as served by /dashboard/stats and the stats stream"""
+    total = _count(cur, "SELECT COUNT(*) FROM clients WHERE gym_id = %s", (gym_id,))
+    active = _count(cur, "SELECT COUNT(*) FROM clients WHERE end_date >= CURRENT_DATE AND gym_id = %s", (gym_id,))
+
+    # Today's precomputed lists, falling back to scanning clients until they are built
+    list_counts = member_lists.counts(gym_id, cur)
+    if list_counts is not None:
+        expiring_10 = list_counts["expiring"]
+        expired_30 = list_counts["expired"]
+        birthdays_today = list_counts["birthday"]
+    else:
+        expiring_10 = _count(cur, "SELECT COUNT(*) FROM clients WHERE end_date BETWEEN CURRENT_DATE AND CURRENT_DATE + INTERVAL '10 days' AND gym_id = %s", (gym_id,))
+        expired_30 = _count(cur, "SELECT COUNT(*) FROM clients WHERE end_date < CURRENT_DATE AND end_date >= CURRENT_DATE - INTERVAL '30 days' AND gym_id = %s", (gym_id,))
+        birthdays_today = _count(cur, """
+            SELECT COUNT(*)
+            FROM clients
+            WHERE EXTRACT(MONTH FROM dateofbirth::date) = EXTRACT(MONTH FROM CURRENT_DATE)
+              AND EXTRACT(DAY FROM dateofbirth::date) = EXTRACT(DAY FROM CURRENT_DATE)
+              AND gym_id = %s
+        """, (gym_id,))
+
+    total_leads = _count(cur, "SELECT COUNT(*) FROM leads WHERE gym_id = %s", (gym_id,))
+
+    cur.execute("SELECT COUNT(*), COALESCE(SUM(balance_due), 0) FROM clients WHERE balance_due > 0 AND gym_id = %s", (gym_id,))
+    due_count, due_total = cur.fetchone()
+
+    return {
+        "total_members": total,
+        "active_members": active,
+        "expiring_in_10_days": expiring_10,
+        "expired_in_last_30_days": expired_30,
+        "birthdays_today": birthdays_today,
+        "total_leads": total_leads,
+        "due_members": due_count,
+        "total_balance_due": float(due_total),
+    }
+
+
+class Subscriber:
+    def __init__(self, gym_id: int, loop):
+        self.gym_id = gym_id
+        self.loop = loop
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE)
+        # Set when a delta was dropped; the stream then resends the full snapshot
+        self.stale = False
+
+    def offer(self, delta: dict):
+        try:
+            self.queue.put_nowait(delta)
+        except asyncio.QueueFull:
+            self.stale = True
+
+
+class StatsHub:
+    def __init__(self):
+        self._subscribers = {}
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = database.connect()
+            self._conn.autocommit = True
+            with self._conn.cursor() as cur:
+                cur.execute(f"LISTEN {CHANNEL}")
+            report_cache.cache.clear()
+        return self._conn
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def subscribe(self, gym_id: int, loop) -> Subscriber:
+        subscriber = Subscriber(gym_id, loop)
+        with self._lock:
+            self._subscribers.setdefault(gym_id, set()).add(subscriber)
+        self.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.gym_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                # Nobody is watching, so the snapshot would go stale
+                del self._subscribers[subscriber.gym_id]
+                self._snapshots.pop(subscriber.gym_id, None)
+
+    def snapshot(self, gym_id: int) -> dict:
+        """Current stats of a gym, computed if no stream of the gym has them yet (blocking)"""
+        with self._lock:
+            snapshot = self._snapshots.get(gym_id)
+        if snapshot is not None:
+            return snapshot
+        with self._db_lock:
+            with self._connection().cursor() as cur:
+                snapshot = dashboard_stats(cur, gym_id)
+        with self._lock:
+            if gym_id in self._subscribers:
+                self._snapshots.setdefault(gym_id, snapshot)
+        return snapshot
+
+    def _refresh(self, gym_id: int):
+        with self._db_lock:
+            with self._connection().cursor() as cur:
+                current = dashboard_stats(cur, gym_id)
+        with self._lock:
+            if gym_id not in self._subscribers:
+                return
+            previous = self._snapshots.get(gym_id, {})
+            self._snapshots[gym_id] = current
+            subscribers = list(self._subscribers[gym_id])
+        delta = {key: value for key, value in current.items() if previous.get(key) != value}
+        if not delta:
+            return
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, delta)
+            except RuntimeError:
+                pass  # event loop already closed
+
+    def _changed_gyms(self, timeout: float) -> set:
+        """
+        Wait up to timeout for notifications, drop the cached reports of the
+        gyms they name and return the watched ones
+        """
+        with self._db_lock:
+            conn = self._connection()
+        select.select([conn], [], [], timeout)
+        with self._db_lock:
+            conn.poll()
+            notifies = list(conn.notifies)
+            conn.notifies.clear()
+        with self._lock:
+            watched = set(self._subscribers)
+        changed = set()
+        for notify in notifies:
+            _, _, gym_id = notify.payload.partition(":")
+            if not gym_id.isdigit():
+                continue
+            report_cache.invalidate(int(gym_id))
+            if int(gym_id) in watched:
+                changed.add(int(gym_id))
+        return changed
+
+    def _run(self):
+        last_refresh = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                changed = self._changed_gyms(1.0)
+                if changed:
+                    # Let the rest of a burst arrive, then recompute once per gym
+                    self._stop.wait(STATS_DEBOUNCE)
+                    changed |= self._changed_gyms(0)
+                if time.monotonic() - last_refresh >= STATS_REFRESH:
+                    last_refresh = time.monotonic()
+                    with self._lock:
+                        changed |= set(self._subscribers)
+                for gym_id in changed:
+                    self._refresh(gym_id)
+            except Exception:
+                logger.exception("Stats hub failed, reconnecting")
+                if self._conn is not None and not self._conn.closed:
+                    self._conn.close()
+                self._stop.wait(1.0)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="stats-hub", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+hub = StatsHub()
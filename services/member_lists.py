@@ -0,0 +1,118 @@
+"""
+Daily member lists and reminders
+
+Once a day, per gym, the scheduler stores the ids of expiring, recently expired
+and birthday members in member_lists and queues reminder messages for them in
+the notification outbox. The dashboard counts read these lists instead of
+scanning clients on every view. Rows are rechecked against the live predicate
+when read, so a member renewed during the day drops off immediately; a member
+that only starts matching during the day is counted from the next day's list.
+The client filters and the birthday list query clients directly, so they are
+always complete.
+"""
+
+import os
+from datetime import date, timedelta
+
+from config import database
+from services import notifications
+from services.scheduler import scheduler
+
+EXPIRING_DAYS = 10
+EXPIRED_DAYS = 30
+LIST_RETENTION_DAYS = int(os.getenv('MEMBER_LIST_RETENTION_DAYS', '7'))
+JOB_RUN_RETENTION_DAYS = 30
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', '90'))
+
+# kind -> predicate on clients c, with %(day)s as the list date
+PREDICATES = {
+    "expiring": f"c.end_date BETWEEN %(day)s AND %(day)s + {EXPIRING_DAYS}",
+    "expired": f"c.end_date < %(day)s AND c.end_date >= %(day)s - {EXPIRED_DAYS}",
+    "birthday": """EXTRACT(MONTH FROM c.dateofbirth::date) = EXTRACT(MONTH FROM %(day)s::date)
+        AND EXTRACT(DAY FROM c.dateofbirth::date) = EXTRACT(DAY FROM %(day)s::date)""",
+}
+
+# kind -> (outbox event, subject, dedupe date expression, body expression)
+REMINDERS = {
+    "expiring": (
+        "membership_expiring",
+        "Your membership is ending soon",
+        "c.end_date",
+        "'Hi ' || c.clientname || ', your membership ends on ' || TO_CHAR(c.end_date, 'DD Mon YYYY') || '. Renew to keep training!'",
+    ),
+    "birthday": (
+        "birthday",
+        "Happy birthday!",
+        "%(day)s::date",
+        "'Happy birthday, ' || c.clientname || '!'",
+    ),
+}
+
+LIST_JOB = "member-lists"
+
+
+@scheduler.daily(LIST_JOB, at=os.getenv('MEMBER_LIST_TIME', '00:05'), per_gym=True)
+def build_member_lists(cur, gym_id: int, day: date):
+    params = {"gym": gym_id, "day": day}
+    cur.execute("DELETE FROM member_lists WHERE gym_id = %(gym)s AND list_date = %(day)s", params)
+    for kind, predicate in PREDICATES.items():
+        cur.execute(f"""
+            INSERT INTO member_lists (gym_id, list_date, kind, client_id)
+            SELECT c.gym_id, %(day)s, %(kind)s, c.id
+            FROM clients c
+            WHERE c.gym_id = %(gym)s AND {predicate}
+        """, {**params, "kind": kind})
+
+    # One reminder per member and end date (or birthday), however many days the member stays listed
+    for kind, (event, subject, ref_date, body) in REMINDERS.items():
+        cur.execute(f"""
+            INSERT INTO outbox (gym_id, client_id, event, channel, recipient, subject, body, dedupe_key)
+            SELECT c.gym_id, c.id, %(event)s, %(channel)s, {notifications.recipient_column()}, %(subject)s, {body},
+                   %(event)s || ':' || c.id || ':' || {ref_date}
+            FROM member_lists ml
+            JOIN clients c ON c.id = ml.client_id AND c.gym_id = ml.gym_id
+            WHERE ml.gym_id = %(gym)s AND ml.list_date = %(day)s AND ml.kind = %(kind)s
+            ON CONFLICT (dedupe_key) DO NOTHING
+        """, {**params, "kind": kind, "event": event, "subject": subject, "channel": notifications.CHANNEL})
+
+
+@scheduler.daily("maintenance", at=os.getenv('MAINTENANCE_TIME', '03:00'))
+def maintenance(cur, day: date):
+    cur.execute("DELETE FROM member_lists WHERE list_date < %s", (day - timedelta(days=LIST_RETENTION_DAYS),))
+    cur.execute("DELETE FROM job_runs WHERE run_on < %s", (day - timedelta(days=JOB_RUN_RETENTION_DAYS),))
+    cur.execute("""
+        DELETE FROM outbox
+        WHERE status = 'sent' AND sent_at < %s
+    """, (day - timedelta(days=OUTBOX_RETENTION_DAYS),))
+    # Idle buckets of the shared rate limiter are full again anyway
+    cur.execute("DELETE FROM rate_limits WHERE updated_at < now() - INTERVAL '1 day'")
+
+
+def ready(gym_id: int, day: date = None, cur=None) -> bool:
+    """Whether today's lists have been built for a gym"""
+    cur = cur or database.cur
+    cur.execute("""
+        SELECT 1 FROM job_runs
+        WHERE job = %s AND gym_id = %s AND run_on = %s AND status = 'done'
+    """, (LIST_JOB, gym_id, day or date.today()))
+    return cur.fetchone() is not None
+
+
+def counts(gym_id: int, cur=None):
+    """Live member counts per list kind for today, or None if the lists are not built yet"""
+    cur = cur or database.cur
+    today = date.today()
+    if not ready(gym_id, today, cur):
+        return None
+    cases = " ".join(f"WHEN '{kind}' THEN {predicate}" for kind, predicate in PREDICATES.items())
+    cur.execute(f"""
+        SELECT ml.kind, COUNT(*)
+        FROM member_lists ml
+        JOIN clients c ON c.id = ml.client_id AND c.gym_id = ml.gym_id
+        WHERE ml.gym_id = %(gym)s AND ml.list_date = %(day)s
+            AND CASE ml.kind {cases} END
+        GROUP BY ml.kind
+    """, {"gym": gym_id, "day": today})
+    result = dict.fromkeys(PREDICATES, 0)
+    result.update({row[0]: row[1] for row in cur.fetchall()})
+    return result
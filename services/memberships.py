@@ -0,0 +1,88 @@
+"""
+Membership history
+
+Every join, renewal and extension appends a row to membership_periods in the
+same transaction as the change to clients, which keeps only the current
+period. A statement trigger rolls new periods up into membership_months and
+membership_cohorts, so retention and cohort reports read small rollups
+instead of replaying the history.
+
+Each night the scheduler also snapshots, per gym, how many members were
+active on the previous day and how many joined, returned after a gap or
+lapsed that day, and adds the day to the month's totals in membership_churn.
+Days missed while no worker ran are caught up, at most CATCH_UP_DAYS back.
+"""
+
+import os
+from datetime import date, timedelta
+
+from services.scheduler import scheduler
+
+# Kinds of membership periods
+JOIN = "join"
+RENEWAL = "renewal"
+EXTENSION = "extension"
+
+CATCH_UP_DAYS = int(os.getenv('MEMBERSHIP_SNAPSHOT_CATCH_UP_DAYS', '31'))
+
+# Reads only the periods around the day, through idx_membership_periods_end
+SNAPSHOT_SQL = """
+    SELECT COUNT(*) FILTER (WHERE on_day),
+           COUNT(*) FILTER (WHERE on_day AND NOT on_day_before AND joined),
+           COUNT(*) FILTER (WHERE on_day AND NOT on_day_before AND NOT joined),
+           COUNT(*) FILTER (WHERE on_day_before AND NOT on_day)
+    FROM (
+        SELECT client_id,
+               BOOL_OR(start_date <= %(day)s AND end_date >= %(day)s) AS on_day,
+               BOOL_OR(start_date < %(day)s AND end_date >= %(day)s::date - 1) AS on_day_before,
+               BOOL_OR(kind = 'join' AND start_date = %(day)s) AS joined
+        FROM membership_periods
+        WHERE gym_id = %(gym)s AND end_date >= %(day)s::date - 1 AND start_date <= %(day)s
+        GROUP BY client_id
+    ) members
+"""
+
+
+def record(cur, gym_id: int, client_id: int, plan_id, start_date, end_date, amount, kind: str):
+    """Append a membership period in the caller's transaction"""
+    cur.execute("""
+        INSERT INTO membership_periods (gym_id, client_id, plan_id, kind, start_date, end_date, amount)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, (gym_id, client_id, plan_id, kind, start_date, end_date, amount or 0))
+
+
+def snapshot(cur, gym_id: int, day: date):
+    """Snapshot one day of a gym and add it to the month's totals, once"""
+    params = {"gym": gym_id, "day": day}
+    cur.execute(SNAPSHOT_SQL, params)
+    active, joined, returned, lapsed = cur.fetchone()
+    cur.execute("""
+        INSERT INTO membership_snapshots (gym_id, snapshot_date, active, joined, returned, lapsed)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (gym_id, snapshot_date) DO NOTHING
+        RETURNING 1
+    """, (gym_id, day, active, joined, returned, lapsed))
+    if cur.fetchone() is None:
+        return
+    # The first snapshot of a month opens it with the count at the start of that day
+    cur.execute("""
+        INSERT INTO membership_churn AS mc (gym_id, month, opening, joined, returned, lapsed, closing)
+        VALUES (%s, DATE_TRUNC('month', %s::date), %s, %s, %s, %s, %s)
+        ON CONFLICT (gym_id, month) DO UPDATE SET
+            joined = mc.joined + EXCLUDED.joined,
+            returned = mc.returned + EXCLUDED.returned,
+            lapsed = mc.lapsed + EXCLUDED.lapsed,
+            closing = EXCLUDED.closing
+    """, (gym_id, day, active - joined - returned + lapsed, joined, returned, lapsed, active))
+
+
+@scheduler.daily("membership-snapshots", at=os.getenv('MEMBERSHIP_SNAPSHOT_TIME', '00:15'), per_gym=True)
+def take_snapshots(cur, gym_id: int, day: date):
+    """Snapshot the days since the gym's last snapshot, up to yesterday"""
+    cur.execute("SELECT MAX(snapshot_date) FROM membership_snapshots WHERE gym_id = %s", (gym_id,))
+    last = cur.fetchone()[0]
+    yesterday = day - timedelta(days=1)
+    first = max(last + timedelta(days=1), day - timedelta(days=CATCH_UP_DAYS)) if last else yesterday
+    while first <= yesterday:
+        snapshot(cur, gym_id, first)
+        first += timedelta(days=1)
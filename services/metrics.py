@@ -0,0 +1,179 @@
+"""
+Prometheus metrics for the API
+
+MetricsMiddleware records request counts and latency per route template and
+status, plus the number and duration of database statements each request
+ran. Connection pool, report cache and rate limiter figures are read at
+scrape time.
+"""
+
+import time
+from contextvars import ContextVar
+from typing import List, Optional
+
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+
+from config import database
+from services import rate_limit, report_cache
+
+REQUESTS = Counter(
+    "gymbook_http_requests_total",
+    "HTTP requests handled",
+    ["method", "route", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "gymbook_http_request_duration_seconds",
+    "HTTP request latency",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+EXCEPTIONS = Counter(
+    "gymbook_http_exceptions_total",
+    "Unhandled exceptions raised by route handlers",
+    ["method", "route"],
+)
+DB_QUERIES = Counter(
+    "gymbook_db_queries_total",
+    "Database statements executed",
+    ["route"],
+)
+DB_QUERY_LATENCY = Histogram(
+    "gymbook_db_query_duration_seconds",
+    "Database statement latency",
+    ["route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+
+class _RequestState:
+    """ASGI scope and statement durations of the request being served"""
+
+    __slots__ = ("scope", "durations")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.durations: List[float] = []
+
+
+_current_request: ContextVar[Optional[_RequestState]] = ContextVar("current_request", default=None)
+
+
+def current_route() -> Optional[str]:
+    """Route template of the request being served, or None outside a request"""
+    request = _current_request.get()
+    if request is None:
+        return None
+    return route_template(request.scope)
+
+
+def _record_query(query, vars, seconds):
+    request = _current_request.get()
+    if request is None:
+        DB_QUERIES.labels("background").inc()
+        DB_QUERY_LATENCY.labels("background").observe(seconds)
+    else:
+        request.durations.append(seconds)
+
+
+def route_template(scope) -> str:
+    """Label for a request: the matched route's path template, never the raw path"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope.get("root_path"):
+        # Requests served by a mounted app such as the static file mounts
+        return scope["root_path"] + "/{path}"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are timed until their last byte"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = _RequestState(scope)
+        token = _current_request.set(request)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            EXCEPTIONS.labels(scope["method"], route_template(scope)).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_request.reset(token)
+            route = route_template(scope)
+            REQUESTS.labels(scope["method"], route, str(status)).inc()
+            REQUEST_LATENCY.labels(scope["method"], route, str(status)).observe(elapsed)
+            if request.durations:
+                DB_QUERIES.labels(route).inc(len(request.durations))
+                histogram = DB_QUERY_LATENCY.labels(route)
+                for seconds in request.durations:
+                    histogram.observe(seconds)
+
+
+class StateCollector:
+    """Metrics computed at scrape time from the connection pool, report cache and rate limiter"""
+
+    def collect(self):
+        pool = GaugeMetricFamily(
+            "gymbook_db_pool_connections",
+            "Request connections of this worker by state",
+            labels=["state"],
+        )
+        pool.add_metric(["in_use"], database.pool.in_use)
+        pool.add_metric(["idle"], database.pool.idle())
+        yield pool
+
+        size = GaugeMetricFamily("gymbook_db_pool_size", "Maximum request connections of this worker")
+        size.add_metric([], database.pool.size)
+        yield size
+
+        stats = report_cache.cache.stats()
+        entries = GaugeMetricFamily("gymbook_report_cache_entries", "Entries held by the report cache")
+        entries.add_metric([], stats["entries"])
+        yield entries
+        lookups = GaugeMetricFamily(
+            "gymbook_report_cache_lookups",
+            "Report cache lookups since start",
+            labels=["result"],
+        )
+        lookups.add_metric(["hit"], stats["hits"])
+        lookups.add_metric(["miss"], stats["misses"])
+        yield lookups
+        ratio = GaugeMetricFamily("gymbook_report_cache_hit_ratio", "Report cache hit ratio since start")
+        ratio.add_metric([], stats["hit_ratio"])
+        yield ratio
+
+        limited = CounterMetricFamily(
+            "gymbook_rate_limited_requests",
+            "Requests rejected with 429 by this worker",
+            labels=["reason"],
+        )
+        for reason in ("rate", "concurrency"):
+            limited.add_metric([reason], rate_limit.rejected[reason])
+        yield limited
+
+
+database.query_listeners.append(_record_query)
+REGISTRY.register(StateCollector())
+
+
+def render():
+    """Return (body, content type) for the /metrics endpoint"""
+    return generate_latest(), CONTENT_TYPE_LATEST
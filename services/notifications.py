@@ -0,0 +1,283 @@
+"""
+Outbound SMS/email through a transactional outbox
+
+Messages are inserted into the outbox table with the same cursor, and so in
+the same transaction, as the write that triggers them: a rolled back payment
+never sends a receipt and a committed one always gets one. A background
+dispatcher claims pending rows in batches (FOR UPDATE SKIP LOCKED, so several
+workers can drain the table without sending twice), hands them to the
+transport for their channel under a rate limit and reschedules failures with
+exponential backoff. Requests never wait on delivery.
+
+Transports are looked up by name from TRANSPORTS. The built-in "file" transport
+appends messages as JSON lines to NOTIFY_OUTBOX_FILE, and "smtp" delivers email
+to SMTP_HOST:SMTP_PORT, which can be a local sink such as
+`python -m aiosmtpd -n -l localhost:1025`.
+"""
+
+import abc
+import json
+import logging
+import os
+import smtplib
+import threading
+import time
+from datetime import datetime, timezone
+from email.message import EmailMessage
+
+from config import database
+
+CHANNEL = os.getenv('NOTIFY_CHANNEL', 'email')
+EMAIL_TRANSPORT = os.getenv('NOTIFY_EMAIL_TRANSPORT', 'file')
+SMS_TRANSPORT = os.getenv('NOTIFY_SMS_TRANSPORT', 'file')
+OUTBOX_FILE = os.getenv('NOTIFY_OUTBOX_FILE', 'outbox.log')
+SMTP_HOST = os.getenv('SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '1025'))
+SMTP_SENDER = os.getenv('SMTP_SENDER', 'no-reply@gymbook.local')
+BATCH_SIZE = int(os.getenv('NOTIFY_BATCH_SIZE', '50'))
+RATE_PER_SECOND = float(os.getenv('NOTIFY_RATE_PER_SECOND', '10'))
+POLL_INTERVAL = float(os.getenv('NOTIFY_POLL_INTERVAL', '5'))
+MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '5'))
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+
+logger = logging.getLogger("gymbook.notifications")
+
+
+class Transport(abc.ABC):
+    """
+    Delivers messages of one channel. send_batch returns one entry per
+    message: None when it was delivered, otherwise the error text.
+    """
+
+    @abc.abstractmethod
+    def send(self, message: dict):
+        """Deliver one message, raising on failure"""
+
+    def send_batch(self, messages: list) -> list:
+        errors = []
+        for message in messages:
+            try:
+                self.send(message)
+                errors.append(None)
+            except Exception as e:
+                errors.append(str(e) or type(e).__name__)
+        return errors
+
+
+class FileTransport(Transport):
+    """Local stand-in that appends each message to a JSON lines file"""
+
+    def __init__(self, path: str = OUTBOX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, message: dict):
+        self.send_batch([message])
+
+    def send_batch(self, messages: list) -> list:
+        sent_at = datetime.now(timezone.utc).isoformat()
+        lines = [json.dumps({**message, "sent_at": sent_at}) + "\n" for message in messages]
+        with self._lock, open(self.path, "a") as f:
+            f.writelines(lines)
+        return [None] * len(messages)
+
+
+class SMTPTransport(Transport):
+    """Email over SMTP, one connection per batch"""
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, sender: str = SMTP_SENDER):
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def _email(self, message: dict) -> EmailMessage:
+        email = EmailMessage()
+        email["From"] = self.sender
+        email["To"] = message["recipient"]
+        email["Subject"] = message["subject"] or ""
+        email.set_content(message["body"])
+        return email
+
+    def send(self, message: dict):
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(self._email(message))
+
+    def send_batch(self, messages: list) -> list:
+        errors = []
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            for message in messages:
+                try:
+                    smtp.send_message(self._email(message))
+                    errors.append(None)
+                except smtplib.SMTPException as e:
+                    errors.append(str(e))
+        return errors
+
+
+# transport name -> factory
+TRANSPORTS = {
+    "file": FileTransport,
+    "smtp": SMTPTransport,
+}
+
+
+def enqueue(cur, gym_id: int, client_id: int, event: str, subject: str, body: str, dedupe_key: str = None):
+    """
+    Queue a message to a client on cur, inside the caller's transaction.
+    The recipient is the client's email or phone number depending on NOTIFY_CHANNEL.
+    """
+    cur.execute(f"""
+        INSERT INTO outbox (gym_id, client_id, event, channel, recipient, subject, body, dedupe_key)
+        SELECT c.gym_id, c.id, %s, %s, {recipient_column()}, %s, %s, %s
+        FROM clients c
+        WHERE c.id = %s AND c.gym_id = %s
+        ON CONFLICT (dedupe_key) DO NOTHING
+    """, (event, CHANNEL, subject, body, dedupe_key, client_id, gym_id))
+
+
+def recipient_column() -> str:
+    """Column of clients c holding the recipient for NOTIFY_CHANNEL"""
+    return "c.email" if CHANNEL == "email" else "c.phonenumber::text"
+
+
+class _RateLimit:
+    """Token bucket of rate messages per second"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self, wanted: int) -> int:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        granted = min(wanted, int(self.tokens))
+        self.tokens -= granted
+        return granted
+
+
+class Dispatcher:
+    def __init__(self, batch_size: int = BATCH_SIZE, rate: float = RATE_PER_SECOND,
+                 poll_interval: float = POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.rate_limit = _RateLimit(rate)
+        self.transports = {
+            "email": TRANSPORTS[EMAIL_TRANSPORT](),
+            "sms": TRANSPORTS[SMS_TRANSPORT](),
+        }
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+
+    def wake(self):
+        """Deliver soon instead of at the next poll; called after committing new messages"""
+        self._wake.set()
+
+    def _deliver(self, rows) -> list:
+        errors = [None] * len(rows)
+        for channel, transport in self.transports.items():
+            positions = [i for i, row in enumerate(rows) if row[1] == channel]
+            if not positions:
+                continue
+            messages = [
+                {"id": rows[i][0], "channel": channel, "recipient": rows[i][2],
+                 "subject": rows[i][3], "body": rows[i][4]}
+                for i in positions
+            ]
+            try:
+                results = transport.send_batch(messages)
+            except Exception as e:
+                results = [str(e) or type(e).__name__] * len(messages)
+            for i, error in zip(positions, results):
+                errors[i] = error
+        for i, row in enumerate(rows):
+            if row[1] not in self.transports:
+                errors[i] = f"No transport for channel {row[1]}"
+        return errors
+
+    def dispatch_batch(self) -> int:
+        """Send one batch of due messages; returns how many rows were claimed"""
+        limit = self.rate_limit.take(self.batch_size)
+        while limit == 0 and not self._stop.is_set():
+            self._stop.wait(1 / self.rate_limit.rate)
+            limit = self.rate_limit.take(self.batch_size)
+        if limit == 0:
+            return 0
+        if self._conn is None or self._conn.closed:
+            self._conn = database.connect()
+        try:
+            with self._conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, channel, recipient, subject, body, attempts
+                    FROM outbox
+                    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                    ORDER BY next_attempt_at, id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                """, (limit,))
+                rows = cur.fetchall()
+                # Hand back the unused part of this batch's rate budget
+                self.rate_limit.tokens += limit - len(rows)
+                if not rows:
+                    self._conn.commit()
+                    return 0
+
+                errors = self._deliver(rows)
+                sent = [row[0] for row, error in zip(rows, errors) if error is None]
+                if sent:
+                    cur.execute("""
+                        UPDATE outbox
+                        SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                        WHERE id = ANY(%s)
+                    """, (sent,))
+                for row, error in zip(rows, errors):
+                    if error is None:
+                        continue
+                    attempts = row[5] + 1
+                    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+                    cur.execute("""
+                        UPDATE outbox
+                        SET status = %s, attempts = %s, last_error = %s,
+                            next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                        WHERE id = %s
+                    """, ("failed" if attempts >= MAX_ATTEMPTS else "pending", attempts, error, delay, row[0]))
+            self._conn.commit()
+            return len(rows)
+        except Exception:
+            self._conn.rollback()
+            raise
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self.dispatch_batch()
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+                claimed = 0
+            if claimed:
+                continue  # more may be due; the rate limit paces the loop
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+dispatcher = Dispatcher()
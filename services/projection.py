@@ -0,0 +1,42 @@
+"""
+Sparse fieldsets for the list endpoints
+
+A list endpoint describes its columns as {name: (SQL expression, serializer)}.
+The comma separated fields query parameter narrows both the SELECT list and
+the serialized objects to the named columns, plus id so rows can still be
+told apart. Without it every column is returned, as before.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+Columns = Dict[str, Tuple[str, Callable]]
+
+
+def choose(columns: Columns, fields: Optional[str]) -> List[str]:
+    """Names of the columns to return for a fields parameter, in column order"""
+    if not fields:
+        return list(columns)
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested.difference(columns)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}. Available: {', '.join(columns)}",
+        )
+    requested.add("id")
+    return [name for name in columns if name in requested]
+
+
+def select_list(columns: Columns, names: List[str]) -> str:
+    return ", ".join(columns[name][0] for name in names)
+
+
+def uses(columns: Columns, names: List[str], alias: str) -> bool:
+    """Whether any chosen column reads from the table alias, i.e. its join is needed"""
+    return any(columns[name][0].startswith(alias + ".") for name in names)
+
+
+def serialize(columns: Columns, names: List[str], row) -> dict:
+    return {name: columns[name][1](value) for name, value in zip(names, row)}
@@ -0,0 +1,346 @@
+"""
+Per-tenant rate limiting and concurrency caps
+
+Every request spends tokens from two buckets: one for the gym and one for the
+user in its JWT. Unauthenticated requests spend from an "anonymous" bucket
+per client address instead, with a larger burst since one address may be a
+whole office behind NAT. The client address is the peer's, or the one in
+X-Forwarded-For when the peer is one of RATE_LIMIT_TRUSTED_PROXIES. Buckets refill continuously at their rate up to their burst, and a
+route's cost is the number of tokens it spends, so reports and exports drain
+a bucket faster than plain listings. A gym and a user may also only have a
+few requests in flight at once, which keeps one tenant's slow reports from
+holding every pooled connection of a worker. Rejected requests get a 429 with
+Retry-After.
+
+Buckets live in worker memory by default. With RATE_LIMIT_BACKEND=postgres
+they are kept in the rate_limits table and shared by every worker; if the
+database cannot be reached the worker falls back to its own buckets. The
+in-flight caps are always per worker.
+"""
+
+import ipaddress
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter
+
+import psycopg2
+from starlette.concurrency import run_in_threadpool
+
+from config import database
+from services.tenancy import token_claims
+
+ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+
+logger = logging.getLogger("gymbook.rate_limit")
+
+
+class Limit:
+    """Token bucket refilled at rate tokens a second up to burst, and a cap on concurrent requests"""
+
+    def __init__(self, rate: float, burst: float, max_in_flight: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+
+
+LIMITS = {
+    "gym": Limit(
+        rate=float(os.getenv('RATE_LIMIT_GYM_RATE', '20')),
+        burst=float(os.getenv('RATE_LIMIT_GYM_BURST', '100')),
+        max_in_flight=int(os.getenv('RATE_LIMIT_GYM_IN_FLIGHT', '8')),
+    ),
+    "user": Limit(
+        rate=float(os.getenv('RATE_LIMIT_USER_RATE', '10')),
+        burst=float(os.getenv('RATE_LIMIT_USER_BURST', '50')),
+        max_in_flight=int(os.getenv('RATE_LIMIT_USER_IN_FLIGHT', '4')),
+    ),
+    "anonymous": Limit(
+        rate=float(os.getenv('RATE_LIMIT_ANON_RATE', '20')),
+        burst=float(os.getenv('RATE_LIMIT_ANON_BURST', '200')),
+        max_in_flight=int(os.getenv('RATE_LIMIT_ANON_IN_FLIGHT', '8')),
+    ),
+}
+
+
+def _trusted_proxies() -> list:
+    """Networks of RATE_LIMIT_TRUSTED_PROXIES, comma separated addresses or CIDRs"""
+    value = os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '')
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(',') if item.strip()]
+
+
+TRUSTED_PROXIES = _trusted_proxies()
+
+
+def _trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_address(scope):
+    """
+    Address of the client, taken from X-Forwarded-For only when the peer is a
+    trusted proxy; the rightmost untrusted hop, as the left ones can be forged
+    """
+    if not scope.get("client"):
+        return None
+    address = scope["client"][0]
+    if not _trusted(address):
+        return address
+    forwarded = [
+        value.decode("latin-1") for name, value in scope.get("headers") or [] if name == b"x-forwarded-for"
+    ]
+    hops = [hop.strip() for value in forwarded for hop in value.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _trusted(hop):
+            return hop
+        address = hop
+    return address
+
+# Tokens spent per request by path prefix, longest prefix first; 1 otherwise.
+# Cost 0 exempts a route, e.g. long-lived streams and the static files.
+DEFAULT_COSTS = {
+    "/reports/": 5,
+    "/owner/overview": 5,
+    "/exports/": 20,
+    "/dashboard/stream": 0,
+    "/metrics": 0,
+    "/styles/": 0,
+    "/scripts/": 0,
+    "/static/": 0,
+}
+
+
+def _route_costs() -> list:
+    """DEFAULT_COSTS with the RATE_LIMIT_COSTS overrides, a JSON object of prefix to cost"""
+    costs = dict(DEFAULT_COSTS)
+    costs.update(json.loads(os.getenv('RATE_LIMIT_COSTS', '{}')))
+    return sorted(costs.items(), key=lambda item: len(item[0]), reverse=True)
+
+
+ROUTE_COSTS = _route_costs()
+
+
+def route_cost(path: str) -> float:
+    for prefix, cost in ROUTE_COSTS:
+        if path.startswith(prefix):
+            return cost
+    return 1
+
+
+class MemoryBackend:
+    """Token buckets of this worker"""
+
+    # Buckets untouched this long are full again and are dropped
+    IDLE_SECONDS = 600
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_prune = time.monotonic() + self.IDLE_SECONDS
+
+    def take(self, requests) -> float:
+        """
+        Spend cost tokens from each (key, cost, limit) bucket, all or none
+
+        Returns 0 when the tokens were spent, otherwise the seconds until every
+        bucket holds enough tokens.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_prune:
+                self._prune(now)
+            levels = []
+            wait = 0.0
+            for key, cost, limit in requests:
+                tokens, updated = self._buckets.get(key, (limit.burst, now))
+                tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+                levels.append(tokens)
+                if tokens < cost:
+                    wait = max(wait, (cost - tokens) / limit.rate)
+            if wait:
+                return wait
+            for (key, cost, limit), tokens in zip(requests, levels):
+                self._buckets[key] = (tokens - cost, now)
+            return 0.0
+
+    def _prune(self, now: float):
+        cutoff = now - self.IDLE_SECONDS
+        for key in [key for key, (_, updated) in self._buckets.items() if updated < cutoff]:
+            del self._buckets[key]
+        self._next_prune = now + self.IDLE_SECONDS
+
+
+class PostgresBackend:
+    """
+    Token buckets in the rate_limits table, shared by every worker
+
+    Runs on a dedicated connection; callers are in the threadpool, so the
+    statements never block the event loop.
+    """
+
+    TAKE_SQL = """
+        INSERT INTO rate_limits (key, tokens, updated_at)
+        VALUES (%(key)s, %(burst)s - %(cost)s, now())
+        ON CONFLICT (key) DO UPDATE
+        SET tokens = LEAST(%(burst)s, rate_limits.tokens + EXTRACT(EPOCH FROM now() - rate_limits.updated_at) * %(rate)s) - %(cost)s,
+            updated_at = now()
+        WHERE LEAST(%(burst)s, rate_limits.tokens + EXTRACT(EPOCH FROM now() - rate_limits.updated_at) * %(rate)s) >= %(cost)s
+        RETURNING tokens
+    """
+
+    WAIT_SQL = """
+        SELECT (%(cost)s - LEAST(%(burst)s, tokens + EXTRACT(EPOCH FROM now() - updated_at) * %(rate)s)) / %(rate)s
+        FROM rate_limits
+        WHERE key = %(key)s
+    """
+
+    def __init__(self, fallback: MemoryBackend):
+        self.fallback = fallback
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = database.connect()
+        return self._conn
+
+    def take(self, requests) -> float:
+        try:
+            with self._lock:
+                return self._take(self._connection(), requests)
+        except psycopg2.Error:
+            logger.exception("Shared rate limiter unavailable, using this worker's buckets")
+            with self._lock:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+            return self.fallback.take(requests)
+
+    def _take(self, conn, requests) -> float:
+        # One transaction, so a request rejected by one bucket spends nothing from the others
+        with conn.cursor() as cur:
+            for key, cost, limit in requests:
+                params = {"key": key, "cost": cost, "rate": limit.rate, "burst": limit.burst}
+                cur.execute(self.TAKE_SQL, params)
+                if cur.fetchone() is None:
+                    conn.rollback()
+                    cur.execute(self.WAIT_SQL, params)
+                    row = cur.fetchone()
+                    conn.rollback()
+                    return max(float(row[0]), 0.001) if row else 0.001
+        conn.commit()
+        return 0.0
+
+
+class InFlight:
+    """Requests being served by this worker, per bucket key"""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def acquire(self, requests) -> bool:
+        """Count a request against each (key, cost, limit), unless a cap is already reached"""
+        with self._lock:
+            if any(self._counts[key] >= limit.max_in_flight for key, _, limit in requests):
+                return False
+            for key, _, _ in requests:
+                self._counts[key] += 1
+            return True
+
+    def release(self, requests):
+        with self._lock:
+            for key, _, _ in requests:
+                self._counts[key] -= 1
+                if self._counts[key] <= 0:
+                    del self._counts[key]
+
+
+memory = MemoryBackend()
+backend = PostgresBackend(memory) if BACKEND == "postgres" else memory
+in_flight = InFlight()
+
+# reason ("rate" or "concurrency") -> rejected requests since start, for /metrics
+rejected = Counter()
+_rejected_lock = threading.Lock()
+
+
+def _reject(reason: str):
+    with _rejected_lock:
+        rejected[reason] += 1
+
+
+def buckets(scope, claims: dict, cost: float) -> list:
+    """(key, cost, limit) for each bucket the request spends from"""
+    requests = []
+    # A route costing more than a whole burst would never be allowed
+    gym_id = claims.get("current_gym_id")
+    if gym_id is not None:
+        requests.append((f"gym:{gym_id}", min(cost, LIMITS["gym"].burst), LIMITS["gym"]))
+    user_id = claims.get("sub")
+    if user_id is not None:
+        requests.append((f"user:{user_id}", min(cost, LIMITS["user"].burst), LIMITS["user"]))
+        return requests
+    address = client_address(scope)
+    if address is not None:
+        requests.append((f"ip:{address}", min(cost, LIMITS["anonymous"].burst), LIMITS["anonymous"]))
+    return requests
+
+
+class RateLimitMiddleware:
+    """
+    Pure ASGI middleware, added inside CORSMiddleware so browsers can read the 429
+
+    Request connections are only checked out on first use, so a rejected
+    request never takes one from the pool.
+    """
+
+    def __init__(self, app, secret_key: str, algorithm: str):
+        self.app = app
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+
+    async def _too_many(self, send, retry_after: float, detail: str):
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        cost = route_cost(scope.get("path", "")) if scope["type"] == "http" else 0
+        if not ENABLED or cost == 0:
+            await self.app(scope, receive, send)
+            return
+
+        requests = buckets(scope, token_claims(scope, self.secret_key, self.algorithm), cost)
+        if not in_flight.acquire(requests):
+            _reject("concurrency")
+            await self._too_many(send, 1, "Too many concurrent requests")
+            return
+        try:
+            if backend is memory:
+                wait = backend.take(requests)
+            else:
+                wait = await run_in_threadpool(backend.take, requests)
+            if wait:
+                _reject("rate")
+                await self._too_many(send, wait, "Rate limit exceeded")
+                return
+            await self.app(scope, receive, send)
+        finally:
+            in_flight.release(requests)
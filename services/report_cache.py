@@ -0,0 +1,228 @@
+"""
+In-memory result cache for the report endpoints
+
+Entries are keyed by (gym_id, report, period) and evicted least recently used
+first once MAX_ENTRIES is reached. Time series reports keep their closed
+buckets indefinitely and only re-query the bucket that is still open; every
+entry for a gym is dropped whenever its clients, plans or payments change.
+
+The cache is per worker. The worker that handles a write invalidates the gym
+right away, and every worker drops it again when the gymbook_changes
+notification of the write arrives through the stats hub in services/live,
+which also covers writes of other workers, the repricer and the scheduler.
+Results computed while the gym was invalidated are not stored, so a report
+that raced a write is not cached with the data from before it.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Optional
+
+MAX_ENTRIES = int(os.getenv('REPORT_CACHE_MAX_ENTRIES', '512'))
+
+
+class ReportCache:
+    """Thread safe LRU mapping of (gym_id, report, period) to cached results"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Bumped by invalidate (per gym) and clear (all gyms)
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def _generation(self, gym_id: int) -> tuple:
+        return self._epoch, self._generations.get(gym_id, 0)
+
+    def generation(self, gym_id: int) -> tuple:
+        """Token to pass to set when computing a value, see set"""
+        with self._lock:
+            return self._generation(gym_id)
+
+    def get(self, gym_id: int, report: str, period: Optional[str] = None) -> Optional[Any]:
+        key = (gym_id, report, period)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, gym_id: int, report: str, period: Optional[str], value: Any, generation: Optional[tuple] = None):
+        """
+        Store a value; with the generation taken before it was computed, only
+        if the gym has not been invalidated since
+        """
+        key = (gym_id, report, period)
+        with self._lock:
+            if generation is not None and generation != self._generation(gym_id):
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, gym_id: int):
+        """Drop every cached report of a gym"""
+        with self._lock:
+            self._generations[gym_id] = self._generations.get(gym_id, 0) + 1
+            for key in [key for key in self._entries if key[0] == gym_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._generations.clear()
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+cache = ReportCache()
+
+# (gym_id, report) -> generation when this thread's lookup missed, for store
+_pending = threading.local()
+
+
+def invalidate(gym_id: int):
+    """Called after any committed write that can change a gym's reports"""
+    cache.invalidate(gym_id)
+
+
+def bucket_start(granularity: str, day: date) -> date:
+    """Python equivalent of DATE_TRUNC for day, week, month and year"""
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    if granularity == "year":
+        return day.replace(month=1, day=1)
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+def shift_months(day: date, months: int) -> date:
+    """Add months to a date, clamping the day like Postgres interval arithmetic"""
+    month_index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(month_index, 12)
+    month += 1
+    next_month = date(year + (month == 12), month % 12 + 1, 1)
+    last_day = (next_month - timedelta(days=1)).day
+    return date(year, month, min(day.day, last_day))
+
+
+def next_bucket(granularity: str, start: date) -> date:
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "week":
+        return start + timedelta(days=7)
+    if granularity == "month":
+        return shift_months(start, 1)
+    if granularity == "year":
+        return shift_months(start, 12)
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+def day_after(day: date) -> date:
+    """Exclusive end of a range ending on day; OverflowError on the last date Python can represent"""
+    return day + timedelta(days=1)
+
+
+def bucket_count(granularity: str, start: date, end: date) -> int:
+    """Number of buckets covering [start, end), which must not be empty"""
+    first = bucket_start(granularity, start)
+    last = bucket_start(granularity, end - timedelta(days=1))
+    if granularity == "day":
+        return (last - first).days + 1
+    if granularity == "week":
+        return (last - first).days // 7 + 1
+    if granularity == "month":
+        return (last.year - first.year) * 12 + last.month - first.month + 1
+    if granularity == "year":
+        return last.year - first.year + 1
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+def lookup(gym_id: int, report: str) -> Optional[Any]:
+    """
+    Return a cached snapshot report computed today, or None
+
+    Snapshot reports (distributions, statuses) depend on CURRENT_DATE, so
+    they are only reused on the day they were computed.
+    """
+    generation = cache.generation(gym_id)
+    entry = cache.get(gym_id, report)
+    if entry is None or entry["computed_on"] != date.today():
+        if not hasattr(_pending, "generations"):
+            _pending.generations = {}
+        _pending.generations[(gym_id, report)] = generation
+        return None
+    return entry["value"]
+
+
+def store(gym_id: int, report: str, value: Any):
+    """Cache a snapshot report computed after a lookup of it missed in this thread"""
+    generation = getattr(_pending, "generations", {}).pop((gym_id, report), None)
+    cache.set(gym_id, report, None, {"computed_on": date.today(), "value": value}, generation)
+
+
+def cached_series(
+    gym_id: int,
+    report: str,
+    period: str,
+    granularity: str,
+    window_start: date,
+    window_end: date,
+    compute: Callable[[date, date], Dict[date, Any]],
+) -> Dict[date, Any]:
+    """
+    Return {bucket_start: value} for the buckets covering [window_start, window_end)
+
+    compute(start, end) must aggregate rows with start <= ts < end and return
+    every bucket in that range, including empty ones. Closed buckets come from
+    the cache; only the open bucket is re-queried, plus the oldest bucket when
+    the trailing edge of a relative window has moved into it.
+    """
+    open_from = bucket_start(granularity, date.today())
+    closed_end = max(min(window_end, open_from), window_start)
+    generation = cache.generation(gym_id)
+    entry = cache.get(gym_id, report, period)
+
+    if entry is None or entry["closed_end"] != closed_end or entry["window_start"] > window_start:
+        closed = compute(window_start, closed_end) if window_start < closed_end else {}
+    elif entry["window_start"] != window_start:
+        edge = bucket_start(granularity, window_start)
+        closed = {bucket: value for bucket, value in entry["closed"].items() if bucket > edge}
+        edge_end = min(next_bucket(granularity, edge), closed_end)
+        if window_start < edge_end:
+            closed.update(compute(window_start, edge_end))
+    else:
+        closed = entry["closed"]
+
+    cache.set(gym_id, report, period, {
+        "window_start": window_start,
+        "closed_end": closed_end,
+        "closed": closed,
+    }, generation)
+
+    series = dict(closed)
+    if window_end > closed_end:
+        series.update(compute(closed_end, window_end))
+    return series
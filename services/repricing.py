@@ -0,0 +1,198 @@
+"""
+Repricing a plan's members in the background
+
+When a plan's amount changes, its members' balance_due (plan amount minus
+total_paid) still reflects the old amount. update_plan can queue a repricing
+in plan_repricings, in the same transaction as the new amount. A worker
+thread claims it and walks the plan's members in id order, REPRICE_BATCH at
+a time. Each chunk is one short transaction that updates the chunk's rows and
+the job's progress together, so only a chunk's rows are ever locked. Each
+chunk waits at most REPRICE_LOCK_TIMEOUT for a row that the front desk is
+writing. A crashed run is picked up again from its last chunk once its lease
+expires. A newer repricing of the same plan supersedes older ones, which
+stop at their next chunk.
+
+Balances are computed from the plan's amount at the time of each chunk, so
+payments taken while a job runs stay consistent with it.
+"""
+
+import logging
+import os
+import threading
+
+import psycopg2
+import psycopg2.errors
+
+from config import database
+from services import report_cache
+
+BATCH_SIZE = int(os.getenv('REPRICE_BATCH', '1000'))
+CHUNK_PAUSE = float(os.getenv('REPRICE_CHUNK_PAUSE', '0.05'))
+LOCK_TIMEOUT = os.getenv('REPRICE_LOCK_TIMEOUT', '2s')
+LEASE_SECONDS = 60
+POLL_INTERVAL = float(os.getenv('REPRICE_POLL_INTERVAL', '30'))
+MAX_ATTEMPTS = 3
+
+# scope -> extra condition on clients c
+SCOPES = {
+    "active": "AND c.end_date >= CURRENT_DATE",
+    "all": "",
+}
+
+logger = logging.getLogger("gymbook.repricing")
+
+
+def enqueue(cur, gym_id: int, plan_id: int, scope: str) -> int:
+    """Queue a repricing in the caller's transaction, superseding unfinished ones of the plan"""
+    cur.execute("""
+        UPDATE plan_repricings SET status = 'superseded', finished_at = CURRENT_TIMESTAMP
+        WHERE gym_id = %s AND plan_id = %s AND status IN ('pending', 'running')
+    """, (gym_id, plan_id))
+    cur.execute("""
+        INSERT INTO plan_repricings (gym_id, plan_id, scope) VALUES (%s, %s, %s) RETURNING id
+    """, (gym_id, plan_id, scope))
+    return cur.fetchone()[0]
+
+
+class Repricer:
+    def __init__(self, batch_size: int = BATCH_SIZE, poll_interval: float = POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+
+    def wake(self):
+        """Start soon instead of at the next poll; called after committing a repricing"""
+        self._wake.set()
+
+    def _claim(self, cur):
+        cur.execute("""
+            UPDATE plan_repricings
+            SET status = 'running', attempts = attempts + 1,
+                started_at = COALESCE(started_at, CURRENT_TIMESTAMP),
+                locked_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+            WHERE id = (
+                SELECT id FROM plan_repricings
+                WHERE status = 'pending' OR (status = 'running' AND locked_until < CURRENT_TIMESTAMP)
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, gym_id, plan_id, scope, last_client_id, total, attempts
+        """, (LEASE_SECONDS,))
+        return cur.fetchone()
+
+    def _chunk(self, cur, job_id: int, gym_id: int, plan_id: int, scope: str, after: int):
+        """Reprice the next chunk; returns (repriced ids, whether the job is still ours)"""
+        cur.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+        cur.execute(f"""
+            UPDATE clients c
+            SET balance_due = COALESCE(p.amount, 0) - COALESCE(c.total_paid, 0)
+            FROM plans p
+            WHERE p.id = c.plan_id
+              AND c.id IN (
+                  SELECT c.id FROM clients c
+                  WHERE c.gym_id = %s AND c.plan_id = %s AND c.id > %s {SCOPES[scope]}
+                  ORDER BY c.id
+                  LIMIT %s
+              )
+            RETURNING c.id
+        """, (gym_id, plan_id, after, self.batch_size))
+        ids = [row[0] for row in cur.fetchall()]
+        cur.execute("""
+            UPDATE plan_repricings
+            SET processed = processed + %s, last_client_id = %s,
+                locked_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+            WHERE id = %s AND status = 'running'
+        """, (len(ids), max(ids, default=after), LEASE_SECONDS, job_id))
+        return ids, cur.rowcount == 1
+
+    def run_one(self) -> bool:
+        """Claim and run one repricing; returns whether there was one"""
+        if self._conn is None or self._conn.closed:
+            self._conn = database.connect()
+        conn = self._conn
+        with conn.cursor() as cur:
+            job = self._claim(cur)
+            if job is None:
+                conn.commit()
+                return False
+            job_id, gym_id, plan_id, scope, after, total, attempts = job
+            if total is None:
+                cur.execute(f"""
+                    SELECT COUNT(*) FROM clients c
+                    WHERE c.gym_id = %s AND c.plan_id = %s {SCOPES[scope]}
+                """, (gym_id, plan_id))
+                cur.execute("UPDATE plan_repricings SET total = %s WHERE id = %s", (cur.fetchone()[0], job_id))
+            conn.commit()
+
+            try:
+                while not self._stop.is_set():
+                    try:
+                        ids, ours = self._chunk(cur, job_id, gym_id, plan_id, scope, after)
+                    except psycopg2.errors.LockNotAvailable:
+                        # A member row is busy at the front desk; try the chunk again shortly
+                        conn.rollback()
+                        self._stop.wait(CHUNK_PAUSE * 10)
+                        continue
+                    if not ours:
+                        conn.rollback()
+                        logger.info("Repricing %s superseded", job_id)
+                        return True
+                    conn.commit()
+                    if len(ids) < self.batch_size:
+                        cur.execute("""
+                            UPDATE plan_repricings SET status = 'done', finished_at = CURRENT_TIMESTAMP, locked_until = NULL
+                            WHERE id = %s AND status = 'running'
+                        """, (job_id,))
+                        conn.commit()
+                        report_cache.invalidate(gym_id)
+                        return True
+                    after = max(ids)
+                    self._stop.wait(CHUNK_PAUSE)
+                # Stopping: the lease runs out and a worker resumes from the last chunk
+                return True
+            except Exception as e:
+                conn.rollback()
+                cur.execute("""
+                    UPDATE plan_repricings
+                    SET status = %s, error = %s, locked_until = NULL
+                    WHERE id = %s AND status = 'running'
+                """, ("failed" if attempts >= MAX_ATTEMPTS else "pending", str(e), job_id))
+                conn.commit()
+                raise
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_one():
+                    continue
+            except psycopg2.Error:
+                logger.exception("Repricing failed")
+                if self._conn is not None and not self._conn.closed:
+                    self._conn.close()
+            except Exception:
+                logger.exception("Repricing failed")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="plan-repricer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+repricer = Repricer()
@@ -0,0 +1,156 @@
+"""
+In-process scheduler for daily background jobs
+
+Every worker runs the scheduler thread, but a job only runs in the worker that
+wins its Postgres advisory lock, so each job runs in one place at a time.
+Completion is recorded in job_runs in the same transaction as the job's own
+writes: a run is either fully done or retried on the next poll, up to
+SCHEDULER_MAX_ATTEMPTS times per day. Per-gym jobs record one row per gym, so
+a crashed run resumes with the gyms it has not finished.
+"""
+
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from typing import Callable
+
+from config import database
+
+POLL_INTERVAL = float(os.getenv('SCHEDULER_POLL_INTERVAL', '60'))
+MAX_ATTEMPTS = int(os.getenv('SCHEDULER_MAX_ATTEMPTS', '3'))
+ENABLED = os.getenv('SCHEDULER_ENABLED', '1') != '0'
+# First key of the two-key advisory locks, to stay clear of other lock users
+LOCK_CLASS = 4711
+
+logger = logging.getLogger("gymbook.scheduler")
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable
+    at: time
+    per_gym: bool
+
+
+class Scheduler:
+    def __init__(self, poll_interval: float = POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.jobs = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+
+    def daily(self, name: str, at: str = "03:00", per_gym: bool = False):
+        """
+        Register func to run once a day after the local time at. Per-gym jobs
+        are called as func(cur, gym_id, day), the others as func(cur, day).
+        """
+        def register(func):
+            self.jobs.append(Job(name, func, time.fromisoformat(at), per_gym))
+            return func
+        return register
+
+    def _pending_targets(self, cur, job: Job, day: date) -> list:
+        done = """
+            SELECT 1 FROM job_runs r
+            WHERE r.job = %s AND r.gym_id = {gym} AND r.run_on = %s
+                AND (r.status = 'done' OR r.attempts >= %s)
+        """
+        if job.per_gym:
+            cur.execute(f"SELECT g.id FROM gyms g WHERE NOT EXISTS ({done.format(gym='g.id')}) ORDER BY g.id",
+                        (job.name, day, MAX_ATTEMPTS))
+        else:
+            cur.execute(f"SELECT 0 WHERE NOT EXISTS ({done.format(gym='0')})", (job.name, day, MAX_ATTEMPTS))
+        return [row[0] for row in cur.fetchall()]
+
+    def _record(self, cur, job: Job, gym_id: int, day: date, status: str, started_at: datetime, error=None):
+        cur.execute("""
+            INSERT INTO job_runs (job, gym_id, run_on, status, attempts, started_at, finished_at, error)
+            VALUES (%s, %s, %s, %s, 1, %s, CURRENT_TIMESTAMP, %s)
+            ON CONFLICT (job, gym_id, run_on) DO UPDATE SET
+                status = EXCLUDED.status,
+                attempts = job_runs.attempts + 1,
+                started_at = EXCLUDED.started_at,
+                finished_at = EXCLUDED.finished_at,
+                error = EXCLUDED.error
+        """, (job.name, gym_id, day, status, started_at, error))
+
+    def _run_target(self, job: Job, gym_id: int, day: date):
+        started_at = datetime.now().astimezone()
+        try:
+            with self._conn.cursor() as cur:
+                if job.per_gym:
+                    job.func(cur, gym_id, day)
+                else:
+                    job.func(cur, day)
+                self._record(cur, job, gym_id, day, "done", started_at)
+            self._conn.commit()
+        except Exception as e:
+            logger.exception(f"Job {job.name} failed for gym {gym_id}")
+            self._conn.rollback()
+            with self._conn.cursor() as cur:
+                self._record(cur, job, gym_id, day, "failed", started_at, str(e))
+            self._conn.commit()
+
+    def run_job(self, job: Job, day: date):
+        """Run job for every target not yet done on day, if this worker gets its lock"""
+        with self._conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s))", (LOCK_CLASS, job.name))
+            leader = cur.fetchone()[0]
+        self._conn.commit()
+        if not leader:
+            return
+        try:
+            with self._conn.cursor() as cur:
+                targets = self._pending_targets(cur, job, day)
+            self._conn.commit()
+            for gym_id in targets:
+                if self._stop.is_set():
+                    break
+                self._run_target(job, gym_id, day)
+        finally:
+            with self._conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s, hashtext(%s))", (LOCK_CLASS, job.name))
+            self._conn.commit()
+
+    def run_pending(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = database.connect()
+        now = datetime.now()
+        for job in self.jobs:
+            if now.time() >= job.at:
+                try:
+                    self.run_job(job, now.date())
+                except Exception:
+                    logger.exception(f"Scheduler could not run {job.name}")
+                    if not self._conn.closed:
+                        self._conn.rollback()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("Scheduler poll failed")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        if ENABLED and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+scheduler = Scheduler()
@@ -0,0 +1,140 @@
+"""
+Slow query log
+
+Every statement run through database.TimedCursor is timed; those slower than
+SLOW_QUERY_MS are logged as one JSON line on the "gymbook.slow_queries"
+logger with whitespace-normalized SQL, the calling route and only the types
+of the parameters. The slowest read-only statement of each query shape is
+re-run under EXPLAIN (ANALYZE, BUFFERS) on a separate read-only connection,
+at most once per EXPLAIN_INTERVAL seconds, and its plan is logged too, with
+the constants in its conditions and filters masked. Statements run as
+EXECUTE through database.execute_prepared are prepared again on that
+connection and explained the same way.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from config import database
+from services import metrics
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+EXPLAIN_INTERVAL = float(os.getenv('SLOW_QUERY_EXPLAIN_INTERVAL', '300'))
+
+logger = logging.getLogger("gymbook.slow_queries")
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_READ_ONLY = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_EXECUTE = re.compile(r"^\s*EXECUTE\s+(\w+)", re.IGNORECASE)
+# Plan lines holding the query's constants: "Index Cond: (gym_id = 42)", "Filter: ...".
+# Only these labels, so counters such as "Rows Removed by Filter: 1234" are kept.
+_PLAN_PREDICATE = re.compile(
+    r"^(\s*(?:->\s*)?(?:Index Cond|Recheck Cond|Hash Cond|Merge Cond|TID Cond|Join Filter|One-Time Filter|Filter"
+    r"|Sort Key|Presorted Key|Group Key|Hash Key|Cache Key):)(.*)$",
+    re.MULTILINE,
+)
+
+# normalized sql -> (slowest explained duration, time of last EXPLAIN)
+_explained = {}
+_explained_lock = threading.Lock()
+
+
+def normalize(query) -> str:
+    """Collapse whitespace and replace inline literals so equal query shapes group together"""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    query = _STRING_LITERAL.sub("?", str(query))
+    query = _NUMBER_LITERAL.sub("?", query)
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+def _redact(vars):
+    if vars is None:
+        return None
+    if isinstance(vars, dict):
+        return {key: type(value).__name__ for key, value in vars.items()}
+    return [type(value).__name__ for value in vars]
+
+
+def _should_explain(sql: str, seconds: float) -> bool:
+    """Sample the worst offenders: a new maximum for this shape, rate limited"""
+    now = time.monotonic()
+    with _explained_lock:
+        slowest, last_run = _explained.get(sql, (0.0, float("-inf")))
+        if seconds <= slowest or now - last_run < EXPLAIN_INTERVAL:
+            return False
+        _explained[sql] = (seconds, now)
+        return True
+
+
+def _as_bytes(query) -> bytes:
+    return query if isinstance(query, bytes) else str(query).encode("utf-8")
+
+
+def _prepared(query):
+    """(name, sql, param types) of an EXECUTE of a statement from execute_prepared, or None"""
+    match = _EXECUTE.match(query.decode("utf-8", "replace") if isinstance(query, bytes) else str(query))
+    if match is None or match.group(1) not in database.prepared_statements:
+        return None
+    return (match.group(1),) + database.prepared_statements[match.group(1)]
+
+
+def mask_plan(plan: str) -> str:
+    """Replace string and numeric constants in a plan's conditions, keeping its costs, rows and timings"""
+    plan = _STRING_LITERAL.sub("'?'", plan)
+    return _PLAN_PREDICATE.sub(lambda match: match.group(1) + _NUMBER_LITERAL.sub("?", match.group(2)), plan)
+
+
+def _explain(query, vars, sql: str, route):
+    conn = None
+    try:
+        conn = database.connect()
+        conn.set_session(readonly=True)
+        cur = conn.cursor()
+        prepared = _prepared(query)
+        if prepared is not None:
+            name, prepared_sql, param_types = prepared
+            cur.execute(f"PREPARE {name} ({', '.join(param_types)}) AS {prepared_sql}")
+        cur.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + _as_bytes(query), vars)
+        plan = "\n".join(row[0] for row in cur.fetchall())
+        conn.rollback()
+        logger.warning(json.dumps({
+            "event": "slow_query_plan",
+            "route": route,
+            "sql": sql,
+            "plan": mask_plan(plan),
+        }))
+    except Exception as e:
+        logger.warning(json.dumps({"event": "slow_query_plan_failed", "route": route, "sql": sql, "error": str(e)}))
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def record(query, vars, seconds):
+    """database.query_listeners hook"""
+    duration_ms = seconds * 1000
+    if duration_ms < SLOW_QUERY_MS:
+        return
+    sql = normalize(query)
+    route = metrics.current_route() or "background"
+    logger.warning(json.dumps({
+        "event": "slow_query",
+        "route": route,
+        "duration_ms": round(duration_ms, 2),
+        "sql": sql,
+        "params": _redact(vars),
+    }))
+    prepared = _prepared(query)
+    read_only = _READ_ONLY.match(prepared[1] if prepared else sql)
+    if read_only and _should_explain(sql, seconds):
+        threading.Thread(target=_explain, args=(query, vars, sql, route), daemon=True).start()
+
+
+database.query_listeners.append(record)
@@ -0,0 +1,58 @@
+"""
+Per-request tenant context
+
+Every HTTP request gets its own pooled database connection, checked out on
+first use of database.conn / database.cur and scoped to the gym in the
+request's verified JWT. Requests without a valid token get a connection that
+sees no gym's rows. The connection goes back to the pool when the response
+has been sent.
+"""
+
+import jwt
+from starlette.concurrency import run_in_threadpool
+
+from config import database
+
+
+def token_claims(scope, secret_key: str, algorithm: str) -> dict:
+    """Claims of the request's Bearer token, or {} if it has none or it is invalid"""
+    if "gymbook.claims" in scope:
+        return scope["gymbook.claims"]
+    claims = {}
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer":
+                try:
+                    claims = jwt.decode(token, secret_key, algorithms=[algorithm])
+                except jwt.InvalidTokenError:
+                    pass
+            break
+    # Decoded once per request, whichever middleware asks first
+    scope["gymbook.claims"] = claims
+    return claims
+
+
+class TenantMiddleware:
+    def __init__(self, app, secret_key: str, algorithm: str):
+        self.app = app
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+
+    def _gym_ids(self, scope) -> list:
+        gym_id = token_claims(scope, self.secret_key, self.algorithm).get("current_gym_id")
+        return [gym_id] if gym_id is not None else []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token, lease = database.begin_request(self._gym_ids(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            database.end_request(token)
+            if lease.conn is not None:
+                # Rolling back an unfinished transaction can block, so not on the event loop
+                await run_in_threadpool(lease.release)
@@ -0,0 +1,53 @@
+"""
+Tests for Accept-Encoding negotiation
+No database needed
+"""
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+# Loaded on its own, services/__init__ would import every service and connect to the database
+_spec = importlib.util.spec_from_file_location("compression", Path(__file__).parent / "services" / "compression.py")
+compression = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(compression)
+
+
+@pytest.fixture
+def gzip_only(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+
+
+@pytest.fixture
+def with_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", object())
+
+
+@pytest.mark.parametrize("header, encoding", [
+    ("gzip, deflate", "gzip"),
+    ("GZip", "gzip"),
+    ("deflate;q=1, gzip;q=0.5", "gzip"),
+    ("gzip; q=0.001", "gzip"),
+    ("gzip;q=0", None),
+    ("gzip;q=nonsense", None),
+    ("*", "gzip"),
+    ("*;q=0", None),
+    ("*, gzip;q=0", None),
+    ("identity", None),
+    ("br", None),
+    ("", None),
+])
+def test_negotiate_gzip_only(gzip_only, header, encoding):
+    assert compression.negotiate(header) == encoding
+
+
+@pytest.mark.parametrize("header, encoding", [
+    ("gzip, br", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("br, gzip;q=0.8", "br"),
+    ("br;q=0.8, gzip;q=0.8", "br"),
+    ("br;q=0, *", "gzip"),
+    ("*", "br"),
+])
+def test_negotiate_with_brotli(with_brotli, header, encoding):
+    assert compression.negotiate(header) == encoding
@@ -0,0 +1,84 @@
+"""
+Tests for the revenue forecast arithmetic, on hand-computed schedules
+No database needed
+"""
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+# Loaded on its own, services/__init__ would import every service and connect to the database
+_spec = importlib.util.spec_from_file_location("forecast", Path(__file__).parent / "services" / "forecast.py")
+forecast = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(forecast)
+
+
+def _lag(*weights):
+    """Lag distribution over 0..GRACE_DAYS days starting with weights"""
+    lag = np.zeros(forecast.GRACE_DAYS + 1)
+    lag[:len(weights)] = weights
+    return lag
+
+
+def _project(offsets, amounts, days, rates, lag, horizon):
+    return forecast.project(
+        np.array(offsets, dtype=float), np.array(amounts, dtype=float),
+        np.array(days, dtype=float), np.array(rates, dtype=float), lag, horizon,
+    )
+
+
+def test_project_single_renewals():
+    """Each member renews once on their end date with probability rate"""
+    expected, variance = _project([0, 5], [100, 50], [0, 0], [0.5, 0.8], _lag(1), horizon=10)
+    assert expected == pytest.approx([50, 0, 0, 0, 0, 40, 0, 0, 0, 0])
+    # Bernoulli: amount^2 * p * (1 - p)
+    assert variance == pytest.approx([2500, 0, 0, 0, 0, 400, 0, 0, 0, 0])
+    assert expected.sum() == pytest.approx(90)
+
+
+def test_project_repeats_short_plans_with_compounded_rate():
+    """A 3 day plan renews on days 0, 3 and 6 of a 7 day horizon"""
+    expected, variance = _project([0], [10], [3], [0.5], _lag(1), horizon=7)
+    assert expected == pytest.approx([5, 0, 0, 2.5, 0, 0, 1.25])
+    assert variance == pytest.approx([25, 0, 0, 18.75, 0, 0, 10.9375])
+
+
+def test_project_spreads_over_lag():
+    """A certain renewal split evenly between its end date and the day after"""
+    expected, variance = _project([0], [100], [0], [1.0], _lag(0.5, 0.5), horizon=3)
+    assert expected == pytest.approx([50, 50, 0])
+    assert variance == pytest.approx([2500, 2500, 0])
+
+
+def test_project_counts_members_already_past_their_end_date():
+    """Ended 3 days ago and renewing 5 days after the end date lands on day 2"""
+    expected, _ = _project([-3], [100], [0], [1.0], _lag(0, 0, 0, 0, 0, 1), horizon=4)
+    assert expected == pytest.approx([0, 0, 100, 0])
+
+
+def test_project_ignores_renewals_past_the_horizon():
+    expected, variance = _project([4], [100], [0], [1.0], _lag(1), horizon=4)
+    assert expected.sum() == 0
+    assert variance.sum() == 0
+
+
+def test_renewal_model_and_member_rates():
+    # plan 1: 3 renewed on the end date, 1 lapsed; plan 2: 4 lapsed
+    history = np.array([[1, 0, 3], [1, -1, 1], [2, -1, 4]], dtype=float)
+    plan_ids, rates, gym_rate, lag = forecast.renewal_model(history)
+
+    assert gym_rate == pytest.approx(4 / 10)
+    assert list(plan_ids) == [1, 2]
+    # Shrunk towards the gym rate with PRIOR_PERIODS periods of weight
+    assert rates == pytest.approx([(3 + 4) / 14, (0 + 4) / 14])
+    assert lag == pytest.approx(_lag(1))
+
+    members = np.array([1, 2, 3], dtype=float)
+    assert forecast.member_rates(plan_ids, rates, gym_rate, members) == pytest.approx([0.5, 2 / 7, 0.4])
+
+
+def test_member_rates_without_history():
+    rates = forecast.member_rates(np.array([]), np.array([]), 0.25, np.array([1.0, 2.0]))
+    assert rates == pytest.approx([0.25, 0.25])
@@ -0,0 +1,53 @@
+"""
+Tests for fields= validation of the list endpoints
+No database needed
+"""
+import importlib.util
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+# Loaded on its own, services/__init__ would import every service and connect to the database
+_spec = importlib.util.spec_from_file_location("projection", Path(__file__).parent / "services" / "projection.py")
+projection = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(projection)
+
+COLUMNS = {
+    "id": ("c.id", int),
+    "clientname": ("c.clientname", str),
+    "phonenumber": ("c.phonenumber", str),
+    "planname": ("p.planname", str),
+}
+
+
+@pytest.mark.parametrize("fields", [None, ""])
+def test_choose_without_fields_returns_every_column(fields):
+    assert projection.choose(COLUMNS, fields) == ["id", "clientname", "phonenumber", "planname"]
+
+
+def test_choose_keeps_column_order_and_adds_id():
+    assert projection.choose(COLUMNS, "planname, clientname") == ["id", "clientname", "planname"]
+
+
+def test_choose_ignores_blanks_and_repeats():
+    assert projection.choose(COLUMNS, "clientname,,clientname, ") == ["id", "clientname"]
+
+
+def test_choose_rejects_unknown_fields():
+    with pytest.raises(HTTPException) as error:
+        projection.choose(COLUMNS, "clientname,password,email")
+    assert error.value.status_code == 400
+    assert "Unknown fields: email, password" in error.value.detail
+
+
+def test_select_list_and_join_use():
+    names = projection.choose(COLUMNS, "phonenumber")
+    assert projection.select_list(COLUMNS, names) == "c.id, c.phonenumber"
+    assert not projection.uses(COLUMNS, names, "p")
+    assert projection.uses(COLUMNS, projection.choose(COLUMNS, "planname"), "p")
+
+
+def test_serialize():
+    names = projection.choose(COLUMNS, "clientname")
+    assert projection.serialize(COLUMNS, names, ("7", "Ann")) == {"id": 7, "clientname": "Ann"}
@@ -0,0 +1,129 @@
+"""
+Tests for the token buckets and the buckets a request spends from
+No database needed
+"""
+import importlib.util
+import ipaddress
+import sys
+import types
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+
+def _load():
+    """
+    services/rate_limit.py on its own: the services package and
+    config.database would connect to the database on import
+    """
+    database = types.ModuleType("config.database")
+    config = types.ModuleType("config")
+    config.database = database
+    tenancy = types.ModuleType("services.tenancy")
+    tenancy.token_claims = None
+    stubs = {"config": config, "config.database": database, "services.tenancy": tenancy}
+    spec = importlib.util.spec_from_file_location("rate_limit", Path(__file__).parent / "services" / "rate_limit.py")
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(sys.modules, stubs):
+        spec.loader.exec_module(module)
+    return module
+
+
+rate_limit = _load()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def backend(clock):
+    return rate_limit.MemoryBackend()
+
+
+def test_bucket_starts_full_and_waits_for_refill(backend):
+    limit = rate_limit.Limit(rate=2, burst=5, max_in_flight=1)
+    assert backend.take([("a", 5, limit)]) == 0
+    # Empty: one token takes half a second at 2 a second
+    assert backend.take([("a", 1, limit)]) == pytest.approx(0.5)
+
+
+def test_bucket_refills_at_rate(backend, clock):
+    limit = rate_limit.Limit(rate=2, burst=5, max_in_flight=1)
+    backend.take([("a", 5, limit)])
+    clock.now += 1.5
+    assert backend.take([("a", 3, limit)]) == 0
+    assert backend.take([("a", 1, limit)]) == pytest.approx(0.5)
+
+
+def test_bucket_refills_up_to_burst(backend, clock):
+    limit = rate_limit.Limit(rate=2, burst=5, max_in_flight=1)
+    backend.take([("a", 5, limit)])
+    clock.now += 60
+    assert backend.take([("a", 6, limit)]) == pytest.approx(0.5)
+    assert backend.take([("a", 5, limit)]) == 0
+
+
+def test_take_is_all_or_none(backend):
+    roomy = rate_limit.Limit(rate=1, burst=5, max_in_flight=1)
+    tight = rate_limit.Limit(rate=1, burst=1, max_in_flight=1)
+    requests = [("gym:1", 1, roomy), ("user:1", 1, tight)]
+    assert backend.take(requests) == 0
+    # The user bucket is empty, so nothing is spent from the gym's either
+    assert backend.take(requests) == pytest.approx(1)
+    assert backend.take([("gym:1", 4, roomy)]) == 0
+
+
+def test_idle_buckets_are_dropped(backend, clock):
+    limit = rate_limit.Limit(rate=1, burst=5, max_in_flight=1)
+    backend.take([("a", 5, limit)])
+    clock.now += backend.IDLE_SECONDS + 1
+    backend.take([("b", 1, limit)])
+    assert "a" not in backend._buckets
+
+
+def test_route_cost():
+    assert rate_limit.route_cost("/exports/clients") == 20
+    assert rate_limit.route_cost("/reports/revenue") == 5
+    assert rate_limit.route_cost("/dashboard/stream") == 0
+    assert rate_limit.route_cost("/clients") == 1
+
+
+def _scope(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return {"client": (peer, 50000), "headers": headers}
+
+
+def test_buckets_of_an_authenticated_request():
+    requests = rate_limit.buckets(_scope("10.0.0.1"), {"current_gym_id": 3, "sub": "8"}, 5)
+    assert [(key, cost) for key, cost, _ in requests] == [("gym:3", 5), ("user:8", 5)]
+    assert requests[1][2] is rate_limit.LIMITS["user"]
+
+
+def test_buckets_of_an_anonymous_request(monkeypatch):
+    monkeypatch.setattr(rate_limit, "TRUSTED_PROXIES", [])
+    requests = rate_limit.buckets(_scope("203.0.113.9", "198.51.100.1"), {}, 1)
+    # X-Forwarded-For from an untrusted peer is ignored
+    assert [(key, cost) for key, cost, _ in requests] == [("ip:203.0.113.9", 1)]
+    assert requests[0][2] is rate_limit.LIMITS["anonymous"]
+
+
+def test_client_address_behind_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(rate_limit, "TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+    # The leftmost entry is whatever the client sent; the rightmost untrusted hop is the client
+    scope = _scope("10.0.0.1", "192.0.2.66, 198.51.100.1, 10.0.0.2")
+    assert rate_limit.client_address(scope) == "198.51.100.1"
+    assert rate_limit.client_address(_scope("10.0.0.1")) == "10.0.0.1"
+    assert rate_limit.client_address({"headers": []}) is None
@@ -0,0 +1,75 @@
+"""
+Tests for masking the constants of logged EXPLAIN plans
+No database needed
+"""
+import importlib.util
+import sys
+import types
+from pathlib import Path
+from unittest import mock
+
+
+def _load():
+    """
+    services/slow_queries.py on its own: the services package and
+    config.database would connect to the database on import
+    """
+    config = types.ModuleType("config")
+    config.database = types.ModuleType("config.database")
+    config.database.query_listeners = []
+    services = types.ModuleType("services")
+    services.metrics = types.ModuleType("services.metrics")
+    stubs = {
+        "config": config,
+        "config.database": config.database,
+        "services": services,
+        "services.metrics": services.metrics,
+    }
+    spec = importlib.util.spec_from_file_location("slow_queries", Path(__file__).parent / "services" / "slow_queries.py")
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(sys.modules, stubs):
+        spec.loader.exec_module(module)
+    return module
+
+
+slow_queries = _load()
+
+PLAN = """\
+Nested Loop  (cost=0.42..16.47 rows=1 width=40) (actual time=0.031..0.035 rows=1 loops=1)
+  Join Filter: (p.amount > 100.50)
+  Rows Removed by Join Filter: 17
+  ->  Index Scan using idx_clients_gym on clients c  (cost=0.42..8.44 rows=1 width=36)
+        Index Cond: (gym_id = 42)
+        Filter: ((phonenumber)::text = '5550100'::text)
+        Rows Removed by Filter: 1234
+  ->  Bitmap Heap Scan on payments p  (cost=4.17..8.01 rows=3 width=8)
+        Recheck Cond: (client_id = 7)
+        Rows Removed by Index Recheck: 9
+  ->  Sort  (cost=1.01..1.02 rows=3 width=8)
+        Sort Key: (date_trunc('month'::text, paid_at))
+Planning Time: 0.210 ms
+Execution Time: 0.080 ms"""
+
+
+def test_mask_plan_masks_predicate_constants():
+    masked = slow_queries.mask_plan(PLAN)
+    assert "Join Filter: (p.amount > ?)" in masked
+    assert "Index Cond: (gym_id = ?)" in masked
+    assert "Filter: ((phonenumber)::text = '?'::text)" in masked
+    assert "Recheck Cond: (client_id = ?)" in masked
+    assert "Sort Key: (date_trunc('?'::text, paid_at))" in masked
+    assert "5550100" not in masked and "= 42" not in masked
+
+
+def test_mask_plan_keeps_counters_costs_and_timings():
+    masked = slow_queries.mask_plan(PLAN)
+    assert "Rows Removed by Filter: 1234" in masked
+    assert "Rows Removed by Join Filter: 17" in masked
+    assert "Rows Removed by Index Recheck: 9" in masked
+    assert "(cost=0.42..16.47 rows=1 width=40) (actual time=0.031..0.035 rows=1 loops=1)" in masked
+    assert "Execution Time: 0.080 ms" in masked
+
+
+def test_normalize_groups_query_shapes():
+    assert slow_queries.normalize("SELECT *  FROM clients\n WHERE id = 42 AND name = 'Ann'") == \
+        "SELECT * FROM clients WHERE id = ? AND name = ?"
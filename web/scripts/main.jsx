@@ -473,6 +473,68 @@ function App() {
         }
     }, [isLoggedIn]);
 
+    // Live dashboard stats: one stream instead of re-polling /dashboard/stats
+    useEffect(() => {
+        if (!isLoggedIn || onboardingStep !== 3 || !localStorage.getItem('token') || !window.EventSource) {
+            return;
+        }
+        let source = null;
+        let retry = null;
+        let closed = false;
+        const listen = (source) => {
+            source.addEventListener('snapshot', (event) => {
+                setDashboardStats(JSON.parse(event.data));
+            });
+            source.addEventListener('delta', async (event) => {
+                const delta = JSON.parse(event.data);
+                setDashboardStats(prev => ({ ...prev, ...delta }));
+                try {
+                    if ('due_members' in delta || 'total_balance_due' in delta) {
+                        const dueMembersData = await apiCall('/dashboard/due_members');
+                        setDueMembers(dueMembersData.due_members || []);
+                    }
+                    if ('birthdays_today' in delta) {
+                        const birthdayData = await apiCall('/clients/birthdays/today');
+                        setBirthdayClients(birthdayData.clients || []);
+                    }
+                } catch (err) {
+                    console.error('Live update error:', err);
+                }
+            });
+        };
+        // The API token stays out of the URL; a one-minute stream ticket is used instead
+        const connect = async () => {
+            try {
+                const { ticket } = await apiCall('/dashboard/stream/ticket', { method: 'POST' });
+                if (closed) {
+                    return;
+                }
+                source = new EventSource(`${API_BASE_URL}/dashboard/stream?ticket=${encodeURIComponent(ticket)}`);
+                listen(source);
+                // A ticket is only good for connecting; reconnect with a fresh one
+                source.onerror = () => {
+                    source.close();
+                    if (!closed) {
+                        retry = setTimeout(connect, 5000);
+                    }
+                };
+            } catch (err) {
+                console.error('Live stream error:', err);
+                if (!closed) {
+                    retry = setTimeout(connect, 30000);
+                }
+            }
+        };
+        connect();
+        return () => {
+            closed = true;
+            clearTimeout(retry);
+            if (source) {
+                source.close();
+            }
+        };
+    }, [isLoggedIn, onboardingStep]);
+
     // Handle login
     const handleLogin = (userData) => {
         setIsLoggedIn(true);